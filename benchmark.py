@@ -0,0 +1,395 @@
+"""
+Benchmarks for the nesting / G-code pipeline.
+
+Usage:
+    python benchmark.py nesting [--pieces 20000] [--types 40]
+    python benchmark.py anneal [--pieces 200] [--types 30] [--budget 10]
+    python benchmark.py toolpath [--pieces 2000] [--types 20]
+    python benchmark.py detect [--dpi 150 300 600] [--tile 1024] [--coarse 4]
+    python benchmark.py merge [--segments 20000]
+    python benchmark.py pdf [--pages 200]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+
+import fitz
+import numpy as np
+
+from nesting_engine import calculate_nesting_layout, iter_nesting_plates, summarize_plates, ENGINES
+from nesting_optimizer import iter_annealed_plates
+from toolpath import merge_collinear_cuts
+from cycle_time import estimate_cut_time, format_duration
+from image_processor import detect_lines, merge_lines, DETECT_METHODS
+from pdf_loader import load_pdf_image, extract_vector_lines, read_pdf_pages, read_pdf_report
+
+
+def random_parts(n_types, n_pieces, plate_w, plate_h, seed=0, scale=1.0):
+    """
+    Builds a random parts list with n_types part types and about n_pieces pieces.
+    scale multiplies the part sizes (1 to 8% of the plate length, 0.5 to 4% of its width).
+    """
+    rng = random.Random(seed)
+    parts_list = []
+    per_type = max(1, n_pieces // n_types)
+    for _ in range(n_types):
+        parts_list.append({
+            'length': round(rng.uniform(plate_w * 0.01, plate_w * 0.08) * scale, 1),
+            'width': round(rng.uniform(plate_h * 0.005, plate_h * 0.04) * scale, 1),
+            'quantity': per_type,
+        })
+    return parts_list
+
+
+def timed(func, *args, repeat=3, **kwargs):
+    """
+    Runs func several times and returns (best seconds, last result).
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        # Engines print skipped parts; keep that out of the timing and the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = func(*args, **kwargs)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best, result
+
+
+def nest_job(plate_w, plate_h, parts_list, engine):
+    """
+    Nests the whole parts list over as many plates as it needs.
+    """
+    return list(iter_nesting_plates(plate_w, plate_h, parts_list, engine=engine))
+
+
+def bench_nesting(args):
+    plate_w, plate_h = args.plate_w, args.plate_h
+    parts_list = random_parts(args.types, args.pieces, plate_w, plate_h, seed=args.seed)
+    total = sum(p['quantity'] for p in parts_list)
+
+    print(f"Plate {plate_w} x {plate_h}, {len(parts_list)} part types, {total} pieces")
+    print(f"{'engine':<12}{'time (s)':>10}{'plates':>8}{'placed':>10}{'yield %':>10}")
+    for engine in ENGINES:
+        dt, plates = timed(nest_job, plate_w, plate_h, parts_list, engine, repeat=args.repeat)
+        summary = summarize_plates(plates, parts_list)
+        util = 100.0 * summary['mean_utilization']
+        print(f"{engine:<12}{dt:>10.3f}{summary['plate_count']:>8}"
+              f"{summary['parts_placed']:>10}{util:>10.2f}")
+
+
+def bench_anneal(args):
+    plate_w, plate_h = args.plate_w, args.plate_h
+    parts_list = random_parts(args.types, args.pieces, plate_w, plate_h, seed=args.seed, scale=args.scale)
+    total = sum(p['quantity'] for p in parts_list)
+
+    print(f"Plate {plate_w} x {plate_h}, {len(parts_list)} part types, {total} pieces, {args.budget}s budget")
+    print(f"{'packer':<12}{'time (s)':>10}{'plates':>8}{'placed':>10}{'yield %':>10}{'last %':>8}")
+    runs = (("column", lambda: nest_job(plate_w, plate_h, parts_list, 'column')),
+            ("annealed", lambda: list(iter_annealed_plates(plate_w, plate_h, parts_list,
+                                                           time_budget=args.budget, seed=args.seed))))
+    for name, run in runs:
+        dt, plates = timed(run, repeat=1)
+        summary = summarize_plates(plates, parts_list)
+        util = 100.0 * summary['mean_utilization']
+        last = 100.0 * summary['utilization'][-1] if plates else 0.0
+        print(f"{name:<12}{dt:>10.3f}{summary['plate_count']:>8}"
+              f"{summary['parts_placed']:>10}{util:>10.2f}{last:>8.1f}")
+
+
+def bench_toolpath(args):
+    plate_w, plate_h = args.plate_w, args.plate_h
+    parts_list = random_parts(args.types, args.pieces, plate_w, plate_h, seed=args.seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+        layout = calculate_nesting_layout(plate_w, plate_h, parts_list)
+    merged_v, merged_h, _ = merge_collinear_cuts(layout.v_cuts, layout.h_cuts)
+
+    print(f"Plate {plate_w} x {plate_h}, {len(layout.rects)} parts placed")
+    print(f"{'toolpath':<18}{'cuts':>8}{'rapid (mm)':>14}{'machine time':>16}{'estimate (s)':>14}")
+    for name, v, h, order in (("layout order", layout.v_cuts, layout.h_cuts, False),
+                              ("merged", merged_v, merged_h, False),
+                              ("merged + ordered", merged_v, merged_h, True)):
+        dt, report = timed(estimate_cut_time, v, h, optimize_order=order, repeat=args.repeat)
+        print(f"{name:<18}{report['cuts']:>8}{report['rapid_distance']:>14.0f}"
+              f"{format_duration(report['total']):>16}{dt:>14.3f}")
+
+
+def synthetic_drawing(path, pieces=300, types=12, seed=0, page_size=(842, 595), margin=36):
+    """
+    Writes a one page PDF nesting drawing (plate border, cut lines and a
+    size label per part) and returns its ground truth cut lines in points,
+    top-left origin: (v_lines, h_lines).
+    """
+    plate_w, plate_h = 2400.0, 1200.0
+    parts_list = random_parts(types, pieces, plate_w, plate_h, seed=seed)
+    for p in parts_list:
+        p['length'] *= 3
+        p['width'] *= 3
+    with contextlib.redirect_stdout(io.StringIO()):
+        layout = calculate_nesting_layout(plate_w, plate_h, parts_list)
+    v_cuts, h_cuts, _ = merge_collinear_cuts(layout.v_cuts, layout.h_cuts)
+
+    k = min((page_size[0] - 2 * margin) / plate_w, (page_size[1] - 2 * margin) / plate_h)
+
+    def to_page(lines):
+        out = np.array(lines, dtype=np.float64).reshape(-1, 4) * k
+        out[:, [0, 2]] += margin
+        out[:, [1, 3]] = margin + plate_h * k - out[:, [1, 3]]
+        return out
+
+    border_v = [[0, 0, 0, plate_h], [plate_w, 0, plate_w, plate_h]]
+    border_h = [[0, 0, plate_w, 0], [0, plate_h, plate_w, plate_h]]
+    v_lines = to_page(np.vstack((border_v, v_cuts)))
+    h_lines = to_page(np.vstack((border_h, h_cuts)))
+
+    doc = fitz.open()
+    page = doc.new_page(width=page_size[0], height=page_size[1])
+    for x1, y1, x2, y2 in np.vstack((v_lines, h_lines)).tolist():
+        page.draw_line((x1, y1), (x2, y2), width=0.8)
+    for x, y, w, h in layout.rects.tolist():
+        cx, cy = to_page([[x + w / 2, y + h / 2, 0, 0]])[0, :2]
+        page.insert_text((cx - 8, cy + 2), f"{w:.0f}x{h:.0f}", fontsize=4)
+    doc.save(path)
+    doc.close()
+    return v_lines, h_lines
+
+
+def match_lines(found, truth, axis, tol=3.0, extent_tol=10.0):
+    """
+    Greedy one-to-one matching of detected lines to ground truth lines of one
+    orientation (axis 0: vertical). Returns (matches, mean position error).
+    """
+    pos, lo, hi = (0, 1, 3) if axis == 0 else (1, 0, 2)
+    found = np.array(found, dtype=np.float64).reshape(-1, 4)
+    used = np.zeros(len(found), dtype=bool)
+    errors = []
+    for t in np.asarray(truth, dtype=np.float64).reshape(-1, 4):
+        d = np.abs(found[:, pos] - t[pos])
+        ok = ~used & (d <= tol) & (np.abs(found[:, lo] - t[lo]) <= extent_tol) \
+            & (np.abs(found[:, hi] - t[hi]) <= extent_tol)
+        if ok.any():
+            i = np.flatnonzero(ok)[np.argmin(d[ok])]
+            used[i] = True
+            errors.append(d[i])
+    return len(errors), (float(np.mean(errors)) if errors else 0.0)
+
+
+def bench_detect(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "drawing.pdf")
+        truth_v, truth_h = synthetic_drawing(path, args.pieces, args.types, seed=args.seed)
+        for dpi in args.dpi:
+            render_dt, img = timed(load_pdf_image, path, dpi=dpi, repeat=args.repeat)
+            gray_dt, gray = timed(load_pdf_image, path, dpi=dpi, gray=True, repeat=args.repeat)
+            k = dpi / 72.0
+            # Same post-processing as the detector output
+            tv = merge_lines(np.rint(truth_v * k).astype(int).tolist(), 'vertical')
+            th = merge_lines(np.rint(truth_h * k).astype(int).tolist(), 'horizontal')
+
+            print(f"{dpi} DPI, {img.shape[1]}x{img.shape[0]} px (render BGR {render_dt:.3f} s / "
+                  f"{img.nbytes >> 20} MB, gray {gray_dt:.3f} s / {gray.nbytes >> 20} MB), "
+                  f"truth: {len(tv)} V / {len(th)} H lines")
+            print(f"{'method':<20}{'time (s)':>10}{'V':>6}{'H':>6}{'recall %':>10}{'precision %':>13}{'err px':>8}")
+
+            def report(name, dt, v, h, tv=tv, th=th):
+                mv, ev = match_lines(v, tv, 0)
+                mh, eh = match_lines(h, th, 1)
+                found = len(v) + len(h)
+                matched = mv + mh
+                err = (ev * mv + eh * mh) / matched if matched else 0.0
+                print(f"{name:<20}{dt:>10.3f}{len(v):>6}{len(h):>6}"
+                      f"{100.0 * matched / max(1, len(tv) + len(th)):>10.1f}"
+                      f"{100.0 * matched / max(1, found):>13.1f}{err:>8.2f}")
+
+            results = {}
+            runs = [(method, method, {}) for method in DETECT_METHODS]
+            runs += [(method + "/gray", method, {'image': gray}) for method in DETECT_METHODS]
+            if args.tile:
+                runs += [(method + "/tiled", method, {'tile_size': args.tile}) for method in DETECT_METHODS]
+            if args.coarse:
+                runs += [(f"{method}/coarse{args.coarse}", method, {'coarse': args.coarse}) for method in DETECT_METHODS]
+            for name, method, options in runs:
+                options = dict(options)
+                dt, (v, h) = timed(detect_lines, options.pop('image', img), method=method, repeat=args.repeat,
+                                   **options)
+                results[name] = (v, h)
+                report(name, dt, v, h)
+
+            # No rendering at all: the drawing's own lines, scaled to this DPI.
+            # Checked against the exact cuts, it doesn't join separate lines at the same x / y
+            dt, (v, h, _, _) = timed(extract_vector_lines, path, repeat=args.repeat)
+            exact_v, exact_h, _ = merge_collinear_cuts(truth_v, truth_h, tol=0.5)
+            report("vector (no render)", dt, v * k, h * k, exact_v * k, exact_h * k)
+
+            # Agreement of the two detectors with each other
+            (hv, hh), (pv, ph) = results['hough'], results['projection']
+            agree = match_lines(pv, hv, 0)[0] + match_lines(ph, hh, 1)[0]
+            print(f"projection vs hough: {agree}/{len(hv) + len(hh)} hough lines matched")
+
+
+def merge_lines_python(lines, orientation, tolerance=10):
+    """
+    Pure Python merge_lines / average_lines (before vectorization), the
+    reference for bench_merge.
+    """
+    if not lines:
+        return []
+    idx = 0 if orientation == 'vertical' else 1
+    lines = sorted(lines, key=lambda l: l[idx])
+    groups = [[lines[0]]]
+    for line in lines[1:]:
+        if abs(line[idx] - groups[-1][-1][idx]) < tolerance:
+            groups[-1].append(line)
+        else:
+            groups.append([line])
+
+    merged = []
+    for group in groups:
+        x1s, y1s, x2s, y2s = ([l[k] for l in group] for k in range(4))
+        if orientation == 'vertical':
+            avg_x = int((sum(x1s) + sum(x2s)) / (2 * len(group)))
+            merged.append([avg_x, min(min(y1s), min(y2s)), avg_x, max(max(y1s), max(y2s))])
+        else:
+            avg_y = int((sum(y1s) + sum(y2s)) / (2 * len(group)))
+            merged.append([min(min(x1s), min(x2s)), avg_y, max(max(x1s), max(x2s)), avg_y])
+    return merged
+
+
+def noisy_segments(n, positions, extent, seed=0):
+    """
+    n short vertical Hough-like segments [x1, y1, x2, y2] scattered around
+    the given x positions (a few px of jitter), as from a noisy scan.
+    """
+    rng = np.random.default_rng(seed)
+    x = rng.choice(positions, n) + rng.integers(-3, 4, n)
+    y1 = rng.integers(0, extent - 60, n)
+    y2 = y1 + rng.integers(50, 60, n)
+    return np.column_stack((x, y1, x + rng.integers(-2, 3, n), y2)).astype(np.int32)
+
+
+def bench_merge(args):
+    rng = np.random.default_rng(args.seed)
+    positions = np.sort(rng.choice(args.extent, args.positions, replace=False))
+    segments = noisy_segments(args.segments, positions, args.extent, seed=args.seed)
+    as_lists = segments.tolist()
+
+    print(f"{args.segments} segments around {args.positions} lines")
+    print(f"{'merge_lines':<12}{'time (s)':>10}{'lines':>8}")
+    dt_py, ref = timed(merge_lines_python, as_lists, 'vertical', repeat=args.repeat)
+    print(f"{'python':<12}{dt_py:>10.4f}{len(ref):>8}")
+    for name, lines in (("numpy", segments), ("numpy/list", as_lists)):
+        dt, result = timed(merge_lines, lines, 'vertical', repeat=args.repeat)
+        same = "identical" if result == ref else "DIFFERENT"
+        print(f"{name:<12}{dt:>10.4f}{len(result):>8}  {same}, {dt_py / dt:.0f}x")
+
+
+def synthetic_report(path, pages=200, rows=40, seed=0):
+    """
+    Writes a multi-page nesting report: plate header on the first page, a
+    parts table continuing over all pages and a few cut lines per page.
+    Returns the expected merged parts table as {(length, width): quantity}.
+    """
+    rng = random.Random(seed)
+    sizes = [(float(rng.randint(300, 900)), float(rng.randint(80, 290))) for _ in range(25)]
+    expected = {}
+    doc = fitz.open()
+    for page_no in range(pages):
+        page = doc.new_page(width=595, height=842)
+        if page_no == 0:
+            page.insert_text((40, 40), "W : 1220  L : 2440", fontsize=10)
+        for r in range(rows):
+            l, w = rng.choice(sizes)
+            expected[(l, w)] = expected.get((l, w), 0) + 1
+            page.insert_text((40, 70 + 18 * r), f"절단 {page_no * rows + r + 1} A {l:.0f} {w:.0f}",
+                             fontsize=9, fontname="korea")
+        for k in range(5):
+            page.draw_line((300, 80 + 100 * k), (560, 80 + 100 * k), width=0.8)
+    doc.save(path)
+    doc.close()
+    return expected
+
+
+def bench_pdf(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "report.pdf")
+        expected = synthetic_report(path, args.pages)
+        workers = args.workers or os.cpu_count() or 1
+        print(f"{args.pages} page report, {workers} worker(s)")
+        print(f"{'read':<28}{'time (s)':>10}{'pages/s':>10}")
+        for name, n in (("report, 1 process", 1), (f"report, {workers} processes", workers)):
+            dt, report = timed(read_pdf_report, path, max_workers=n, repeat=args.repeat)
+            ok = {(p['length'], p['width']): p['quantity'] for p in report['parts']} == expected
+            print(f"{name:<28}{dt:>10.3f}{args.pages / dt:>10.0f}  {'tables OK' if ok else 'tables WRONG'}")
+        for name, n in (("render 100 DPI, 1 process", 1), (f"render 100 DPI, {workers} proc.", workers)):
+            dt, _ = timed(lambda: sum(1 for _ in read_pdf_pages(path, ('image',), dpi=100, max_workers=n)),
+                          repeat=args.repeat)
+            print(f"{name:<28}{dt:>10.3f}{args.pages / dt:>10.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nesting Software Benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("nesting", help="Column vs Guillotine engine (runtime and yield)")
+    p.add_argument("--pieces", type=int, default=20000)
+    p.add_argument("--types", type=int, default=40)
+    p.add_argument("--plate-w", type=float, default=12000)
+    p.add_argument("--plate-h", type=float, default=6000)
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_nesting)
+
+    p = sub.add_parser("anneal", help="Annealed part order vs plain Column Packing (plates and yield)")
+    p.add_argument("--pieces", type=int, default=200)
+    p.add_argument("--types", type=int, default=30)
+    p.add_argument("--scale", type=float, default=10.0)
+    p.add_argument("--budget", type=float, default=10.0)
+    p.add_argument("--plate-w", type=float, default=6000)
+    p.add_argument("--plate-h", type=float, default=3000)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_anneal)
+
+    p = sub.add_parser("toolpath", help="Machine time of layout order vs merged / ordered cuts")
+    p.add_argument("--pieces", type=int, default=2000)
+    p.add_argument("--types", type=int, default=20)
+    p.add_argument("--plate-w", type=float, default=12000)
+    p.add_argument("--plate-h", type=float, default=6000)
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_toolpath)
+
+    p = sub.add_parser("detect", help="Hough vs projection vs vector line detection (runtime and accuracy)")
+    p.add_argument("--dpi", type=int, nargs="+", default=[300])
+    p.add_argument("--pieces", type=int, default=300)
+    p.add_argument("--types", type=int, default=12)
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--tile", type=int, help="Also run the tiled detectors with this tile size")
+    p.add_argument("--coarse", type=int, help="Also run coarse-to-fine detection with this downscale factor")
+    p.set_defaults(func=bench_detect)
+
+    p = sub.add_parser("merge", help="NumPy vs pure Python merge_lines")
+    p.add_argument("--segments", type=int, default=20000)
+    p.add_argument("--positions", type=int, default=200)
+    p.add_argument("--extent", type=int, default=7000)
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_merge)
+
+    p = sub.add_parser("pdf", help="Multi-page report import, one process vs a process pool")
+    p.add_argument("--pages", type=int, default=200)
+    p.add_argument("--workers", type=int, help="Worker processes (default: all cores)")
+    p.add_argument("--repeat", type=int, default=1)
+    p.set_defaults(func=bench_pdf)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
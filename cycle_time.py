@@ -0,0 +1,649 @@
+"""
+Machine cycle-time estimation for the generated G-code.
+
+Usage:
+    python cycle_time.py output.nc [--rapid 15000] [--accel 1000]
+"""
+import argparse
+import os
+import re
+import warnings
+
+import numpy as np
+
+from toolpath import order_toolpath, _as_rows
+
+MM_PER_INCH = 25.4
+
+# Machine limits in mm and seconds, whatever unit the program uses
+DEFAULT_MACHINE = {
+    'rapid_rate': 15000.0,  # G0 speed (mm/min)
+    'max_feed': 15000.0,    # G1 feeds above this are clamped (mm/min)
+    'accel': 1000.0,        # Acceleration / deceleration (mm/s^2)
+    'm3_dwell': 0.5,        # Cut On: spindle / torch start (s)
+    'm5_dwell': 0.2,        # Cut Off (s)
+}
+
+_WORD = re.compile(r'([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))')
+_PASS = re.compile(r'\(---\s*(.*?)\s*---\)')
+_COMMENT = re.compile(r'\(.*?\)|;.*')
+
+
+def machine_profile(**overrides):
+    """
+    DEFAULT_MACHINE with some values replaced (None values are ignored).
+    """
+    machine = dict(DEFAULT_MACHINE)
+    machine.update({k: v for k, v in overrides.items() if v is not None})
+    return machine
+
+
+class _Program:
+    """
+    Moves of a parsed program as growing lists, turned into arrays by arrays().
+    Coordinates and feeds are stored in mm.
+    """
+
+    def __init__(self):
+        self.coords = []  # x0, y0, z0, x1, y1, z1 per move
+        self.rapid = []
+        self.feed = []
+        self.pass_id = []
+        self.cutting = []
+        self.blocks = []  # Move arrays of the vectorized parser, instead of the lists
+        self.passes = ["Setup"]
+        self.m3 = [0]
+        self.m5 = [0]
+        self.dwell = [0.0]
+
+    def new_pass(self, name):
+        self.passes.append(name)
+        self.m3.append(0)
+        self.m5.append(0)
+        self.dwell.append(0.0)
+
+    def arrays(self):
+        if self.blocks:
+            start, end, rapid, feed, pass_id, cutting = (np.concatenate(a) for a in zip(*self.blocks))
+        else:
+            coords = np.array(self.coords, dtype=np.float64).reshape(-1, 6)
+            start, end = coords[:, 0:3], coords[:, 3:6]
+            rapid = np.array(self.rapid, dtype=bool)
+            feed = np.array(self.feed, dtype=np.float64)
+            pass_id = np.array(self.pass_id, dtype=np.int64)
+            cutting = np.array(self.cutting, dtype=bool)
+        return {
+            'start': start,
+            'end': end,
+            'rapid': rapid,
+            'feed': feed,
+            'pass_id': pass_id,
+            'cutting': cutting,
+            'passes': list(self.passes),
+            'm3': np.array(self.m3),
+            'm5': np.array(self.m5),
+            'dwell': np.array(self.dwell, dtype=np.float64),
+        }
+
+
+def _source_lines(source):
+    """
+    Lines of a G-code file path, program string or iterable of lines.
+    """
+    if isinstance(source, str):
+        if "\n" not in source and os.path.exists(source):
+            with open(source) as f:
+                for line in f:
+                    yield line
+            return
+        source = source.splitlines()
+    for line in source:
+        yield line
+
+
+def _words(line):
+    """
+    (letter, value) pairs of a line without comments. Space separated words
+    are split directly, anything else goes through the regex.
+    """
+    line = line.upper()
+    try:
+        return [(w[0], float(w[1:])) for w in line.split()]
+    except ValueError:
+        return [(letter, float(value)) for letter, value in _WORD.findall(line)]
+
+
+def _split_programs(source):
+    """
+    Main program lines and {number: lines} of the O-word subprograms that
+    follow it (as written by generate_gcode with subprograms).
+    """
+    main = []
+    subs = {}
+    current = main
+    seen_main = False
+    for raw in _source_lines(source):
+        head = raw.lstrip()[:1].upper()
+        if head == 'O':
+            m = _WORD.match(raw.lstrip().upper())
+            if m and seen_main:
+                current = subs.setdefault(int(float(m.group(2))), [])
+                continue
+            seen_main = True
+        current.append(raw)
+    return main, subs
+
+
+class _Interpreter:
+    """
+    Modal controller state while parsing, with M98 subprogram calls and
+    G52 local offsets.
+    """
+
+    def __init__(self, subs):
+        self.prog = _Program()
+        self.subs = subs
+        self.pos = [0.0, 0.0, 0.0]
+        self.offset = [0.0, 0.0, 0.0]
+        self.scale = 1.0      # mm per program unit
+        self.absolute = True
+        self.motion = None    # 0 rapid, 1 feed
+        self.feed = 0.0       # mm/min
+        self.cutting = False  # Between M3 and M5
+        self.current = 0
+
+    def run(self, lines, depth=0):
+        """
+        Runs lines until M99 / M30 / M2 or their end. Returns False once the
+        program has ended (M30 / M2).
+        """
+        prog = self.prog
+        for raw in lines:
+            if '(' in raw or ';' in raw:
+                m = _PASS.search(raw)
+                if m:
+                    prog.new_pass(m.group(1))
+                    self.current = len(prog.passes) - 1
+                    continue
+                raw = _COMMENT.sub("", raw)
+
+            words = _words(raw)
+            if not words:
+                continue
+
+            target = {}
+            dwell_p = None
+            local = False
+            call = None
+            repeat = 1
+            for letter, value in words:
+                if letter == 'G':
+                    code = value
+                    if code in (0, 1):
+                        self.motion = int(code)
+                    elif code == 20:
+                        self.scale = MM_PER_INCH
+                    elif code == 21:
+                        self.scale = 1.0
+                    elif code == 90:
+                        self.absolute = True
+                    elif code == 91:
+                        self.absolute = False
+                    elif code == 4:
+                        # Dwell, P seconds. Not modal: the motion mode stays
+                        dwell_p = 0.0
+                    elif code == 52:
+                        # Local coordinate system: X Y Z are the new origin
+                        local = True
+                elif letter == 'M':
+                    code = int(value)
+                    if code in (3, 4):
+                        prog.m3[self.current] += 1
+                        self.cutting = True
+                    elif code == 5:
+                        prog.m5[self.current] += 1
+                        self.cutting = False
+                    elif code == 98:
+                        call = -1
+                    elif code == 99 and depth > 0:
+                        return True
+                    elif code in (2, 30):
+                        return False
+                elif letter == 'F':
+                    self.feed = value * self.scale
+                elif letter == 'P' and dwell_p is not None:
+                    dwell_p = value
+                elif letter == 'P' and call is not None:
+                    call = int(value)
+                elif letter == 'L':
+                    repeat = int(value)
+                elif letter in 'XYZ':
+                    target['XYZ'.index(letter)] = value * self.scale
+
+            if dwell_p is not None:
+                prog.dwell[self.current] += dwell_p
+                continue
+            if local:
+                for axis, value in target.items():
+                    self.offset[axis] = value
+                continue
+            if call is not None:
+                body = self.subs.get(call)
+                if body is None:
+                    print(f"Subprogram O{call} not found, call skipped")
+                    continue
+                for _ in range(repeat):
+                    if not self.run(body, depth + 1):
+                        return False
+                continue
+            if not target or self.motion is None:
+                continue
+
+            pos = self.pos
+            new = list(pos)
+            for axis, value in target.items():
+                new[axis] = value + self.offset[axis] if self.absolute else pos[axis] + value
+            prog.coords.append(pos + new)
+            prog.rapid.append(self.motion == 0)
+            prog.feed.append(self.feed)
+            prog.pass_id.append(self.current)
+            prog.cutting.append(self.cutting)
+            self.pos = new
+        return True
+
+
+# Fast parser: letters become spaces so np.fromstring reads every value in one go,
+# and a second pass keeps only the letters, which then line up with the values.
+_VALUE_TABLE = bytes.maketrans(b"ABCDEFGHIJKLMNOPQRSTUVWXYZ%\r\t", b" " * 29)
+_LETTER_DELETE = b"0123456789.-+ \t\r%"
+_PASS_B = re.compile(rb'\(---\s*(.*?)\s*---\)')
+_COMMENT_B = re.compile(rb'\([^)\n]*\)|;[^\n]*')
+_PAREN_B = re.compile(rb'\([^)\n]*\)')
+_NEWLINE = ord("\n")
+# Words the vectorized parser leaves to the interpreter
+_FAST_UNSUPPORTED = {ord('G'): (52, 91, 92), ord('M'): (98, 99)}
+# Bytes per chunk of the vectorized parser
+CHUNK_BYTES = 1 << 20
+
+
+def _source_chunks(source, size=CHUNK_BYTES):
+    """
+    Whole-line byte chunks of about size bytes.
+    """
+    if isinstance(source, str) and "\n" not in source and os.path.exists(source):
+        with open(source, "rb") as f:
+            while True:
+                chunk = f.read(size)
+                if not chunk:
+                    return
+                yield chunk + f.readline()
+    if not isinstance(source, str):
+        source = "\n".join(line.rstrip("\n") for line in source)
+    data = source.encode("utf-8")
+    start = 0
+    while start < len(data):
+        end = data.find(b"\n", start + size)
+        end = len(data) if end < 0 else end + 1
+        yield data[start:end]
+        start = end
+
+
+def _ffill(values, initial):
+    """
+    Carries the last non-NaN value forward; leading NaNs become initial.
+    """
+    idx = np.where(np.isnan(values), -1, np.arange(len(values)))
+    np.maximum.accumulate(idx, out=idx)
+    return np.where(idx >= 0, values[np.maximum(idx, 0)], initial)
+
+
+def _per_line(n_lines, line, mask, values):
+    """
+    Value of the last word matching mask on each line, NaN where there is none.
+    """
+    out = np.full(n_lines, np.nan)
+    out[line[mask]] = values[mask]
+    return out
+
+
+class _FastParser:
+    """
+    Vectorized parser for flat programs (no subprograms, G52 or G91). Each
+    chunk is tokenized and its modal state resolved with NumPy; the state at
+    the end of a chunk carries into the next one.
+    """
+
+    def __init__(self):
+        self.prog = _Program()
+        self.pos = np.zeros(3)
+        self.scale = 1.0
+        self.motion = np.nan
+        self.feed = 0.0
+        self.cutting = 0.0
+        self.current = 0
+        self.ended = False
+
+    def feed_chunk(self, text):
+        """
+        Parses one chunk. Returns False if the chunk needs the interpreter.
+        """
+        if self.ended:
+            return True
+        prog = self.prog
+
+        if not text.endswith(b"\n"):
+            text += b"\n"
+
+        # Pass markers by line, before the comments go
+        markers = []
+        if b"(" in text or b";" in text:
+            line_no = 0
+            last = 0
+            for m in _PASS_B.finditer(text):
+                line_no += text.count(b"\n", last, m.start())
+                last = m.start()
+                markers.append((line_no, m.group(1).decode("utf-8", "replace")))
+            text = (_COMMENT_B if b";" in text else _PAREN_B).sub(b"", text)
+        text = text.upper()
+
+        letters = np.frombuffer(text.translate(None, _LETTER_DELETE), dtype=np.uint8)
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                values = np.fromstring(text.translate(_VALUE_TABLE).replace(b"\n", b" nan "), sep=" ")
+        except ValueError:
+            return False
+        if len(letters) != len(values) or np.any((letters > ord('Z')) | ((letters < ord('A')) & (letters != _NEWLINE))):
+            return False  # A letter without value or a stray character
+
+        is_nl = letters == _NEWLINE
+        line = np.cumsum(is_nl) - is_nl
+        n_lines = int(is_nl.sum())
+
+        G = letters == ord('G')
+        M = letters == ord('M')
+        for letter, codes in _FAST_UNSUPPORTED.items():
+            if np.any((letters == letter) & np.isin(values, codes)):
+                return False
+
+        # Program end: nothing after M30 / M2 runs
+        end = M & np.isin(values, (2, 30))
+        if end.any():
+            last_line = line[np.argmax(end)]
+            keep = line <= last_line
+            letters, values, line = letters[keep], values[keep], line[keep]
+            G, M = G[keep], M[keep]
+            n_lines = int(last_line) + 1
+            markers = [mk for mk in markers if mk[0] <= last_line]
+            self.ended = True
+
+        # Passes
+        pass_line = np.full(n_lines, np.nan)
+        for line_no, name in markers:
+            prog.new_pass(name)
+            pass_line[line_no] = len(prog.passes) - 1
+        pass_line = _ffill(pass_line, self.current).astype(np.int64)
+
+        # Modal state after each line
+        scale = _ffill(_per_line(n_lines, line, G & np.isin(values, (20, 21)),
+                                 np.where(values == 20, MM_PER_INCH, 1.0)), self.scale)
+        motion = _ffill(_per_line(n_lines, line, G & np.isin(values, (0, 1)), values), self.motion)
+        cut_on = M & np.isin(values, (3, 4))
+        cut_off = M & (values == 5)
+        cutting = _ffill(_per_line(n_lines, line, cut_on | cut_off, cut_on.astype(np.float64)), self.cutting)
+        feed = _ffill(_per_line(n_lines, line, letters == ord('F'), values) * scale, self.feed)
+
+        # Spindle toggles and G4 dwells per pass
+        n_pass = len(prog.passes)
+        m3 = np.bincount(pass_line[line[cut_on]], minlength=n_pass)
+        m5 = np.bincount(pass_line[line[cut_off]], minlength=n_pass)
+        dwell_lines = np.zeros(n_lines, dtype=bool)
+        dwell_lines[line[G & (values == 4)]] = True
+        p_words = (letters == ord('P')) & dwell_lines[line]
+        dwell = np.bincount(pass_line[line[p_words]], weights=values[p_words], minlength=n_pass)
+        for i in range(n_pass):
+            prog.m3[i] += int(m3[i])
+            prog.m5[i] += int(m5[i])
+            prog.dwell[i] += float(dwell[i])
+
+        # Coordinates: only lines with a motion mode move
+        moving = ~np.isnan(motion)
+        ends = []
+        has_xyz = np.zeros(n_lines, dtype=bool)
+        for axis, letter in enumerate("XYZ"):
+            raw = _per_line(n_lines, line, letters == ord(letter), values) * scale
+            raw[~moving | dwell_lines] = np.nan
+            has_xyz |= ~np.isnan(raw)
+            ends.append(_ffill(raw, self.pos[axis]))
+        end_pos = np.column_stack(ends)
+        start_pos = np.vstack(([self.pos], end_pos[:-1])) if n_lines else end_pos
+
+        move = has_xyz
+        prog.blocks.append((start_pos[move], end_pos[move], motion[move] == 0, feed[move],
+                            pass_line[move], cutting[move] > 0))
+
+        if n_lines:
+            self.pos = end_pos[-1]
+            self.scale = scale[-1]
+            self.motion = motion[-1]
+            self.feed = feed[-1]
+            self.cutting = cutting[-1]
+            self.current = int(pass_line[-1])
+        return True
+
+
+def parse_gcode(source):
+    """
+    Parses a G-code program into moves (as written by generate_gcode, or any
+    program using G0/G1, G20/G21, G90/G91, G4, G52, M3/M4/M5, M98/M99 and F).
+    Motion mode and coordinates are modal. '(--- name ---)' comments start
+    a new pass for the breakdown. Subprogram calls (M98 P.. L..) are expanded,
+    their moves count towards the pass they are called from.
+
+    Args:
+        source: File path, program string or iterable of lines
+
+    Returns:
+        dict of arrays: {'start', 'end': (N, 3) mm, 'rapid': (N,) bool,
+        'feed': (N,) mm/min, 'pass_id': (N,) int, 'passes': names,
+        'cutting': (N,) bool (between M3 and M5),
+        'm3', 'm5': Cut On / Off count per pass, 'dwell': G4 seconds per pass}
+    """
+    if not isinstance(source, str):
+        source = list(source)  # May have to be read twice
+
+    # Flat programs go through the vectorized parser, the rest is interpreted
+    fast = _FastParser()
+    if all(fast.feed_chunk(chunk) for chunk in _source_chunks(source)):
+        return fast.prog.arrays()
+
+    main, subs = _split_programs(source)
+    interp = _Interpreter(subs)
+    interp.run(main)
+    return interp.prog.arrays()
+
+
+def move_times(start, end, rapid, feed, machine=None):
+    """
+    Time of each move (seconds) with a trapezoidal speed profile: accelerate
+    to the rapid rate or feed, cruise, decelerate. Short moves that never
+    reach full speed take 2 * sqrt(d / a).
+    Moves with no feed set (F0) take no time.
+
+    Returns:
+        (times, distances) arrays in seconds and mm
+    """
+    if machine is None:
+        machine = DEFAULT_MACHINE
+    dist = np.linalg.norm(np.asarray(end) - np.asarray(start), axis=1)
+    speed = np.where(rapid, machine['rapid_rate'], np.minimum(feed, machine['max_feed'])) / 60.0
+    accel = machine['accel']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ramp = speed * speed / accel  # Distance to reach full speed and stop again
+        cruise = dist / speed + speed / accel
+        short = 2.0 * np.sqrt(dist / accel)
+        times = np.where(dist >= ramp, cruise, short)
+    times = np.where(speed > 0, times, 0.0)
+    return times, dist
+
+
+def estimate_cycle_time(program, machine=None):
+    """
+    Cycle time of a parsed program (see parse_gcode).
+
+    Returns:
+        dict: {'total', 'rapid_time', 'feed_time', 'dwell_time' (seconds),
+               'rapid_distance', 'feed_distance' (mm), 'moves', 'cuts',
+               'passes': [per pass dict with the same keys and 'name']}
+    """
+    if machine is None:
+        machine = DEFAULT_MACHINE
+    rapid = program['rapid']
+    times, dist = move_times(program['start'], program['end'], rapid, program['feed'], machine)
+
+    n = len(program['passes'])
+    ids = program['pass_id']
+
+    def per_pass(values, mask):
+        return np.bincount(ids[mask], weights=values[mask], minlength=n)
+
+    rapid_time = per_pass(times, rapid)
+    feed_time = per_pass(times, ~rapid)
+    rapid_dist = per_pass(dist, rapid)
+    feed_dist = per_pass(dist, ~rapid)
+    moves = np.bincount(ids, minlength=n)
+    dwell = program['m3'] * machine['m3_dwell'] + program['m5'] * machine['m5_dwell'] + program['dwell']
+
+    passes = []
+    for i, name in enumerate(program['passes']):
+        passes.append({
+            'name': name,
+            'total': float(rapid_time[i] + feed_time[i] + dwell[i]),
+            'rapid_time': float(rapid_time[i]),
+            'feed_time': float(feed_time[i]),
+            'dwell_time': float(dwell[i]),
+            'rapid_distance': float(rapid_dist[i]),
+            'feed_distance': float(feed_dist[i]),
+            'moves': int(moves[i]),
+            'cuts': int(program['m3'][i]),
+        })
+    # The setup section only matters if it moved
+    if passes and passes[0]['moves'] == 0 and passes[0]['total'] == 0:
+        passes = passes[1:]
+
+    report = {key: sum(p[key] for p in passes)
+              for key in ('total', 'rapid_time', 'feed_time', 'dwell_time',
+                          'rapid_distance', 'feed_distance', 'moves', 'cuts')}
+    report['passes'] = passes
+    return report
+
+
+def estimate_gcode_time(source, machine=None):
+    """
+    Cycle time of a G-code file, program string or iterable of lines.
+    """
+    return estimate_cycle_time(parse_gcode(source), machine)
+
+
+def estimate_cut_time(v_lines, h_lines, feed_rate=1000, unit="mm", optimize_order=False, machine=None):
+    """
+    Cycle time of the program generate_gcode would write for these cuts,
+    built straight from the cut arrays (no G-code text).
+    """
+    if optimize_order:
+        v_lines, h_lines, _ = order_toolpath(v_lines, h_lines)
+    scale = MM_PER_INCH if unit.lower() == "inch" else 1.0
+    feed = feed_rate * scale
+
+    prog = _Program()
+    starts, ends, rapid, feeds, ids = [], [], [], [], []
+
+    def add(s, e, is_rapid, pass_id):
+        starts.append(s)
+        ends.append(e)
+        rapid.append(np.full(len(s), is_rapid))
+        feeds.append(np.full(len(s), feed))
+        ids.append(np.full(len(s), pass_id))
+
+    # Header: G0 Z0.5 from the origin
+    safe = 0.5 * scale
+    add(np.zeros((1, 3)), np.array([[0.0, 0.0, safe]]), True, 0)
+    pos = np.array([0.0, 0.0, safe])
+
+    for name, lines in (("1st Pass: VERTICAL", v_lines), ("2nd Pass: HORIZONTAL", h_lines)):
+        prog.new_pass(name)
+        pass_id = len(prog.passes) - 1
+        lines = _as_rows(lines) * scale
+        n = len(lines)
+        if n == 0:
+            continue
+        cut_start = np.column_stack((lines[:, 0:2], np.full(n, safe)))
+        cut_end = np.column_stack((lines[:, 2:4], np.full(n, safe)))
+        prev = np.vstack(([pos], cut_end[:-1]))
+        # G0 to each cut start, then G1 along the cut
+        add(prev, cut_start, True, pass_id)
+        add(cut_start, cut_end, False, pass_id)
+        prog.m3[pass_id] = n
+        prog.m5[pass_id] = n
+        pos = cut_end[-1]
+
+    # Footer: G0 Z10.0, G0 X0 Y0 (counted with the last pass, like the parser)
+    top = np.array([pos[0], pos[1], 10.0 * scale])
+    add(np.array([pos, top]), np.array([top, [0.0, 0.0, top[2]]]), True, len(prog.passes) - 1)
+
+    # Moves are grouped (all rapids, then all cuts per pass), the totals don't depend on order
+    program = prog.arrays()
+    program.update({
+        'start': np.vstack(starts),
+        'end': np.vstack(ends),
+        'rapid': np.concatenate(rapid),
+        'feed': np.concatenate(feeds),
+        'pass_id': np.concatenate(ids),
+    })
+    program['cutting'] = ~program['rapid']
+    return estimate_cycle_time(program, machine)
+
+
+def format_duration(seconds):
+    """
+    '1h 02m 03.4s', '12m 30.0s' or '4.2s'.
+    """
+    h, rest = divmod(seconds, 3600)
+    m, s = divmod(rest, 60)
+    if h >= 1:
+        return f"{int(h)}h {int(m):02d}m {s:04.1f}s"
+    if m >= 1:
+        return f"{int(m)}m {s:04.1f}s"
+    return f"{s:.1f}s"
+
+
+def print_cycle_report(report, log=print):
+    """
+    Per pass breakdown of estimate_cycle_time.
+    """
+    log(f"{'pass':<24}{'cuts':>8}{'rapid':>16}{'feed':>16}{'dwell':>16}{'total':>16}")
+    for p in report['passes'] + [dict(report, name="Total")]:
+        log(f"{p['name']:<24}{p['cuts']:>8}{format_duration(p['rapid_time']):>16}"
+            f"{format_duration(p['feed_time']):>16}{format_duration(p['dwell_time']):>16}"
+            f"{format_duration(p['total']):>16}")
+    log(f"Rapid Travel: {report['rapid_distance']:.1f} mm, Cut Length: {report['feed_distance']:.1f} mm")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate machine cycle time of a G-code file")
+    parser.add_argument("gcode_file", help="Path to the G-code file")
+    parser.add_argument("--rapid", type=float, help="G0 rapid rate (mm/min)")
+    parser.add_argument("--max-feed", type=float, help="Maximum G1 feed (mm/min)")
+    parser.add_argument("--accel", type=float, help="Acceleration (mm/s^2)")
+    parser.add_argument("--m3-dwell", type=float, help="Seconds per Cut On (M3)")
+    parser.add_argument("--m5-dwell", type=float, help="Seconds per Cut Off (M5)")
+    args = parser.parse_args()
+
+    machine = machine_profile(rapid_rate=args.rapid, max_feed=args.max_feed, accel=args.accel,
+                              m3_dwell=args.m3_dwell, m5_dwell=args.m5_dwell)
+    print_cycle_report(estimate_gcode_time(args.gcode_file, machine))
+
+
+if __name__ == "__main__":
+    main()
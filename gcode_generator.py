@@ -1,48 +1,229 @@
-def generate_gcode(v_lines, h_lines, feed_rate=1000, unit="mm"):
+from toolpath import order_toolpath, find_repeated_patterns
+
+# Lines per write() call of write_gcode
+WRITE_CHUNK_LINES = 4096
+
+# 'standard': full block and comment per cut, 'compact': modal words only
+DIALECTS = ("standard", "compact")
+
+
+# Pass name, per-cut comment, Cut On and Cut Off blocks (standard) and spindle speed (compact)
+PASSES = {
+    'vertical': ("1st Pass: VERTICAL", "Vertical Cut", "M3 (Cut On)", "M5 (Cut Off)", None),
+    'horizontal': ("2nd Pass: HORIZONTAL", "Horizontal Cut", "M3 S1000", "M5", 1000),
+}
+
+# Number of the first subprogram (the main program is O1000)
+FIRST_SUBPROGRAM = 1001
+
+
+def _standard_cuts(lines, kind):
+    _, label, cut_on, cut_off, _ = PASSES[kind]
+    for i, line in enumerate(lines):
+        x1, y1, x2, y2 = line
+        yield f"({label} #{i+1})"
+        yield f"G0 X{x1:.2f} Y{y1:.2f}" # Move to start
+        yield cut_on
+        yield f"G1 X{x2:.2f} Y{y2:.2f}" # Cut to end
+        yield cut_off
+
+
+def _num(value):
     """
-    Generates G-code string from mapped vertical and horizontal lines.
+    Coordinate with 2 decimals and no trailing zeros: 12.50 -> '12.5', 3.00 -> '3'.
+    """
+    s = f"{value:.2f}".rstrip("0").rstrip(".")
+    return "0" if s == "-0" else s
+
+
+class _ModalState:
+    """
+    Controller state for the compact dialect: words that would not change
+    the motion mode, position or spindle speed are left out.
+    """
+
+    def __init__(self):
+        self.motion = None
+        self.x = None
+        self.y = None
+        self.speed = None
+        self.cutting = False
+
+    def move(self, motion, x, y):
+        """
+        Block for a G0 / G1 move, or None if it goes nowhere.
+        """
+        words = []
+        if motion != self.motion:
+            words.append(motion)
+        x, y = _num(x), _num(y)
+        if x != self.x:
+            words.append("X" + x)
+        if y != self.y:
+            words.append("Y" + y)
+        if len(words) == (motion != self.motion):
+            return None  # Already there
+        self.motion, self.x, self.y = motion, x, y
+        return " ".join(words)
+
+    def at(self, x, y):
+        return _num(x) == self.x and _num(y) == self.y
+
+    def cut_on(self, speed=None):
+        self.cutting = True
+        if speed is not None and speed != self.speed:
+            self.speed = speed
+            return f"M3 S{speed}"
+        return "M3"
+
+
+def _compact_cuts(lines, kind, state, chain_cuts=True):
+    speed = PASSES[kind][4]
+    for line in lines:
+        x1, y1, x2, y2 = line
+        if state.cutting and not (chain_cuts and state.at(x1, y1)):
+            yield "M5"
+            state.cutting = False
+        if not state.cutting:
+            block = state.move("G0", x1, y1)
+            if block:
+                yield block
+            yield state.cut_on(speed)
+        # Chained: the cutter stays on into the next stroke
+        block = state.move("G1", x2, y2)
+        if block:
+            yield block
+    if state.cutting:
+        yield "M5"
+        state.cutting = False
+
+
+def iter_gcode(v_lines, h_lines, feed_rate=1000, unit="mm", optimize_order=False, dialect="standard",
+               chain_cuts=True, subprograms=False, order_budget=None):
+    """
+    Yields the G-code program for mapped vertical and horizontal lines, one
+    line at a time (without newline).
     v_lines: List of [x1, y1, x2, y2] (Vertical)
     h_lines: List of [x1, y1, x2, y2] (Horizontal)
     unit: 'mm' or 'inch'
+    optimize_order: Reorder / reverse cuts within each pass to minimize rapid travel
+    order_budget: toolpath.TimeBudget for the order refinement, share one across
+                  the plates of a job (default: ORDER_TIME_LIMIT for this program)
+    dialect: 'standard' or 'compact' (no per-cut comments, unchanged modal
+             words and coordinates left out)
+    chain_cuts: compact only, keep the cutter on between strokes that share
+                an endpoint (set False if the controller needs M5/M3 per cut)
+    subprograms: write repeated cut groups (e.g. identical columns) once as an
+                 O-word subprogram after M30 and call it with M98 at a G52 offset
     """
-    gcode = []
-    
+    if dialect not in DIALECTS:
+        raise ValueError(f"Unknown G-code dialect: {dialect}")
+
+    rapid_note = None
+    if optimize_order:
+        v_lines, h_lines, stats = order_toolpath(v_lines, h_lines, budget=order_budget)
+        rapid_note = f"(Rapid Travel: {stats['rapid_before']:.1f} -> {stats['rapid_after']:.1f})"
+
     # Header
-    gcode.append("%")
-    gcode.append("O1000 (NESTING CUT)")
-    
+    yield "%"
+    yield "O1000 (NESTING CUT)"
+
     if unit.lower() == "inch":
-        gcode.append("G20 g90 (Inch, Absolute)")
+        yield "G20 g90 (Inch, Absolute)"
     else:
-        gcode.append("G21 g90 (Metric, Absolute)")
-        
-    gcode.append(f"F{feed_rate}")
-    gcode.append("G0 Z0.5 (Safe Height)") # 0.5 inch is safer than 10 inches if unit is inch
-    
-    # 1. Vertical Cuts (1차)
-    gcode.append("(--- 1st Pass: VERTICAL ---)")
-    for i, line in enumerate(v_lines):
-        x1, y1, x2, y2 = line
-        gcode.append(f"(Vertical Cut #{i+1})")
-        gcode.append(f"G0 X{x1:.2f} Y{y1:.2f}") # Move to start
-        gcode.append("M3 (Cut On)")
-        gcode.append(f"G1 X{x2:.2f} Y{y2:.2f}") # Cut to end
-        gcode.append("M5 (Cut Off)")
-        
-    # 2. Horizontal Cuts (2차)
-    gcode.append("(--- 2nd Pass: HORIZONTAL ---)")
-    for i, line in enumerate(h_lines):
-        x1, y1, x2, y2 = line
-        gcode.append(f"(Horizontal Cut #{i+1})")
-        gcode.append(f"G0 X{x1:.2f} Y{y1:.2f}")
-        gcode.append("M3 S1000") # Start spindle/laser again if needed, S value optional
-        gcode.append(f"G1 X{x2:.2f} Y{y2:.2f}")
-        gcode.append("M5")
-        
+        yield "G21 g90 (Metric, Absolute)"
+
+    yield f"F{feed_rate}"
+    if rapid_note:
+        yield rapid_note
+    yield "G0 Z0.5 (Safe Height)" # 0.5 inch is safer than 10 inches if unit is inch
+
+    compact = dialect == "compact"
+    state = _ModalState()
+    num = _num if compact else (lambda v: f"{v:.2f}")
+
+    def cuts(lines, kind, state):
+        if compact:
+            return _compact_cuts(lines, kind, state, chain_cuts)
+        return _standard_cuts(lines, kind)
+
+    subs = []
+    for kind, lines in (('vertical', v_lines), ('horizontal', h_lines)):
+        # 1. Vertical Cuts (1차), 2. Horizontal Cuts (2차)
+        yield f"(--- {PASSES[kind][0]} ---)"
+        calls = []
+        if subprograms:
+            patterns, calls, lines = find_repeated_patterns(lines, axis=0 if kind == 'vertical' else 1)
+            first = FIRST_SUBPROGRAM + len(subs)
+            subs.extend((kind, p, sum(1 for c in calls if c[0] == i)) for i, p in enumerate(patterns))
+        yield from cuts(lines, kind, state)
+        if calls:
+            for pattern_id, ox, oy in calls:
+                yield f"G52 X{num(ox)} Y{num(oy)}" # Local origin of this repetition
+                yield f"M98 P{first + pattern_id}"
+            yield "G52 X0 Y0"
+            # Position and modes are unknown after a subprogram
+            state = _ModalState()
+
     # Footer
-    gcode.append("G0 Z10.0")
-    gcode.append("G0 X0 Y0")
-    gcode.append("M30 (End of Program)")
-    gcode.append("%")
-    
-    return "\n".join(gcode)
+    yield "G0 Z10.0"
+    yield "G0 X0 Y0"
+    yield "M30 (End of Program)"
+
+    # Subprograms, in local coordinates of their G52 origin
+    for i, (kind, body, count) in enumerate(subs):
+        yield f"O{FIRST_SUBPROGRAM + i} ({PASSES[kind][1]} Pattern: {len(body)} cuts x {count})"
+        yield from cuts(body, kind, _ModalState())
+        yield "M99"
+    yield "%"
+
+
+def write_gcode(output, v_lines, h_lines, chunk_lines=WRITE_CHUNK_LINES, **kwargs):
+    """
+    Streams the G-code program to a file as it is generated, chunk_lines
+    lines per write, so memory use does not grow with the program length.
+    Same content as generate_gcode.
+
+    Args:
+        output: File path or an open text file object
+        v_lines, h_lines: As for iter_gcode
+        chunk_lines (int): Lines joined per write() call
+        **kwargs: feed_rate, unit, optimize_order, dialect, chain_cuts, subprograms,
+                  order_budget (see iter_gcode)
+
+    Returns:
+        int: Number of lines written
+    """
+    if isinstance(output, str):
+        with open(output, "w", buffering=1024 * 1024) as f:
+            return write_gcode(f, v_lines, h_lines, chunk_lines, **kwargs)
+
+    count = 0
+    chunk = []
+    for line in iter_gcode(v_lines, h_lines, **kwargs):
+        # Newline between lines, none after the last one (like generate_gcode)
+        chunk.append(line if count == 0 else "\n" + line)
+        count += 1
+        if len(chunk) >= chunk_lines:
+            output.write("".join(chunk))
+            chunk = []
+    if chunk:
+        output.write("".join(chunk))
+    return count
+
+
+def generate_gcode(v_lines, h_lines, feed_rate=1000, unit="mm", optimize_order=False, dialect="standard",
+                   chain_cuts=True, subprograms=False, order_budget=None):
+    """
+    Generates G-code string from mapped vertical and horizontal lines.
+    Builds the whole program in memory; use write_gcode for large jobs.
+    v_lines: List of [x1, y1, x2, y2] (Vertical)
+    h_lines: List of [x1, y1, x2, y2] (Horizontal)
+    unit: 'mm' or 'inch'
+    optimize_order: Reorder / reverse cuts within each pass to minimize rapid travel
+    order_budget: Shared time for the order refinement (see iter_gcode)
+    dialect: 'standard' or 'compact' (see iter_gcode)
+    subprograms: Emit repeated cut groups once as subprograms (see iter_gcode)
+    """
+    return "\n".join(iter_gcode(v_lines, h_lines, feed_rate, unit, optimize_order, dialect, chain_cuts,
+                                 subprograms, order_budget))
@@ -0,0 +1,192 @@
+"""
+Back-plotter: turns a G-code program back into cut segments, draws them and
+checks them against the layout the program was made from.
+
+Usage:
+    python gcode_plotter.py output.nc [--png plot.png] [--width 2400 --height 1200] [--rapids]
+"""
+import argparse
+
+import numpy as np
+
+from cycle_time import parse_gcode, MM_PER_INCH
+from nesting_engine import create_preview_image
+from toolpath import merge_collinear_cuts, _as_rows
+
+
+def gcode_segments(source, unit="mm", tol=1e-3):
+    """
+    Cut and rapid segments of a G-code program. Cuts are G1 moves between
+    M3 and M5; moves that only change Z are left out.
+
+    Args:
+        source: File path, program string, iterable of lines or the result of
+                cycle_time.parse_gcode
+        unit: Unit of the returned coordinates, 'mm' or 'inch'
+        tol: Moves shorter than this are ignored, cuts within this of an
+             axis count as vertical / horizontal
+
+    Returns:
+        dict of (N, 4) [x1, y1, x2, y2] arrays: {'v_cuts', 'h_cuts',
+        'other_cuts' (not axis aligned), 'rapids'}
+    """
+    program = source if isinstance(source, dict) else parse_gcode(source)
+    scale = MM_PER_INCH if unit.lower() == "inch" else 1.0
+    segs = np.hstack((program['start'][:, :2], program['end'][:, :2])) / scale
+
+    dx = np.abs(segs[:, 2] - segs[:, 0])
+    dy = np.abs(segs[:, 3] - segs[:, 1])
+    moves = np.maximum(dx, dy) > tol
+    cut = moves & ~program['rapid'] & program['cutting']
+    vertical = cut & (dx <= tol)
+    horizontal = cut & (dy <= tol) & ~vertical
+
+    return {
+        'v_cuts': segs[vertical],
+        'h_cuts': segs[horizontal],
+        'other_cuts': segs[cut & ~vertical & ~horizontal],
+        'rapids': segs[moves & program['rapid']],
+    }
+
+
+def plot_gcode(source, plate_w=None, plate_h=None, unit="mm", img_size=(600, 400), show_rapids=False):
+    """
+    Draws a G-code program like create_preview_image draws a layout
+    (vertical cuts red, horizontal green), plus non axis-aligned cuts in
+    magenta and optionally the rapids in grey.
+    plate_w / plate_h default to the extent of the cuts.
+    Returns a PIL Image.
+    """
+    segs = source if isinstance(source, dict) and 'v_cuts' in source else gcode_segments(source, unit)
+    if plate_w is None or plate_h is None:
+        cuts = np.vstack((segs['v_cuts'], segs['h_cuts'], segs['other_cuts']))
+        plate_w = float(cuts[:, [0, 2]].max()) if len(cuts) else 0.0
+        plate_h = float(cuts[:, [1, 3]].max()) if len(cuts) else 0.0
+
+    overlays = [(segs['other_cuts'], (255, 0, 255), 2)]
+    if show_rapids:
+        overlays.insert(0, (segs['rapids'], (180, 180, 180), 1))
+    return create_preview_image(plate_w, plate_h, segs['v_cuts'], segs['h_cuts'], [],
+                                img_size=img_size, overlays=overlays)
+
+
+def _subtract(a, b, axis, tol):
+    """
+    Parts of the merged strokes a not covered by the merged strokes b
+    (same orientation, see merge_collinear_cuts). Leftovers up to tol long
+    are rounding and dropped.
+
+    One sweep over all strokes at once: coordinates within tol of each
+    other are the same line, and along each line the start / end events of
+    a and b are counted, so a piece is left where some a is open and no b.
+    """
+    c = 0 if axis == 0 else 1       # Constant coordinate
+    s, e = (1, 3) if axis == 0 else (0, 2)
+    if not len(a):
+        return np.empty((0, 4), dtype=np.float64)
+
+    # Line ids: sorted coordinates, a new line wherever the gap is over tol
+    coords = np.concatenate((a[:, c], b[:, c]))
+    order = np.argsort(coords, kind='stable')
+    new_line = np.diff(coords[order], prepend=-np.inf) > tol
+    line = np.empty(len(coords), dtype=np.int64)
+    line[order] = np.cumsum(new_line)
+    line_a, line_b = line[:len(a)], line[len(a):]
+
+    # Events: position, +1 / -1 for a and for b, and the a stroke each a start belongs to
+    pos = np.concatenate((a[:, s], a[:, e], b[:, s], b[:, e]))
+    ev_line = np.concatenate((line_a, line_a, line_b, line_b))
+    n_a, n_b = len(a), len(b)
+    d_a = np.concatenate((np.ones(n_a), -np.ones(n_a), np.zeros(2 * n_b))).astype(np.int64)
+    d_b = np.concatenate((np.zeros(2 * n_a), np.ones(n_b), -np.ones(n_b))).astype(np.int64)
+    src = np.concatenate((np.arange(n_a), np.full(n_a + 2 * n_b, -1)))
+
+    ev = np.lexsort((pos, ev_line))
+    pos, ev_line, src = pos[ev], ev_line[ev], src[ev]
+    # Every stroke opens and closes on its own line, so the counts are 0 between lines
+    open_a = np.cumsum(d_a[ev])
+    open_b = np.cumsum(d_b[ev])
+    # The a stroke a piece belongs to: the last a start before it
+    owner = np.maximum.accumulate(src)
+
+    # Pieces between consecutive events on the same line
+    lo, hi = pos[:-1], pos[1:]
+    keep = (open_a[:-1] > 0) & (open_b[:-1] == 0) & (ev_line[:-1] == ev_line[1:]) & (hi > lo)
+    idx = np.flatnonzero(keep)
+    if not len(idx):
+        return np.empty((0, 4), dtype=np.float64)
+    lo, hi, piece_line, piece_owner = lo[idx], hi[idx], ev_line[idx], owner[idx]
+
+    # Pieces only split by events inside them (e.g. a b stroke ending where another starts) join up
+    joined = np.ones(len(idx), dtype=bool)
+    joined[1:] = (piece_line[1:] != piece_line[:-1]) | (lo[1:] != hi[:-1])
+    first = np.flatnonzero(joined)
+    lo = lo[first]
+    hi = np.maximum.reduceat(hi, first)
+    piece_owner = piece_owner[first]
+
+    long_enough = hi - lo > tol
+    out = a[piece_owner[long_enough]].copy()
+    out[:, s] = lo[long_enough]
+    out[:, e] = hi[long_enough]
+    return out
+
+
+def diff_gcode(source, v_lines, h_lines, unit="mm", tol=0.01):
+    """
+    Compares the cuts a program makes with the layout cuts it was made from.
+    Both are merged into maximal strokes first, so cut order, direction and
+    splitting (merged cuts, chained strokes, subprograms) don't matter, only
+    the material that is cut.
+
+    Args:
+        source: As for gcode_segments
+        v_lines, h_lines: Layout cuts in the program unit
+        unit: 'mm' or 'inch'
+        tol: Coordinate tolerance (G-code is written with 2 decimals)
+
+    Returns:
+        dict: {'ok': bool, 'missing': (N, 4) layout cuts the program doesn't make,
+               'extra': (N, 4) program cuts not in the layout,
+               'missing_length', 'extra_length': float}
+    """
+    segs = gcode_segments(source, unit)
+    prog_v, prog_h, _ = merge_collinear_cuts(segs['v_cuts'], segs['h_cuts'], tol=tol)
+    lay_v, lay_h, _ = merge_collinear_cuts(_as_rows(v_lines), _as_rows(h_lines), tol=tol)
+
+    missing = np.vstack((_subtract(lay_v, prog_v, 0, tol), _subtract(lay_h, prog_h, 1, tol)))
+    extra = np.vstack((_subtract(prog_v, lay_v, 0, tol), _subtract(prog_h, lay_h, 1, tol),
+                       segs['other_cuts']))
+
+    def length(lines):
+        return float(np.hypot(lines[:, 2] - lines[:, 0], lines[:, 3] - lines[:, 1]).sum())
+
+    return {
+        'ok': len(missing) == 0 and len(extra) == 0,
+        'missing': missing,
+        'extra': extra,
+        'missing_length': length(missing),
+        'extra_length': length(extra),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Back-plot a G-code file")
+    parser.add_argument("gcode_file", help="Path to the G-code file")
+    parser.add_argument("--png", help="Save the plot to this image file")
+    parser.add_argument("--width", type=float, help="Plate length (default: extent of the cuts)")
+    parser.add_argument("--height", type=float, help="Plate width (default: extent of the cuts)")
+    parser.add_argument("--unit", choices=["mm", "inch"], default="mm", help="Unit of --width/--height")
+    parser.add_argument("--rapids", action="store_true", help="Also draw rapid moves")
+    args = parser.parse_args()
+
+    segs = gcode_segments(args.gcode_file, args.unit)
+    print(f"Vertical cuts: {len(segs['v_cuts'])}, Horizontal cuts: {len(segs['h_cuts'])}, "
+          f"Other cuts: {len(segs['other_cuts'])}, Rapids: {len(segs['rapids'])}")
+    if args.png:
+        plot_gcode(segs, args.width, args.height, img_size=(1200, 800), show_rapids=args.rapids).save(args.png)
+        print(f"Plot saved to {args.png}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,20 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import threading
+import itertools
 import os
 import cv2  # For image processing in PDF mode
 from PIL import Image, ImageTk
-from pdf_loader import load_pdf_image, extract_dimensions, extract_table_info
-from nesting_engine import calculate_nesting_layout, create_preview_image
-from gcode_generator import generate_gcode
+from pdf_loader import load_pdf_image, read_pdf_report
+from nesting_engine import create_preview_image, summarize_plates, NestingSession
+from nesting_cache import cached_nesting_layout, cached_nesting_plates, get_default_cache
+from gcode_generator import write_gcode
+from main import plate_output_path
+from toolpath import merge_collinear_cuts, TimeBudget
+from cycle_time import estimate_gcode_time, format_duration
+
+# Lines of G-code shown in the text area
+GCODE_PREVIEW_LINES = 2000
 
 class GCodeGeneratorApp:
     def __init__(self, root):
@@ -37,6 +45,11 @@ class GCodeGeneratorApp:
         self.part_h = tk.StringVar(value="10")
         self.quantity = tk.StringVar(value="1")
         
+        # Repeat jobs and Preview -> Generate reuse the same layout
+        self.nesting_cache = get_default_cache()
+        # Part table edits only re-pack the columns from the changed part on
+        self.nesting_session = NestingSession()
+        
         self.create_widgets()
         
     def create_widgets(self):
@@ -142,6 +155,24 @@ class GCodeGeneratorApp:
         self.enable_rem_cut = tk.BooleanVar(value=True)
         ttk.Checkbutton(left_panel, text="Cut Remnant (잔량 절단)", variable=self.enable_rem_cut).pack(fill="x", pady=(10, 0))
         
+        self.enable_merge_cuts = tk.BooleanVar(value=True)
+        self.merge_cuts_check = ttk.Checkbutton(left_panel, text="Merge Collinear Cuts", variable=self.enable_merge_cuts)
+        self.merge_cuts_check.pack(fill="x")
+        
+        # Merged strokes are sorted by coordinate, only worth it when the cut order is optimized
+        self.enable_order_cuts = tk.BooleanVar(value=True)
+        ttk.Checkbutton(left_panel, text="Optimize Cut Order", variable=self.enable_order_cuts,
+                        command=self.update_merge_option).pack(fill="x")
+        
+        self.enable_compact = tk.BooleanVar(value=False)
+        ttk.Checkbutton(left_panel, text="Compact G-code", variable=self.enable_compact).pack(fill="x")
+        
+        self.enable_subprograms = tk.BooleanVar(value=False)
+        ttk.Checkbutton(left_panel, text="Subprograms for Repeats (M98)", variable=self.enable_subprograms).pack(fill="x")
+        
+        self.enable_multi_plate = tk.BooleanVar(value=False)
+        ttk.Checkbutton(left_panel, text="Multi-Plate (다중 원판)", variable=self.enable_multi_plate).pack(fill="x")
+        
         ttk.Button(left_panel, text="Update Preview", command=self.update_preview).pack(fill="x", pady=20)
         ttk.Button(left_panel, text="Generate G-Code", command=self.run_manual_process).pack(fill="x")
         
@@ -208,45 +239,58 @@ class GCodeGeneratorApp:
     def import_manual_pdf(self):
         filename = filedialog.askopenfilename(filetypes=[("PDF & Images", "*.pdf *.png *.jpg"), ("All Files", "*.*")])
         if filename and filename.lower().endswith('.pdf'):
-            try:
-                # 1. Extract Plate Dimensions (Header)
-                w, l = extract_dimensions(filename)
-                if w is not None and l is not None:
-                     self.plate_h.set(str(w))
-                     self.plate_w.set(str(l))
-                     self.log(f"Imported Plate Dims: W={w}, L={l}")
-                else:
-                    self.log("Plate dimensions not found in PDF header.")
+            # Long reports use a process pool, keep the UI responsive meanwhile
+            self.log(f"Reading {os.path.basename(filename)}...")
+            threading.Thread(target=self._import_pdf_thread, args=(filename,), daemon=True).start()
 
-                # 2. Extract Part Info (Table)
-                parts_data = extract_table_info(filename)
-                
-                # Clear existing table
-                for item in self.part_list_tree.get_children():
-                    self.part_list_tree.delete(item)
-                
-                if parts_data:
-                     count = 0
-                     for p in parts_data:
-                         # Extraction returns {'length': l, 'width': w, 'quantity': q}
-                         # UI expects (W (Vert), L (Horz), Qty)
-                         # We mapped L=Horizontal, W=Vertical in extraction too.
-                         
-                         p_w = p['width']  # Vertical
-                         p_l = p['length'] # Horizontal
-                         p_qty = p['quantity']
-                         
-                         self.part_list_tree.insert('', 'end', values=(p_w, p_l, p_qty))
-                         count += 1
-                         
-                     self.log(f"Imported {count} unique part types.")
-                     # self.update_preview() # Disabled per user request
-                else:
-                    self.log("Part info table not found or format unrecognized.")
-                    
-            except Exception as e:
-                self.log(f"Import Error: {e}")
-                messagebox.showerror("Error", str(e))
+    def _import_pdf_thread(self, filename):
+        try:
+            # 1. Plate Dimensions (Header) and 2. Part Info (Table, may continue over pages)
+            report = read_pdf_report(filename)
+            self.root.after(0, lambda: self._show_pdf_report(report))
+        except Exception as e:
+            msg = str(e)
+            self.root.after(0, lambda: self.log(f"Import Error: {msg}"))
+            self.root.after(0, lambda: messagebox.showerror("Error", msg))
+
+    def _show_pdf_report(self, report):
+        """
+        Fills the plate size and the parts table from read_pdf_report (Tk thread).
+        """
+        w, l = report['dimensions']
+        parts_data = report['parts']
+        if report['pages'] > 1:
+            self.log(f"Read {report['pages']} pages.")
+        
+        if w is not None and l is not None:
+             self.plate_h.set(str(w))
+             self.plate_w.set(str(l))
+             self.log(f"Imported Plate Dims: W={w}, L={l}")
+        else:
+            self.log("Plate dimensions not found in PDF header.")
+
+        # Clear existing table
+        for item in self.part_list_tree.get_children():
+            self.part_list_tree.delete(item)
+        
+        if parts_data:
+             count = 0
+             for p in parts_data:
+                 # Extraction returns {'length': l, 'width': w, 'quantity': q}
+                 # UI expects (W (Vert), L (Horz), Qty)
+                 # We mapped L=Horizontal, W=Vertical in extraction too.
+                 
+                 p_w = p['width']  # Vertical
+                 p_l = p['length'] # Horizontal
+                 p_qty = p['quantity']
+                 
+                 self.part_list_tree.insert('', 'end', values=(p_w, p_l, p_qty))
+                 count += 1
+                 
+             self.log(f"Imported {count} unique part types.")
+             # self.update_preview() # Disabled per user request
+        else:
+            self.log("Part info table not found or format unrecognized.")
 
     def update_preview(self):
         try:
@@ -254,16 +298,7 @@ class GCodeGeneratorApp:
             ph = float(self.plate_h.get())
             
             # Construct Parts List from Treeview
-            parts_list = []
-            for item_id in self.part_list_tree.get_children():
-                vals = self.part_list_tree.item(item_id)['values']
-                # vals = (w, l, qty) as strings or numbers
-                try:
-                    p_w = float(vals[0]) # Vertical
-                    p_l = float(vals[1]) # Horizontal
-                    p_q = int(vals[2])
-                    parts_list.append({'length': p_l, 'width': p_w, 'quantity': p_q})
-                except: continue
+            parts_list = self.get_parts_list()
                 
             if not parts_list:
                 # If list is empty, maybe user typed in entry but didn't click Add?
@@ -271,24 +306,13 @@ class GCodeGeneratorApp:
                 # No, strict UI: Must add to list.
                 pass
             
-            v_lines, h_lines, rects = calculate_nesting_layout(pw, ph, parts_list)
+            self.nesting_session.set_plate(pw, ph)
+            layout = cached_nesting_layout(pw, ph, parts_list, cache=self.nesting_cache,
+                                           compute=self.nesting_session.update)
             
             # Extend Horizontal Lines if Enabled (Cut Remnant)
-            if self.enable_rem_cut.get() and h_lines:
-                # Find the right-most X2 coordinate across all horizontal lines
-                # h_lines format: [x1, y1, x2, y2]
-                # Right X is x2 (index 2)
-                max_x = 0
-                if h_lines:
-                    max_x = max(line[2] for line in h_lines)
-                
-                # Extend lines that reach close to max_x to the plate width
-                epsilon = 1.0 # Tolerance
-                for line in h_lines:
-                    # line is [x1, y1, x2, y2]
-                    # We extend the RIGHT side (x2)
-                    if abs(line[2] - max_x) < epsilon:
-                        line[2] = pw
+            if self.enable_rem_cut.get():
+                layout.extend_remnant()
             
             # Draw preview
             # Note: create_preview_image now accepts rects directly
@@ -299,7 +323,7 @@ class GCodeGeneratorApp:
             if w < 100: w = 800 # Default larger width
             if h < 100: h = 600 # Default larger height
             
-            preview_img = create_preview_image(pw, ph, v_lines, h_lines, rects, img_size=(w, h))
+            preview_img = create_preview_image(pw, ph, layout.v_cuts, layout.h_cuts, layout.rects, img_size=(w, h))
             
             # Not returning None to allow UI update with empty image if needed?
             # Actually create_preview_image returns an image even if empty.
@@ -323,15 +347,85 @@ class GCodeGeneratorApp:
                 self.preview_label.config(image=im_tk)
                 self.preview_label.image = im_tk # Keep ref
             
-            self.log(f"Preview updated: {len(rects)} parts placed.")
-            return v_lines, h_lines
+            self.log(f"Preview updated: {len(layout.rects)} parts placed.")
+            return layout.v_cuts, layout.h_cuts
             
         except Exception as e:
             self.log(f"Preview Error: {e}")
             messagebox.showerror("Error", str(e))
             return None, None
 
+    def get_parts_list(self):
+        """
+        Parts list from the Treeview as [{'length', 'width', 'quantity'}].
+        """
+        parts_list = []
+        for item_id in self.part_list_tree.get_children():
+            vals = self.part_list_tree.item(item_id)['values']
+            # vals = (w, l, qty) as strings or numbers
+            try:
+                p_w = float(vals[0]) # Vertical
+                p_l = float(vals[1]) # Horizontal
+                p_q = int(vals[2])
+                parts_list.append({'length': p_l, 'width': p_w, 'quantity': p_q})
+            except: continue
+        return parts_list
+
+    def show_gcode_file(self, path, max_lines=GCODE_PREVIEW_LINES):
+        """
+        Shows the start of a G-code file in the text area. Only max_lines are
+        read, large programs stay on disk.
+        """
+        text = ""
+        if path:
+            with open(path) as f:
+                text = "".join(itertools.islice(f, max_lines))
+                if f.readline():
+                    text += f"(... truncated, see {os.path.basename(path)})"
+        self.gcode_text.config(state="normal")
+        self.gcode_text.delete("1.0", "end")
+        self.gcode_text.insert("end", text)
+        self.gcode_text.config(state="disabled")
+
+    def gcode_options(self):
+        """
+        write_gcode keyword options from the output checkboxes.
+        """
+        return {
+            'dialect': "compact" if self.enable_compact.get() else "standard",
+            'subprograms': self.enable_subprograms.get(),
+        }
+
+    def update_merge_option(self):
+        """
+        Merging needs the cut order optimization, disable it without.
+        """
+        if self.enable_order_cuts.get():
+            self.merge_cuts_check.state(["!disabled"])
+        else:
+            self.merge_cuts_check.state(["disabled"])
+
+    def merge_cuts(self, v_lines, h_lines):
+        """
+        Fuses collinear cuts if Enabled (and the cut order is optimized), logging the strokes saved.
+        """
+        # Merged strokes span several columns, which would hide repeated columns
+        if not self.enable_merge_cuts.get() or self.enable_subprograms.get():
+            return v_lines, h_lines
+        # Merged strokes run sorted by coordinate, cut in that order they add rapids
+        if not self.enable_order_cuts.get():
+            return v_lines, h_lines
+        v_lines, h_lines, stats = merge_collinear_cuts(v_lines, h_lines)
+        if stats['strokes_removed']:
+            # time_saved is for the given order, the written program is re-ordered
+            self.log(f"Merged cuts: {stats['strokes_before']} -> {stats['strokes_after']} strokes")
+        return v_lines, h_lines
+
     def run_manual_process(self):
+        if self.enable_multi_plate.get():
+            self.run_multi_plate_process()
+            return
+        
         v_lines, h_lines = self.update_preview()
         if v_lines is None:
             return
@@ -340,23 +434,73 @@ class GCodeGeneratorApp:
         unit = self.unit_var.get()
         
         try:
-            gcode = generate_gcode(v_lines, h_lines, unit=unit)
-            with open(out_file, "w") as f:
-                f.write(gcode)
+            v_lines, h_lines = self.merge_cuts(v_lines, h_lines)
+            write_gcode(out_file, v_lines, h_lines, unit=unit, optimize_order=self.enable_order_cuts.get(),
+                        **self.gcode_options())
             
             # Show in Text Area
-            self.gcode_text.config(state="normal")
-            self.gcode_text.delete("1.0", "end")
-            self.gcode_text.insert("end", gcode)
-            self.gcode_text.config(state="disabled")
+            self.show_gcode_file(out_file)
             
-            self.log(f"G-code generated: {out_file} ({unit})")
+            cycle = estimate_gcode_time(out_file)['total']
+            self.log(f"G-code generated: {out_file} ({unit}), est. machine time {format_duration(cycle)}")
             # messagebox.showinfo("Success", f"G-code saved to {out_file}")
             
         except Exception as e:
             self.log(f"Error: {e}")
             messagebox.showerror("Error", str(e))
 
+    def run_multi_plate_process(self):
+        """
+        Nests over as many plates as needed, writing one G-code file per plate
+        as each plate is finished.
+        """
+        # Preview shows plate 1 (same as the single plate layout)
+        if self.update_preview()[0] is None:
+            return
+        
+        out_file = self.output_path.get()
+        unit = self.unit_var.get()
+        
+        try:
+            pw = float(self.plate_w.get())
+            ph = float(self.plate_h.get())
+            parts_list = self.get_parts_list()
+            
+            plates = []
+            first_path = None
+            total_time = 0.0
+            # One cut order refinement budget for the whole job, not per plate
+            order_budget = TimeBudget()
+            for plate in cached_nesting_plates(pw, ph, parts_list, cache=self.nesting_cache):
+                if self.enable_rem_cut.get():
+                    plate['layout'].extend_remnant()
+                path = plate_output_path(out_file, plate['plate'])
+                v_lines, h_lines = self.merge_cuts(plate['v_lines'], plate['h_lines'])
+                write_gcode(path, v_lines, h_lines, unit=unit, optimize_order=self.enable_order_cuts.get(),
+                            order_budget=order_budget, **self.gcode_options())
+                if first_path is None:
+                    first_path = path
+                cycle = estimate_gcode_time(path)['total']
+                total_time += cycle
+                self.log(f"Plate {plate['plate']}: {len(plate['placed_rects'])} parts, "
+                         f"{plate['utilization'] * 100:.1f}% used, ~{format_duration(cycle)} -> {path}")
+                self.root.update_idletasks()
+                plates.append({'placed_rects': plate['placed_rects'], 'utilization': plate['utilization']})
+            
+            summary = summarize_plates(plates, parts_list)
+            
+            # Show plate 1 in Text Area
+            self.show_gcode_file(first_path)
+            
+            self.log(f"Plates: {summary['plate_count']}, Mean Utilization: {summary['mean_utilization'] * 100:.1f}%, "
+                     f"Machine Time: ~{format_duration(total_time)}")
+            if summary['parts_unplaced']:
+                self.log(f"Unplaced parts: {summary['parts_unplaced']}")
+            
+        except Exception as e:
+            self.log(f"Error: {e}")
+            messagebox.showerror("Error", str(e))
+
     def run_pdf_process(self):
         # ... logic similar to previous gui_main ...
         # Need to patch process_file to support unit if I want to match features, 
@@ -378,10 +522,13 @@ class GCodeGeneratorApp:
         out = self.output_path.get()
         unit = self.unit_var.get()
         
+        # Tk variables are read here, the worker thread must not touch them
+        options = self.gcode_options()
+        
         # Thread
-        threading.Thread(target=self._pdf_thread, args=(path, w, h, out, unit)).start()
+        threading.Thread(target=self._pdf_thread, args=(path, w, h, out, unit, options)).start()
         
-    def _pdf_thread(self, path, w, h, out, unit):
+    def _pdf_thread(self, path, w, h, out, unit, options):
         # NOTE: process_file in main.py currently hardcodes gcode generation with default args (mm).
         # We need to update main.py/process_file to accept unit or handle it here.
         # Since process_file encapsulates everything, I should update main.py first.
@@ -389,34 +536,50 @@ class GCodeGeneratorApp:
         
         # Let's import logic components to have full control
         try:
-            from gcode_generator import generate_gcode
-            from image_processor import detect_lines, map_coordinates
-            from pdf_loader import load_pdf_image
+            from gcode_generator import write_gcode
+            from image_processor import detect_lines, AffineTransform
+            from pdf_loader import PdfJob
             
             if not os.path.exists(path):
                 raise Exception("File not found")
                 
+            v = h_lines = rect = None
             if path.lower().endswith('.pdf'):
-                img = load_pdf_image(path)
+                with PdfJob(path) as job:
+                    # Lines straight from the drawing, scans (or unreadable drawings) are rendered
+                    try:
+                        v, h_lines, iw, ih = job.vector_lines()
+                    except Exception as e:
+                        msg = f"Could not read the vector drawing ({e}), rendering it instead"
+                        self.root.after(0, lambda: self.log(msg))
+                    if v is not None and not len(v) + len(h_lines):
+                        v = h_lines = None
+                    if v is not None:
+                        # The border of the drawing is the plate
+                        rect = job.plate_rect()
+                    else:
+                        img = job.image(gray=True)
             else:
                 img = cv2.imread(path)
                 
-            v, h_lines = detect_lines(img)
-            ih, iw = img.shape[:2]
+            if v is None:
+                v, h_lines = detect_lines(img)
+                ih, iw = img.shape[:2]
             
-            mv = map_coordinates(v, iw, ih, w, h)
-            mh = map_coordinates(h_lines, iw, ih, w, h)
+            x0, y0, x1, y1 = rect if rect is not None else (0, 0, iw, ih)
+            to_machine = (AffineTransform.pixel_to_machine(x1 - x0, y1 - y0, w, h)
+                          @ AffineTransform.translation(-x0, -y0))
+            mv = to_machine.apply(v)
+            mh = to_machine.apply(h_lines)
             
-            gcode = generate_gcode(mv, mh, unit=unit)
+            write_gcode(out, mv, mh, unit=unit, **options)
             
-            with open(out, "w") as f:
-                f.write(gcode)
-                
             self.root.after(0, lambda: self.log(f"PDF G-code saved to {out}"))
             self.root.after(0, lambda: messagebox.showinfo("Success", "Done"))
             
         except Exception as e:
-            self.root.after(0, lambda: messagebox.showerror("Error", str(e)))
+            msg = str(e)
+            self.root.after(0, lambda: messagebox.showerror("Error", msg))
 
 if __name__ == "__main__":
     root = tk.Tk()
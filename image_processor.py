@@ -1,19 +1,73 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import numpy as np
 
-def detect_lines(image):
+# 'hough': morphology + HoughLinesP, 'projection': row / column projections (faster)
+DETECT_METHODS = ('hough', 'projection')
+
+# Overlap of neighbouring tiles (px): more than minLineLength (50), so a line
+# too short to be found in either of two tiles is still whole in one of them,
+# and the 20 px morphology kernel and 11 px threshold block see real pixels
+TILE_MARGIN = 64
+
+def binarize(image):
     """
-    Detects vertical and horizontal lines in the image.
-    Returns a tuple (vertical_lines, horizontal_lines).
-    Each line is [x1, y1, x2, y2].
+    Adaptive threshold of a BGR or grayscale image: lines (dark on white) become 255.
     """
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     
     # Use adaptive thresholding to isolate lines
     # valid lines are black, background is white.
     # Invert so lines are white.
-    thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                   cv2.THRESH_BINARY_INV, 11, 2)
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
+                                 cv2.THRESH_BINARY_INV, 11, 2)
+
+def detect_lines(image, method='hough', tile_size=None, workers=None, coarse=None):
+    """
+    Detects vertical and horizontal lines in the image (BGR, or grayscale
+    as from load_pdf_image(..., gray=True)).
+    Returns a tuple (vertical_lines, horizontal_lines).
+    Each line is [x1, y1, x2, y2].
+    method: 'hough' or 'projection' (see detect_lines_projection)
+    tile_size: process the image in tiles of this many pixels (plus an
+               overlap margin) on a thread pool, so the working memory is
+               bounded by the tile size instead of the page size
+    workers: threads for tiled / coarse mode (default: all cores)
+    coarse: downscale factor (e.g. 4) for coarse-to-fine detection: line
+            candidates are found on the downscaled image and only narrow
+            strips around them are searched at full resolution
+    """
+    if method not in DETECT_METHODS:
+        raise ValueError(f"Unknown line detection method: {method}")
+    
+    if not tile_size and not coarse:
+        segments = _projection_segments if method == 'projection' else _hough_segments
+        v_lines, h_lines = segments(image)
+        return merge_lines(v_lines, 'vertical'), merge_lines(h_lines, 'horizontal')
+    
+    # One threshold for the whole page, a blank tile has no Otsu threshold of its own
+    threshold = _otsu_threshold(image[::4, ::4])
+    if method == 'projection':
+        segments = lambda region, orientations: _projection_segments(region, threshold=threshold,
+                                                                     orientations=orientations)
+    else:
+        segments = _hough_segments
+    
+    if coarse:
+        regions = _coarse_regions(image, coarse, threshold)
+    else:
+        regions = _tile_regions(image.shape, tile_size)
+    v_lines, h_lines = _region_segments(image, regions, segments, workers)
+    return merge_lines(v_lines, 'vertical'), merge_lines(h_lines, 'horizontal')
+
+def _hough_segments(image, orientations=('vertical', 'horizontal')):
+    """
+    Raw vertical and horizontal HoughLinesP segments (before merge_lines).
+    Only the orientations asked for are searched, the other list is empty.
+    """
+    thresh = binarize(image)
 
     # Use morphological operations to refine valid lines
     # Vertical kernel
@@ -22,99 +76,339 @@ def detect_lines(image):
     h_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (20, 1))
     
     # Detect Vertical lines
-    v_temp = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, v_kernel, iterations=2)
-    v_lines_p = cv2.HoughLinesP(v_temp, 1, np.pi/180, threshold=50, minLineLength=50, maxLineGap=10)
+    v_lines_p = None
+    if 'vertical' in orientations:
+        v_temp = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, v_kernel, iterations=2)
+        v_lines_p = cv2.HoughLinesP(v_temp, 1, np.pi/180, threshold=50, minLineLength=50, maxLineGap=10)
+        del v_temp
     
     # Detect Horizontal lines
-    h_temp = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, h_kernel, iterations=2)
-    h_lines_p = cv2.HoughLinesP(h_temp, 1, np.pi/180, threshold=50, minLineLength=50, maxLineGap=10)
+    h_lines_p = None
+    if 'horizontal' in orientations:
+        h_temp = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, h_kernel, iterations=2)
+        h_lines_p = cv2.HoughLinesP(h_temp, 1, np.pi/180, threshold=50, minLineLength=50, maxLineGap=10)
     
+    # (N, 1, 4) in OpenCV 4, (N, 4) in OpenCV 5
     v_lines = []
     if v_lines_p is not None:
-        for line in v_lines_p:
-            x1, y1, x2, y2 = line[0]
+        for line in v_lines_p.reshape(-1, 4):
+            x1, y1, x2, y2 = line
             # Ensure vertical line (small x difference)
             if abs(x1 - x2) < 5: 
-                v_lines.append(line[0])
+                v_lines.append(line)
 
     h_lines = []
     if h_lines_p is not None:
-        for line in h_lines_p:
-            x1, y1, x2, y2 = line[0]
+        for line in h_lines_p.reshape(-1, 4):
+            x1, y1, x2, y2 = line
             # Ensure horizontal line (small y difference)
             if abs(y1 - y2) < 5:
-                h_lines.append(line[0])
+                h_lines.append(line)
                 
+    return v_lines, h_lines
+
+def _tile_regions(shape, tile_size, margin=TILE_MARGIN):
+    """
+    Overlapping tiles covering an image of this shape, as regions
+    (x1, y1, x2, y2, orientations) for _region_segments.
+    """
+    h, w = shape[:2]
+    regions = []
+    for y0 in range(0, h, tile_size):
+        for x0 in range(0, w, tile_size):
+            regions.append((max(0, x0 - margin), max(0, y0 - margin),
+                            min(w, x0 + tile_size + margin), min(h, y0 + tile_size + margin),
+                            ('vertical', 'horizontal')))
+    return regions
+
+def _coarse_regions(image, factor, threshold, margin=TILE_MARGIN):
+    """
+    Coarse stage of coarse-to-fine detection: finds candidate lines with the
+    projection detector on the image shrunk by factor and returns the
+    full resolution strips around them as regions for _region_segments.
+    
+    Shrinking takes the darkest pixel of every factor x factor block, so
+    1 px lines stay black instead of fading to grey. A strip reaches margin
+    past the candidate ends (lines may be longer than they look coarse) but
+    only a few pixels across; it is only searched for lines along it.
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.erode(gray, np.ones((factor, factor), np.uint8))[factor // 2::factor, factor // 2::factor]
+    del gray
+    
+    # Detector limits in coarse pixels
+    v_cand, h_cand = _projection_segments(small, min_length=max(2, 50 // factor), max_gap=-(-10 // factor),
+                                          min_run=max(3, -(-39 // factor)), threshold=threshold)
+    
+    h, w = image.shape[:2]
+    across = factor + 8  # Candidate pixel block plus the 11 px threshold block
+    regions = []
+    for orientation, lines in (('vertical', v_cand), ('horizontal', h_cand)):
+        boxes = []
+        for x1, y1, x2, y2 in lines:
+            x1, y1, x2, y2 = x1 * factor, y1 * factor, (x2 + 1) * factor, (y2 + 1) * factor
+            if orientation == 'vertical':
+                box = [max(0, x1 - across), max(0, y1 - margin), min(w, x2 + across), min(h, y2 + margin)]
+            else:
+                box = [max(0, x1 - margin), max(0, y1 - across), min(w, x2 + margin), min(h, y2 + across)]
+            # Runs of neighbouring coarse columns (thick lines, broken lines) share one strip
+            for other in reversed(boxes):
+                if box[0] <= other[2] and other[0] <= box[2] and box[1] <= other[3] and other[1] <= box[3]:
+                    other[:] = [min(box[0], other[0]), min(box[1], other[1]),
+                                max(box[2], other[2]), max(box[3], other[3])]
+                    break
+            else:
+                boxes.append(box)
+        regions.extend((*box, (orientation,)) for box in boxes)
+    return regions
+
+def _region_segments(image, regions, segments, workers=None):
+    """
+    Runs segments(part, orientations) over image regions
+    (x1, y1, x2, y2, orientations) on a thread pool (OpenCV and NumPy release the GIL) and returns the
+    segments of the wanted orientations in page coordinates.
+    Regions are views into image; only the ones being worked on have
+    intermediate arrays. Lines crossing region borders come back in pieces
+    and are joined by merge_lines, like the pieces of a broken line.
+    """
+    def run(region):
+        x1, y1, x2, y2, orientations = region
+        return segments(image[y1:y2, x1:x2], orientations)
+    
+    v_lines, h_lines = [], []
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        for (x1, y1, _, _, orientations), (part_v, part_h) in zip(regions, executor.map(run, regions)):
+            offset = np.array([x1, y1, x1, y1])
+            if 'vertical' in orientations:
+                v_lines.extend((np.asarray(line) + offset).tolist() for line in part_v)
+            if 'horizontal' in orientations:
+                h_lines.extend((np.asarray(line) + offset).tolist() for line in part_h)
+    return v_lines, h_lines
+
+def _axis_runs(binary, min_run, min_length, max_gap):
+    """
+    Vertical runs of set pixels in every column of binary (H, K), all columns
+    at once. Runs shorter than min_run are dropped (like the morphological
+    open of the Hough path), then runs at most max_gap apart are joined and
+    the ones at least min_length long are kept.
+    Returns (column, first row, last row) arrays.
+    """
+    h = binary.shape[0]
+    padded = np.zeros((binary.shape[1], h + 2), dtype=np.int8)
+    padded[:, 1:-1] = binary.T
+    edges = np.diff(padded, axis=1)
+    # Sorted by column, then row: starts and ends pair up
+    col, start = np.nonzero(edges == 1)
+    _, end = np.nonzero(edges == -1)
+    
+    keep = end - start >= min_run
+    col, start, end = col[keep], start[keep], end[keep]
+    if not len(col):
+        return col, start, end
+    
+    # Join runs of the same column across small gaps
+    new_group = np.ones(len(col), dtype=bool)
+    new_group[1:] = (col[1:] != col[:-1]) | (start[1:] - end[:-1] > max_gap)
+    first = np.flatnonzero(new_group)
+    last = np.append(first[1:], len(col)) - 1
+    col, start, end = col[first], start[first], end[last]
+    
+    keep = end - start >= min_length
+    return col[keep], start[keep], end[keep] - 1
+
+def _otsu_threshold(image):
+    """
+    Otsu threshold of a BGR or gray image (e.g. a subsample of the page).
+    """
+    gray = np.ascontiguousarray(image)
+    if gray.ndim == 3:
+        gray = cv2.cvtColor(gray, cv2.COLOR_BGR2GRAY)
+    value, _ = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    return value
+
+def _projection_segments(image, min_length=50, max_gap=10, min_run=39, threshold=None,
+                         orientations=('vertical', 'horizontal')):
+    """
+    Raw vertical and horizontal segments from the projections (before
+    merge_lines). threshold: gray level below which a pixel is dark
+    (default: Otsu of this image). Only the orientations asked for are
+    searched, the other list is empty.
+    """
+    # Vector drawings are clean dark lines on white: a global (Otsu)
+    # threshold is enough and much cheaper than the adaptive one
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if threshold is None:
+        _, thresh = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    else:
+        _, thresh = cv2.threshold(gray, threshold, 1, cv2.THRESH_BINARY_INV)
+    thresh = thresh.view(bool)
+    del gray
+    
+    # Pixels with set pixels min_run / 2 and min_run further on: only runs of
+    # at least min_run survive, so lines crossing the other way and text
+    # don't add to the projections
+    half = max(1, (min_run - 1) // 2)
+    v_lines, h_lines = [], []
+    if 'vertical' in orientations:
+        v_core = thresh[:-2 * half] & thresh[half:-half] & thresh[2 * half:]
+        xs = np.flatnonzero(np.count_nonzero(v_core, axis=0))
+        del v_core
+        
+        # Extents along the candidate columns (x positions)
+        col, y1, y2 = _axis_runs(thresh[:, xs], min_run, min_length, max_gap)
+        x = xs[col]
+        v_lines = np.column_stack((x, y1, x, y2)).tolist()
+    
+    if 'horizontal' in orientations:
+        h_core = thresh[:, :-2 * half] & thresh[:, half:-half] & thresh[:, 2 * half:]
+        ys = np.flatnonzero(np.count_nonzero(h_core, axis=1))
+        del h_core
+        
+        # Extents along the candidate rows (y positions)
+        row, x1, x2 = _axis_runs(thresh[ys, :].T, min_run, min_length, max_gap)
+        y = ys[row]
+        h_lines = np.column_stack((x1, y, x2, y)).tolist()
+    return v_lines, h_lines
+
+def detect_lines_projection(image, min_length=50, max_gap=10, min_run=39):
+    """
+    Detects vertical and horizontal lines from row / column projections
+    instead of HoughLinesP. Only works for axis-aligned lines.
+    
+    Columns (rows) whose projection holds a run of at least min_run pixels
+    are candidates; the line extents are the runs along them. Same defaults and output as
+    detect_lines: min_run matches the (20 px, 2 iterations) morphological
+    open, min_length / max_gap the HoughLinesP parameters.
+    """
+    v_lines, h_lines = _projection_segments(image, min_length, max_gap, min_run)
     return merge_lines(v_lines, 'vertical'), merge_lines(h_lines, 'horizontal')
 
 def merge_lines(lines, orientation, tolerance=10):
     """
     Merges lines that are close to each other.
-    Simple clustering based on 'x' for vertical and 'y' for horizontal.
+    Simple clustering based on 'x' for vertical and 'y' for horizontal:
+    after sorting, a line joins the group of the previous one if it is
+    less than tolerance away from it. Works on the whole (N, 4) array at
+    once; lines is a list of [x1, y1, x2, y2] or an array.
     """
-    if not lines:
+    if len(lines) == 0:
         return []
+    lines = np.asarray(lines).reshape(-1, 4)
 
-    # Sort based on primary coordinate
+    # Sort based on primary coordinate (stable, ties keep their order)
     idx = 0 if orientation == 'vertical' else 1
-    lines.sort(key=lambda l: l[idx])
-    
-    merged = []
-    current_group = [lines[0]]
+    lines = lines[np.argsort(lines[:, idx], kind='stable')]
     
-    for i in range(1, len(lines)):
-        line = lines[i]
-        prev_line = current_group[-1]
-        
-        # Check proximity
-        if abs(line[idx] - prev_line[idx]) < tolerance:
-            current_group.append(line)
-        else:
-            merged.append(average_lines(current_group, orientation))
-            current_group = [line]
-            
-    if current_group:
-        merged.append(average_lines(current_group, orientation))
-        
-    return merged
+    # Check proximity: a new group starts wherever the gap is >= tolerance
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(lines[:, idx]) >= tolerance) + 1))
+    return _average_groups(lines, starts, orientation)
 
-def average_lines(group, orientation):
+def _average_groups(lines, starts, orientation):
     """
-    Averages a group of close lines into a single line.
-    Extends the line to the min/max of the opposing coordinate.
+    average_lines for consecutive groups of the (N, 4) array lines, the
+    groups starting at the row indices starts.
     """
-    x1s = [l[0] for l in group]
-    y1s = [l[1] for l in group]
-    x2s = [l[2] for l in group]
-    y2s = [l[3] for l in group]
-    
+    counts = np.diff(np.append(starts, len(lines)))
     if orientation == 'vertical':
         # Average X, Min Y, Max Y
-        avg_x = int((sum(x1s) + sum(x2s)) / (2 * len(group)))
-        min_y = min(min(y1s), min(y2s))
-        max_y = max(max(y1s), max(y2s))
-        return [avg_x, min_y, avg_x, max_y]
+        pos, lo, hi = lines[:, 0] + lines[:, 2], lines[:, 1], lines[:, 3]
     else:
         # Average Y, Min X, Max X
-        avg_y = int((sum(y1s) + sum(y2s)) / (2 * len(group)))
-        min_x = min(min(x1s), min(x2s))
-        max_x = max(max(x1s), max(x2s))
-        return [min_x, avg_y, max_x, avg_y]
+        pos, lo, hi = lines[:, 1] + lines[:, 3], lines[:, 0], lines[:, 2]
+    # Truncated like int() of the mean
+    avg = np.trunc(np.add.reduceat(pos, starts) / (2 * counts)).astype(np.int64)
+    min_c = np.minimum.reduceat(np.minimum(lo, hi), starts)
+    max_c = np.maximum.reduceat(np.maximum(lo, hi), starts)
+    
+    if orientation == 'vertical':
+        merged = [avg, min_c, avg, max_c]
+    else:
+        merged = [min_c, avg, max_c, avg]
+    # Plain Python numbers, like the lines that came in
+    return [list(line) for line in zip(*(column.tolist() for column in merged))]
+
+def average_lines(group, orientation):
+    """
+    Averages a group of close lines into a single line.
+    Extends the line to the min/max of the opposing coordinate.
+    """
+    return _average_groups(np.asarray(group).reshape(-1, 4), np.array([0]), orientation)[0]
+
+class AffineTransform:
+    """
+    2D affine mapping held as one 3x3 matrix, applied to whole (N, 4)
+    arrays of lines [x1, y1, x2, y2] at once. Transforms compose with @
+    (a @ b applies b first, then a) and invert with inverse().
+    """
+
+    def __init__(self, matrix=None):
+        self.matrix = np.eye(3) if matrix is None else np.array(matrix, dtype=np.float64).reshape(3, 3)
+
+    @classmethod
+    def translation(cls, tx, ty):
+        return cls([[1, 0, tx], [0, 1, ty], [0, 0, 1]])
+
+    @classmethod
+    def scaling(cls, sx, sy):
+        return cls([[sx, 0, 0], [0, sy, 0], [0, 0, 1]])
+
+    @classmethod
+    def rotation(cls, degrees, center=(0.0, 0.0)):
+        """
+        Rotation by degrees about center (clockwise on screen for pixel
+        coordinates, counter-clockwise for machine coordinates with y up).
+        """
+        a = np.radians(degrees)
+        c, s = np.cos(a), np.sin(a)
+        cx, cy = center
+        return cls.translation(cx, cy) @ cls([[c, -s, 0], [s, c, 0], [0, 0, 1]]) @ cls.translation(-cx, -cy)
+
+    @classmethod
+    def pixel_to_machine(cls, img_width, img_height, total_width_mm, total_height_mm, origin=(0.0, 0.0),
+                         skew=0.0):
+        """
+        Pixel -> machine coordinates: scales the image onto the plate, flips Y
+        (G-code usually has 0,0 at bottom-left, image is top-left) and moves
+        the plate corner to origin.
+        skew: angle (degrees, clockwise on screen) the drawing is rotated by
+              in the image, e.g. a scan fed in crooked; it is turned back
+              about the image center
+        """
+        transform = cls.translation(*origin) @ cls.scaling(total_width_mm / img_width, -total_height_mm / img_height) \
+            @ cls.translation(0, -img_height)
+        if skew:
+            transform = transform @ cls.rotation(-skew, (img_width / 2.0, img_height / 2.0))
+        return transform
+
+    def __matmul__(self, other):
+        return AffineTransform(self.matrix @ other.matrix)
+
+    def inverse(self):
+        """
+        The reverse mapping, e.g. machine coordinates back to pixels for debug overlays.
+        """
+        return AffineTransform(np.linalg.inv(self.matrix))
+
+    def apply(self, lines, out=None):
+        """
+        Maps lines [x1, y1, x2, y2] (list or (N, 4) array) in one call.
+        Returns a float (N, 4) array (written to out if given).
+        """
+        points = np.asarray(lines, dtype=np.float64).reshape(-1, 2)
+        if out is None:
+            out = np.empty((len(points) // 2, 4))
+        result = out.reshape(-1, 2)
+        # Both endpoints of every line as one (2N, 2) product
+        np.matmul(points, self.matrix[:2, :2].T, out=result)
+        result += self.matrix[:2, 2]
+        return out
+
+    def __repr__(self):
+        return f"AffineTransform({self.matrix.tolist()})"
 
 def map_coordinates(lines, img_width, img_height, total_width_mm, total_height_mm):
     """
     Converts pixel coordinates to real-world MM coordinates.
-    Returns list of mapped lines.
-    """
-    x_scale = total_width_mm / img_width
-    y_scale = total_height_mm / img_height
-    
-    mapped_lines = []
-    for line in lines:
-        x1, y1, x2, y2 = line
-        mx1 = x1 * x_scale
-        my1 = (img_height - y1) * y_scale # G-code usually has 0,0 at bottom-left, image is top-left
-        mx2 = x2 * x_scale
-        my2 = (img_height - y2) * y_scale
-        mapped_lines.append([mx1, my1, mx2, my2])
-    return mapped_lines
+    Returns an (N, 4) array of mapped lines (see AffineTransform.pixel_to_machine).
+    """
+    return AffineTransform.pixel_to_machine(img_width, img_height, total_width_mm, total_height_mm).apply(lines)
@@ -3,14 +3,30 @@ import argparse
 import sys
 import os
 import cv2
-from pdf_loader import load_pdf_image
-from image_processor import detect_lines, map_coordinates
-from gcode_generator import generate_gcode
+import numpy as np
+from pdf_loader import PdfJob
+from image_processor import detect_lines, AffineTransform, DETECT_METHODS
+from gcode_generator import write_gcode, DIALECTS
+from nesting_engine import iter_nesting_plates, summarize_plates, ENGINES
+from nesting_optimizer import search_nesting_strategies, iter_annealed_plates, score_summary
+from nesting_cache import cached_nesting_plates
+from nesting_bounds import optimality_gap
+from toolpath import merge_collinear_cuts, TimeBudget
+from cycle_time import parse_gcode, estimate_cycle_time, format_duration
+from gcode_plotter import diff_gcode
 
 
-def process_file(input_path, width_mm, height_mm, output_path, debug=False):
+def process_file(input_path, width_mm, height_mm, output_path, debug=False, dialect="standard",
+                 detect_method="hough", tile_size=None, coarse=None, vector=True, plate_rect=None):
     """
     Core logic to process the file and generate G-code.
+    tile_size: detect lines in tiles of this many pixels (bounded memory for huge rasters)
+    coarse: find line candidates at 1/coarse resolution first (see image_processor.detect_lines)
+    vector: for PDFs, read the lines from the drawing itself (no rendering);
+            pages without vector lines (scans) still go through the raster path
+    plate_rect: for PDFs, the plate on the page as (x0, y0, x1, y1) in points; it is
+                mapped onto width_mm x height_mm and only it is rendered. Default:
+                the border of the vector drawing, or the whole page without one
     Returns a log string or raises Exception.
     """
     logs = []
@@ -22,46 +38,79 @@ def process_file(input_path, width_mm, height_mm, output_path, debug=False):
         raise FileNotFoundError(f"File {input_path} not found.")
 
     log(f"Processing {input_path}...")
-    
-    if input_path.lower().endswith('.pdf'):
-        img = load_pdf_image(input_path)
+    is_pdf = input_path.lower().endswith('.pdf')
+
+    v_lines = h_lines = img = None
+    if is_pdf:
+        # One open of the document for the vector lines and the render
+        with PdfJob(input_path) as job:
+            if vector:
+                try:
+                    v_lines, h_lines, w, h = job.vector_lines()
+                except Exception as e:
+                    # Unreadable drawing commands, the render may still show the lines
+                    log(f"Could not read the vector drawing ({e}), rendering it instead")
+                    v_lines = h_lines = None
+                else:
+                    if len(v_lines) + len(h_lines) > 0:
+                        log(f"Vector drawing: {w:.0f}x{h:.0f} pt page")
+                    else:
+                        log("No vector lines in the PDF, rendering it instead")
+                        v_lines = h_lines = None
+            # The plate on the page, margins and title blocks around it are not cut
+            if plate_rect is None and v_lines is not None:
+                plate_rect = job.plate_rect()
+            if plate_rect is not None:
+                x0, y0, x1, y1 = plate_rect
+                if x1 <= x0 or y1 <= y0:
+                    raise ValueError(f"Empty plate region {tuple(plate_rect)}")
+                log(f"Plate region: ({x0:.1f}, {y0:.1f})-({x1:.1f}, {y1:.1f}) pt")
+            # 1. Load Image (raster path, or for the debug image), grayscale without copies
+            if v_lines is None or debug:
+                img = job.image(gray=True, clip=plate_rect)
     else:
         img = cv2.imread(input_path)
+    raster = v_lines is None
 
-    if img is None:
-        raise ValueError("Failed to load image.")
+    if raster:
+        if img is None:
+            raise ValueError("Failed to load image.")
 
-    h, w = img.shape[:2]
-    log(f"Image Resolution: {w}x{h} pixels")
+        h, w = img.shape[:2]
+        log(f"Image Resolution: {w}x{h} pixels")
     log(f"Target Size: {width_mm}mm x {height_mm}mm")
 
-    # 2. Detect Lines
-    log("Detecting lines...")
-    v_lines, h_lines = detect_lines(img)
+    if raster:
+        # 2. Detect Lines
+        log("Detecting lines...")
+        v_lines, h_lines = detect_lines(img, method=detect_method, tile_size=tile_size, coarse=coarse)
     log(f"Found {len(v_lines)} Vertical lines and {len(h_lines)} Horizontal lines.")
 
-    # 3. Map Coordinates
-    mapped_v = map_coordinates(v_lines, w, h, width_mm, height_mm)
-    mapped_h = map_coordinates(h_lines, w, h, width_mm, height_mm)
+    # 3. Map Coordinates (pixels or PDF points, both top-left origin). The render is
+    # clipped to the plate already, vector lines are in page points
+    x0, y0, x1, y1 = (0, 0, w, h) if raster else plate_rect
+    to_machine = (AffineTransform.pixel_to_machine(x1 - x0, y1 - y0, width_mm, height_mm)
+                  @ AffineTransform.translation(-x0, -y0))
+    mapped_v = to_machine.apply(v_lines)
+    mapped_h = to_machine.apply(h_lines)
 
-    # 4. Generate G-Code
-    gcode = generate_gcode(mapped_v, mapped_h)
-    
-    # 5. Save Output
-    with open(output_path, "w") as f:
-        f.write(gcode)
+    # 4. Generate G-Code and 5. Save Output (streamed to the file)
+    write_gcode(output_path, mapped_v, mapped_h, dialect=dialect)
     
     log(f"G-code saved to {output_path}")
 
     # Debug Visualization
     if debug:
-        debug_img = img.copy()
+        debug_img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR) if img.ndim == 2 else img.copy()
+        # The cuts as written, mapped back onto the image
+        img_h, img_w = img.shape[:2]
+        to_pixels = AffineTransform.pixel_to_machine(img_w, img_h, width_mm, height_mm).inverse()
         # Draw Vertical (Blue)
-        for line in v_lines:
+        for line in np.rint(to_pixels.apply(mapped_v)).astype(int).tolist():
             x1, y1, x2, y2 = line
             cv2.line(debug_img, (x1, y1), (x2, y2), (255, 0, 0), 2)
         # Draw Horizontal (Green)
-        for line in h_lines:
+        for line in np.rint(to_pixels.apply(mapped_h)).astype(int).tolist():
             x1, y1, x2, y2 = line
             cv2.line(debug_img, (x1, y1), (x2, y2), (0, 255, 0), 2)
             
@@ -71,18 +120,175 @@ def process_file(input_path, width_mm, height_mm, output_path, debug=False):
         
     return "\n".join(logs)
 
+def plate_output_path(output_path, plate_no):
+    """
+    Per-plate output file name for multi-plate jobs: output.nc -> output_plate1.nc
+    """
+    base, ext = os.path.splitext(output_path)
+    return f"{base}_plate{plate_no}{ext or '.nc'}"
+
+
+def parse_part(text):
+    """
+    Parses a part given as LxWxQTY (e.g. 10x5x20) into a parts_list entry.
+    """
+    try:
+        l, w, q = text.lower().split('x')
+        return {'length': float(l), 'width': float(w), 'quantity': int(q)}
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid part '{text}', expected LxWxQTY")
+
+
+def process_nesting(plate_w, plate_h, parts_list, output_path, unit="mm", engine="column", optimize=None,
+                    use_cache=True, merge_cuts=True, optimize_order=True, dialect="standard",
+                    subprograms=False, verify=True):
+    """
+    Nests parts over as many plates as needed and writes one G-code file per plate
+    as soon as that plate is nested.
+    optimize: time budget in seconds for a parallel strategy search and an annealed
+              part order, the one with fewer plates is written (None = engine as given).
+    use_cache: reuse the layout of an identical earlier job (see nesting_cache).
+    merge_cuts: fuse collinear cuts across columns into single strokes (only with
+                optimize_order, merged strokes are sorted by coordinate).
+    optimize_order: order cuts within each pass to minimize rapid travel.
+    dialect: G-code dialect, 'standard' or 'compact' (see gcode_generator.iter_gcode).
+    subprograms: write repeated column patterns once as M98 subprograms (replaces merge_cuts,
+                 merged strokes span several columns).
+    verify: back-plot every written file and check it cuts exactly the layout cuts.
+    Returns a log string.
+    """
+    logs = []
+    def log(msg):
+        print(msg)
+        logs.append(msg)
+
+    strategy = {'engine': engine}
+    annealed = None
+    if optimize:
+        # Half the budget for the strategy search, half for annealing the column order
+        budget = optimize / 2
+        log(f"Searching nesting strategies for {budget}s...")
+        result = search_nesting_strategies(plate_w, plate_h, parts_list, time_budget=budget)
+        if result is not None:
+            strategy = result['strategy']
+            log(f"Best strategy: {result['name']} ({result['summary']['plate_count']} plates, "
+                f"{result['evaluated']}/{result['total']} evaluated"
+                f"{', budget exhausted' if result['timed_out'] else ''})")
+        else:
+            log("No strategy finished within the time budget, using default.")
+
+        log(f"Annealing part order for {budget}s...")
+        plates_annealed = list(iter_annealed_plates(plate_w, plate_h, parts_list, time_budget=budget))
+        summary = summarize_plates(plates_annealed, parts_list)
+        log(f"Annealed column order: {summary['plate_count']} plates, "
+            f"{summary['mean_utilization'] * 100:.1f}% mean utilization")
+        if result is None or score_summary(summary) < score_summary(result['summary']):
+            annealed = plates_annealed
+            # Annealing may turn part types, the plate bound below must allow that
+            strategy = {'engine': 'column', 'rotate': True}
+            log("Using the annealed order.")
+        else:
+            log("Keeping the best strategy.")
+
+    log(f"Nesting {sum(p['quantity'] for p in parts_list)} parts on {plate_w}x{plate_h} plates ({strategy['engine']})...")
+
+    if annealed is not None:
+        nested = annealed
+    elif use_cache:
+        nested = cached_nesting_plates(plate_w, plate_h, parts_list, **strategy)
+    else:
+        nested = iter_nesting_plates(plate_w, plate_h, parts_list, **strategy)
+
+    plates = []
+    total_time = 0.0
+    failed = 0
+    # One cut order refinement budget for the whole job, not per plate
+    order_budget = TimeBudget()
+    for plate in nested:
+        path = plate_output_path(output_path, plate['plate'])
+        v_lines, h_lines = plate['v_lines'], plate['h_lines']
+        merged = ""
+        if merge_cuts and optimize_order and not subprograms:
+            v_lines, h_lines, stats = merge_collinear_cuts(v_lines, h_lines)
+            merged = f", {stats['strokes_removed']} strokes merged"
+        write_gcode(path, v_lines, h_lines, unit=unit, optimize_order=optimize_order, dialect=dialect,
+                    subprograms=subprograms, order_budget=order_budget)
+        program = parse_gcode(path)
+        cycle = estimate_cycle_time(program)['total']
+        total_time += cycle
+        if verify:
+            check = diff_gcode(program, v_lines, h_lines, unit=unit)
+            if not check['ok']:
+                failed += 1
+                log(f"Plate {plate['plate']}: G-code check FAILED, {len(check['missing'])} cuts missing "
+                    f"({check['missing_length']:.1f}), {len(check['extra'])} extra ({check['extra_length']:.1f})")
+        log(f"Plate {plate['plate']}: {len(plate['placed_rects'])} parts, "
+            f"{plate['utilization'] * 100:.1f}% used{merged}, ~{format_duration(cycle)} -> {path}")
+        # Keep only what the summary needs
+        plates.append({'placed_rects': plate['placed_rects'], 'utilization': plate['utilization']})
+
+    summary = summarize_plates(plates, parts_list)
+    log(f"Plates: {summary['plate_count']}, Mean Utilization: {summary['mean_utilization'] * 100:.1f}%, "
+        f"Machine Time: ~{format_duration(total_time)}")
+    if summary['parts_unplaced']:
+        log(f"Unplaced parts: {summary['parts_unplaced']}")
+
+    if verify:
+        log(f"G-code check: {len(plates) - failed}/{len(plates)} plates OK")
+
+    gap = optimality_gap(plate_w, plate_h, parts_list, plates, allow_rotate=strategy.get('rotate', False))
+    log(f"Lower Bound: {gap['lower_bound']} plates, Gap: {gap['gap']}"
+        f"{' (optimal)' if gap['optimal'] else ''}")
+
+    return "\n".join(logs)
+
 def main():
     parser = argparse.ArgumentParser(description="Convert PDF/Image Nesting Layout to G-Code")
-    parser.add_argument("input_file", help="Path to input PDF or Image file")
+    parser.add_argument("input_file", nargs="?", help="Path to input PDF or Image file")
     parser.add_argument("--width", type=float, help="Total Width of the Plate in mm", required=True)
     parser.add_argument("--height", type=float, help="Total Height of the Plate in mm", required=True)
     parser.add_argument("--output", help="Output G-code file path", default="output.nc")
     parser.add_argument("--debug", action="store_true", help="Save debug image with detected lines")
+    parser.add_argument("--detect", choices=DETECT_METHODS, default="hough",
+                        help="Line detector for rendered / image input (projection is faster, axis-aligned lines only)")
+    parser.add_argument("--raster", action="store_true",
+                        help="Always render PDFs and detect the lines in the image (default: read vector lines)")
+    parser.add_argument("--plate-rect", type=float, nargs=4, metavar=("X0", "Y0", "X1", "Y1"),
+                        help="PDF region of the plate in points (default: the border of the vector drawing)")
+    parser.add_argument("--tile", type=int, metavar="PIXELS",
+                        help="Detect lines in tiles of this size on all cores (for very large rasters)")
+    parser.add_argument("--coarse", type=int, metavar="FACTOR",
+                        help="Find lines at 1/FACTOR resolution, then refine them at full resolution")
+    parser.add_argument("--part", type=parse_part, action="append",
+                        help="Nest parts instead of reading a file: LxWxQTY (repeatable). "
+                             "--width/--height are the plate size, one file is written per plate")
+    parser.add_argument("--engine", choices=ENGINES, default="column", help="Nesting engine for --part")
+    parser.add_argument("--unit", choices=["mm", "inch"], default="mm", help="G-code unit for --part")
+    parser.add_argument("--optimize", type=float, metavar="SECONDS",
+                        help="Search nesting strategies and anneal the part order within this time budget (--part)")
+    parser.add_argument("--no-cache", action="store_true", help="Don't reuse cached nesting layouts (--part)")
+    parser.add_argument("--no-merge", action="store_true", help="Keep one stroke per column cut (--part)")
+    parser.add_argument("--dialect", choices=DIALECTS, default="standard",
+                        help="G-code output: standard, or compact (modal words only, chained cuts)")
+    parser.add_argument("--subprograms", action="store_true",
+                        help="Write repeated column patterns once as M98 subprograms (--part, implies --no-merge)")
+    parser.add_argument("--no-verify", action="store_true", help="Don't back-plot and check written files (--part)")
+    parser.add_argument("--no-order", action="store_true",
+                        help="Cut in layout order, not rapid-optimized (--part, implies --no-merge)")
 
     args = parser.parse_args()
+    if not args.part and not args.input_file:
+        parser.error("input_file is required unless --part is given")
 
     try:
-        process_file(args.input_file, args.width, args.height, args.output, args.debug)
+        if args.part:
+            process_nesting(args.width, args.height, args.part, args.output, args.unit, args.engine, args.optimize,
+                            use_cache=not args.no_cache, merge_cuts=not args.no_merge,
+                            optimize_order=not args.no_order, dialect=args.dialect,
+                            subprograms=args.subprograms, verify=not args.no_verify)
+        else:
+            process_file(args.input_file, args.width, args.height, args.output, args.debug, args.dialect,
+                         args.detect, args.tile, args.coarse, not args.raster, args.plate_rect)
     except Exception as e:
         print(f"Error: {e}")
         sys.exit(1)
@@ -0,0 +1,130 @@
+import math
+
+from nesting_engine import group_parts
+
+# Tolerance for area / length sums, so exact fits don't round up to one more plate
+EPS = 1e-9
+
+
+def plate_lower_bounds(plate_w, plate_h, parts_list, allow_rotate=False):
+    """
+    Cheap lower bounds on the number of plates needed for parts_list.
+
+    - area:  total part area / plate area
+    - wide:  parts longer than half the plate length can't sit side by side,
+             so their widths must stack within the plate width
+    - tall:  same for parts wider than half the plate width, along the length
+    - big:   parts that are both wide and tall need a plate each
+
+    Parts that don't fit on an empty plate at all are ignored (and counted).
+    With allow_rotate a part only counts as wide / tall / big if it is so in
+    both orientations.
+
+    Returns:
+        dict: {'area', 'wide', 'tall', 'big', 'lower_bound': max of them,
+               'unfit': pieces that fit no plate}
+    """
+    half_w = plate_w / 2
+    half_h = plate_h / 2
+
+    area = 0.0
+    wide_sum = 0.0
+    tall_sum = 0.0
+    big = 0
+    unfit = 0
+
+    for g in group_parts(parts_list):
+        l, w, q = g.length, g.width, g.remaining
+        orientations = [(l, w), (w, l)] if allow_rotate else [(l, w)]
+        fitting = [(a, b) for a, b in orientations if a <= plate_w and b <= plate_h]
+        if not fitting:
+            unfit += q
+            continue
+
+        area += l * w * q
+
+        # Must hold for every orientation the part could be placed in
+        if all(a > half_w for a, _ in fitting):
+            wide_sum += min(b for _, b in fitting) * q
+        if all(b > half_h for _, b in fitting):
+            tall_sum += min(a for a, _ in fitting) * q
+        if all(a > half_w and b > half_h for a, b in fitting):
+            big += q
+
+    bounds = {
+        'area': math.ceil(area / (plate_w * plate_h) - EPS) if area > 0 else 0,
+        'wide': math.ceil(wide_sum / plate_h - EPS) if wide_sum > 0 else 0,
+        'tall': math.ceil(tall_sum / plate_w - EPS) if tall_sum > 0 else 0,
+        'big': big,
+    }
+    bounds['lower_bound'] = max(bounds.values())
+    bounds['unfit'] = unfit
+    return bounds
+
+
+def plate_lower_bound(plate_w, plate_h, parts_list, allow_rotate=False):
+    """
+    Best of plate_lower_bounds as a single number.
+    """
+    return plate_lower_bounds(plate_w, plate_h, parts_list, allow_rotate)['lower_bound']
+
+
+def utilization_upper_bound(plate_w, plate_h, parts_list, allow_rotate=False):
+    """
+    Upper bound on the utilization of a single plate (0..1): the plate can't
+    hold more than all parts that fit on it (in either orientation with allow_rotate).
+    """
+    area = 0.0
+    for g in group_parts(parts_list):
+        fits = g.length <= plate_w and g.width <= plate_h
+        if allow_rotate:
+            fits = fits or (g.width <= plate_w and g.length <= plate_h)
+        if fits:
+            area += g.length * g.width * g.remaining
+    return min(1.0, area / (plate_w * plate_h)) if area > 0 else 0.0
+
+
+def optimality_gap(plate_w, plate_h, parts_list, plates, allow_rotate=False):
+    """
+    Gap between a nesting result and the lower bound.
+
+    Args:
+        plates: a Layout (single plate) or the plate dicts of iter_nesting_plates
+
+    Returns:
+        dict: {'plates': int, 'lower_bound': int, 'gap': plates - lower_bound,
+               'gap_pct': float, 'optimal': bool,
+               'utilization': float, 'utilization_bound': float}
+        For a single Layout the gap is in utilization instead
+        ('gap': utilization_bound - utilization, 0..1) and 'optimal' means
+        the utilization bound is reached.
+    """
+    bounds = plate_lower_bounds(plate_w, plate_h, parts_list, allow_rotate)
+    lb = bounds['lower_bound']
+
+    if hasattr(plates, 'utilization'):
+        # Single Layout
+        util = plates.utilization()
+        util_bound = utilization_upper_bound(plate_w, plate_h, parts_list, allow_rotate)
+        return {
+            'plates': 1,
+            'lower_bound': lb,
+            'gap': max(0.0, util_bound - util),
+            'gap_pct': 100.0 * (util_bound - util) / util_bound if util_bound > 0 else 0.0,
+            'optimal': util >= util_bound - EPS,
+            'utilization': util,
+            'utilization_bound': util_bound,
+        }
+
+    plates = list(plates)
+    n = len(plates)
+    total_area = sum(p['utilization'] for p in plates) * plate_w * plate_h
+    return {
+        'plates': n,
+        'lower_bound': lb,
+        'gap': n - lb,
+        'gap_pct': 100.0 * (n - lb) / lb if lb > 0 else 0.0,
+        'optimal': n <= lb,
+        'utilization': total_area / (n * plate_w * plate_h) if n else 0.0,
+        'utilization_bound': total_area / (lb * plate_w * plate_h) if lb else 0.0,
+    }
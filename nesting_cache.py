@@ -0,0 +1,262 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+from nesting_engine import calculate_nesting_layout, iter_nesting_plates
+
+# Bump when the engines change their output, so old disk entries are not reused
+CACHE_VERSION = 2
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".nesting_cache")
+
+
+def canonical_parts(parts_list, keep_order=False):
+    """
+    Canonical form of a parts list: valid entries as (length, width, quantity),
+    identical part types merged and sorted (unless keep_order is set, for
+    engines that nest in the given order).
+    
+    Returns:
+        (parts, sources): sources[i] is the parts_list index of canonical part i
+        (the first entry, for merged part types).
+    """
+    parts = []
+    sources = []
+    merged = {}
+    for idx, p in enumerate(parts_list):
+        try:
+            q = int(p['quantity'])
+            l = float(p['length'])
+            w = float(p['width'])
+        except: continue
+        if q <= 0 or l <= 0 or w <= 0:
+            continue
+        if keep_order:
+            parts.append((l, w, q))
+            sources.append(idx)
+        elif (l, w) in merged:
+            merged[(l, w)][1] += q
+        else:
+            merged[(l, w)] = [idx, q]
+
+    if not keep_order:
+        entries = sorted(merged.items(), key=lambda e: (-e[0][0], -e[0][1]))
+        parts = [(l, w, q) for (l, w), (_, q) in entries]
+        sources = [idx for _, (idx, _) in entries]
+    return parts, sources
+
+
+def _to_source_ids(layout, sources):
+    """
+    Maps part ids of a layout nested from the canonical list back to the
+    caller's parts_list indices. In place.
+    """
+    if len(layout.part_ids):
+        layout.part_ids = np.asarray(sources, dtype=np.int32)[layout.part_ids]
+
+
+def make_key(kind, plate_w, plate_h, parts, options):
+    """
+    SHA-256 of (version, kind, plate size, canonical parts, engine options).
+    """
+    payload = json.dumps(
+        [CACHE_VERSION, kind, float(plate_w), float(plate_h), parts, sorted(options.items())],
+        separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class NestingCache:
+    """
+    Two-level cache for nesting results: an in-memory LRU in front of an
+    on-disk store (one pickle per key) with size-based eviction of the least
+    recently used files.
+
+    Values are kept pickled, so every get returns a fresh copy that callers
+    may modify (e.g. remnant extension of h_lines) without touching the cache.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_memory_items=64, max_disk_bytes=256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        if self.cache_dir:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+            except OSError as e:
+                print(f"Nesting cache disabled on disk: {e}")
+                self.cache_dir = None
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".pkl")
+
+    def get(self, key):
+        """
+        Returns the cached value or None.
+        """
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+        elif self.cache_dir:
+            path = self._path(key)
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                os.utime(path)  # Mark as recently used for eviction
+                self._remember(key, data)
+            except OSError:
+                data = None
+
+        if data is None:
+            self.misses += 1
+            return None
+        try:
+            value = pickle.loads(data)
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, ValueError):
+            # Truncated or stale entry (e.g. from an older version), recompute it
+            self.misses += 1
+            self._forget(key)
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._remember(key, data)
+
+        if self.cache_dir:
+            tmp = None
+            try:
+                # Own temp file per writer, processes may store the same key at once
+                fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, self._path(key))
+                self._evict_disk()
+            except OSError as e:
+                print(f"Error writing nesting cache: {e}")
+                if tmp is not None and os.path.exists(tmp):
+                    os.remove(tmp)
+
+    def clear(self):
+        self._memory.clear()
+        if self.cache_dir:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".pkl"):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+    def _forget(self, key):
+        self._memory.pop(key, None)
+        if self.cache_dir:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def _remember(self, key, data):
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".pkl"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+        # Oldest first
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+_default_cache = None
+
+
+def get_default_cache():
+    """
+    Process-wide cache in DEFAULT_CACHE_DIR, created on first use.
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = NestingCache()
+    return _default_cache
+
+
+def cached_nesting_layout(plate_w, plate_h, parts_list, cache=None, compute=None, **options):
+    """
+    calculate_nesting_layout through the cache. Same arguments and result.
+    The parts are nested in canonical order, so the same part multiset gives
+    the same layout whatever order it was entered in.
+    compute: optional callable(canonical_parts_list) used on a miss instead of
+    calculate_nesting_layout (e.g. NestingSession.update).
+    """
+    if cache is None:
+        cache = get_default_cache()
+
+    keep_order = 'sort_key' in options and options['sort_key'] is None
+    parts, sources = canonical_parts(parts_list, keep_order)
+    key = make_key('layout', plate_w, plate_h, parts, options)
+
+    layout = cache.get(key)
+    if layout is None:
+        canon_list = [{'length': l, 'width': w, 'quantity': q} for l, w, q in parts]
+        if compute is not None:
+            layout = compute(canon_list)
+        else:
+            layout = calculate_nesting_layout(plate_w, plate_h, canon_list, **options)
+        cache.put(key, layout)
+    _to_source_ids(layout, sources)
+    return layout
+
+
+def cached_nesting_plates(plate_w, plate_h, parts_list, cache=None, **options):
+    """
+    iter_nesting_plates through the cache. On a miss the plates are still
+    yielded as they are nested, and stored once the job is complete.
+    """
+    if cache is None:
+        cache = get_default_cache()
+
+    keep_order = 'sort_key' in options and options['sort_key'] is None
+    parts, sources = canonical_parts(parts_list, keep_order)
+    key = make_key('plates', plate_w, plate_h, parts, options)
+
+    plates = cache.get(key)
+    if plates is not None:
+        for plate in plates:
+            _to_source_ids(plate['layout'], sources)
+            yield plate
+        return
+
+    canon_list = [{'length': l, 'width': w, 'quantity': q} for l, w, q in parts]
+    plates = []
+    for plate in iter_nesting_plates(plate_w, plate_h, canon_list, **options):
+        # Stored copy, the caller may modify what it gets
+        plates.append(pickle.loads(pickle.dumps(plate)))
+        _to_source_ids(plate['layout'], sources)
+        yield plate
+    cache.put(key, plates)
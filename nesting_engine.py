@@ -1,106 +1,719 @@
+import random
+
 import cv2
 import numpy as np
 from PIL import Image
 
-def calculate_nesting_layout(plate_w, plate_h, parts_list, align_top_left=True):
+ENGINES = ('column', 'guillotine')
+DIRECTIONS = ('column', 'row')
+
+# Part order keys, all Descending. 'length' is the original Column Packing order.
+SORT_KEYS = {
+    'length': lambda g: g.length,
+    'width': lambda g: g.width,
+    'area': lambda g: g.length * g.width,
+}
+
+
+class PartGroup:
+    """
+    Run-length group of identical parts: one part type and its remaining count.
+    The engines consume `remaining` instead of expanding every piece.
+    """
+    __slots__ = ('type_id', 'length', 'width', 'remaining')
+
+    def __init__(self, type_id, length, width, remaining):
+        self.type_id = type_id
+        self.length = length     # Horizontal
+        self.width = width       # Vertical
+        self.remaining = remaining
+
+    def __repr__(self):
+        return f"PartGroup({self.type_id}, {self.length}x{self.width}, remaining={self.remaining})"
+
+
+def _as_rows(data):
+    """
+    (N, 4) contiguous float64 array from a list of rows or an array.
+    """
+    if data is None:
+        return np.empty((0, 4), dtype=np.float64)
+    return np.ascontiguousarray(np.asarray(data, dtype=np.float64).reshape(-1, 4))
+
+
+class Layout:
+    """
+    Nesting result backed by contiguous NumPy arrays.
+    
+        v_cuts, h_cuts: (N, 4) float64 [x1, y1, x2, y2]
+        rects:          (N, 4) float64 [x, y, w, h] in Bottom-Left coordinates
+        part_ids:       (N,) int32, index of each rect's part in parts_list
+    
+    List-compatible accessors (v_lines, h_lines, placed_rects) return the old
+    list forms, and the object unpacks like the old result tuple:
+        v_lines, h_lines, placed_rects = calculate_nesting_layout(...)
     """
-    Calculates nesting layout for multiple parts using Column Packing strategy.
+    __slots__ = ('plate_w', 'plate_h', 'v_cuts', 'h_cuts', 'rects', 'part_ids')
+    
+    def __init__(self, plate_w, plate_h, v_cuts=None, h_cuts=None, rects=None, part_ids=None):
+        self.plate_w = plate_w
+        self.plate_h = plate_h
+        self.v_cuts = _as_rows(v_cuts)
+        self.h_cuts = _as_rows(h_cuts)
+        self.rects = _as_rows(rects)
+        if part_ids is None:
+            part_ids = np.full(len(self.rects), -1)
+        self.part_ids = np.ascontiguousarray(part_ids, dtype=np.int32)
+    
+    # --- List-compatible accessors ---
+    @property
+    def v_lines(self):
+        return self.v_cuts.tolist()
+    
+    @property
+    def h_lines(self):
+        return self.h_cuts.tolist()
+    
+    @property
+    def placed_rects(self):
+        return [tuple(r) for r in self.rects.tolist()]
+    
+    def __iter__(self):
+        return iter((self.v_lines, self.h_lines, self.placed_rects))
+    
+    def __getitem__(self, i):
+        return (self.v_lines, self.h_lines, self.placed_rects)[i]
+    
+    def __len__(self):
+        return 3
+    
+    def __repr__(self):
+        return (f"Layout({self.plate_w}x{self.plate_h}, {len(self.rects)} parts, "
+                f"{len(self.v_cuts)} vertical / {len(self.h_cuts)} horizontal cuts)")
+    
+    # --- Vectorized helpers ---
+    def placed_area(self):
+        return float(np.dot(self.rects[:, 2], self.rects[:, 3]))
+    
+    def utilization(self):
+        """
+        Ratio of placed part area to plate area (0..1).
+        """
+        if self.plate_w <= 0 or self.plate_h <= 0:
+            return 0.0
+        return self.placed_area() / (self.plate_w * self.plate_h)
+    
+    def part_counts(self):
+        """
+        Number of placed rects per part id, as {part_id: count}.
+        """
+        ids, counts = np.unique(self.part_ids, return_counts=True)
+        return dict(zip(ids.tolist(), counts.tolist()))
+    
+    def extend_remnant(self, epsilon=1.0):
+        """
+        Cut Remnant: extends the horizontal cuts that end at the right-most
+        x (within epsilon) to the plate edge. In place.
+        """
+        if len(self.h_cuts):
+            x2 = self.h_cuts[:, 2]
+            x2[np.abs(x2 - x2.max()) < epsilon] = self.plate_w
+    
+    def out_of_bounds(self, tol=1e-6):
+        """
+        Boolean mask of rects that are not fully inside the plate.
+        """
+        r = self.rects
+        return ((r[:, 0] < -tol) | (r[:, 1] < -tol) |
+                (r[:, 0] + r[:, 2] > self.plate_w + tol) | (r[:, 1] + r[:, 3] > self.plate_h + tol))
+    
+    def in_bounds(self, tol=1e-6):
+        return not self.out_of_bounds(tol).any()
+    
+    def scaled(self, sx, sy=None):
+        """
+        Copy scaled by (sx, sy), e.g. for a unit conversion.
+        """
+        if sy is None:
+            sy = sx
+        f = np.array([sx, sy, sx, sy])
+        return Layout(self.plate_w * sx, self.plate_h * sy,
+                      self.v_cuts * f, self.h_cuts * f, self.rects * f, self.part_ids.copy())
+
+
+def _concat_rows(blocks):
+    if not blocks:
+        return np.empty((0, 4), dtype=np.float64)
+    return np.concatenate(blocks)
+
+
+class _LayoutBuilder:
+    """
+    Collects the cuts / rects of one nesting run as NumPy blocks
+    (one block per stack of identical parts) and builds a Layout.
+    """
+    __slots__ = ('v_rows', 'h_blocks', 'rect_blocks', 'id_blocks')
+    
+    def __init__(self):
+        self.v_rows = []
+        self.h_blocks = []
+        self.rect_blocks = []
+        self.id_blocks = []
+    
+    def add_v_cut(self, x, y1, y2):
+        self.v_rows.append((x, y1, x, y2))
+    
+    def add_stack(self, x, ys, l, w, cut_width, floor_y, type_id):
+        """
+        Adds parts of size l x w at x with bottom edges ys, plus a horizontal
+        cut of cut_width under every part above floor_y.
+        """
+        n = len(ys)
+        rects = np.empty((n, 4))
+        rects[:, 0] = x
+        rects[:, 1] = ys
+        rects[:, 2] = l
+        rects[:, 3] = w
+        self.rect_blocks.append(rects)
+        self.id_blocks.append(np.full(n, type_id, dtype=np.int32))
+        
+        cut_ys = ys[ys > floor_y]
+        if len(cut_ys):
+            cuts = np.empty((len(cut_ys), 4))
+            cuts[:, 0] = x
+            cuts[:, 1] = cut_ys
+            cuts[:, 2] = x + cut_width
+            cuts[:, 3] = cut_ys
+            self.h_blocks.append(cuts)
+    
+    def extend(self, other):
+        self.v_rows.extend(other.v_rows)
+        self.h_blocks.extend(other.h_blocks)
+        self.rect_blocks.extend(other.rect_blocks)
+        self.id_blocks.extend(other.id_blocks)
+    
+    def build(self, plate_w, plate_h):
+        ids = np.concatenate(self.id_blocks) if self.id_blocks else np.empty(0, dtype=np.int32)
+        return Layout(plate_w, plate_h, self.v_rows or None, _concat_rows(self.h_blocks),
+                      _concat_rows(self.rect_blocks), ids)
+
+
+def group_parts(parts_list, sort_key='length', rotate=False):
+    """
+    Converts parts_list into PartGroups sorted by sort_key Descending
+    (default Length (Horizontal), None keeps the parts_list order).
+    rotate=True turns every part by 90 degrees.
+    Invalid or empty entries are skipped. type_id is the index in parts_list.
+    """
+    groups = []
+    for type_id, p in enumerate(parts_list):
+        try:
+            q = int(p['quantity'])
+            l = float(p['length']) # Horizontal
+            w = float(p['width'])  # Vertical
+            if rotate:
+                l, w = w, l
+            if q > 0 and l > 0 and w > 0:
+                groups.append(PartGroup(type_id, l, w, q))
+        except: continue
+    
+    # Stable sort, so equal keys keep the input order
+    if sort_key is not None:
+        groups.sort(key=SORT_KEYS[sort_key], reverse=True)
+    return groups
+
+
+def stack_count(used, w, limit, remaining):
+    """
+    Number of parts of height w that fit between used and limit (max remaining).
+    """
+    n = min(remaining, int((limit - used) // w))
+    # Guard float rounding of the division against the exact fit test
+    while n > 0 and used + n * w > limit:
+        n -= 1
+    while n < remaining and used + (n + 1) * w <= limit:
+        n += 1
+    return max(n, 0)
+
+
+def calculate_nesting_layout(plate_w, plate_h, parts_list, align_top_left=True, engine='column',
+                             sort_key='length', rotate=False, direction='column'):
+    """
+    Calculates nesting layout for multiple parts.
     
     Args:
         plate_w (float): Plate Length (Horizontal)
         plate_h (float): Plate Width (Vertical)
         parts_list (list): List of dicts [{'length': float, 'width': float, 'quantity': int}]
+        engine (str): 'column' (Column Packing, default) or 'guillotine' (Free-Rectangle Guillotine)
+        sort_key (str): Part order, 'length' (default), 'width' or 'area' (Descending),
+                        None to keep the parts_list order
+        rotate (bool): Turn every part by 90 degrees
+        direction (str): 'column' (columns left to right, default) or 'row' (rows top to bottom)
     
     Returns:
+        Layout, which unpacks like the old tuple:
         v_lines (list): List of [x1, y1, x2, y2]
         h_lines (list): List of [x1, y1, x2, y2]
         placed_rects (list): List of (x, y, w, h) in Bottom-Left coordinates
     """
+    groups = _prepare_groups(parts_list, engine, sort_key, rotate, direction)
+    layout = _nest_plate(engine, direction, plate_w, plate_h, groups)
     
-    # 1. Expand parts into individual items
-    items = []
-    for p in parts_list:
-        try:
-            q = int(p['quantity'])
-            l = float(p['length']) # Horizontal
-            w = float(p['width'])  # Vertical
-            if q > 0 and l > 0 and w > 0:
-                for _ in range(q):
-                    items.append({'l': l, 'w': w})
-        except: continue
+    for g in groups:
+        if g.remaining > 0:
+            print(f"Part {g.length}x{g.width} doesn't fit in remaining width. ({g.remaining} pcs dropped)")
+    return layout
+
+
+def iter_nesting_plates(plate_w, plate_h, parts_list, engine='column',
+                        sort_key='length', rotate=False, direction='column'):
+    """
+    Multi-Plate nesting. Opens a new plate of the same size whenever the
+    current one is full and yields each finished plate as soon as it is nested,
+    so G-code / previews for plate 1 can be produced while plate 2 is nested.
+    Options are the same as calculate_nesting_layout.
+    
+    Yields:
+        dict: {'plate': int (1-based), 'layout': Layout, 'utilization': float (0..1),
+               'v_lines', 'h_lines', 'placed_rects': the Layout's (N, 4) arrays}
+    """
+    groups = _prepare_groups(parts_list, engine, sort_key, rotate, direction)
+    plate_no = 0
+    
+    while groups:
+        layout = _nest_plate(engine, direction, plate_w, plate_h, groups)
+        
+        if not len(layout.rects):
+            # Nothing fits even on an empty plate
+            for g in groups:
+                print(f"Part {g.length}x{g.width} doesn't fit on plate {plate_w}x{plate_h}. ({g.remaining} pcs dropped)")
+            return
         
-    # 2. Sort by Length (Horizontal) Descending
-    items.sort(key=lambda x: x['l'], reverse=True)
-    
-    v_lines = []
-    h_lines = []
-    placed_rects = []
-    
-    current_x = 0
-    
-    # Column State
-    col_width = 0
-    current_y_from_top = 0 # Track usage in current column from top
-    
-    # Process items
-    i = 0
-    # Use a loop that allows reprocessing items if we start new column
-    while i < len(items):
-        item = items[i]
-        l = item['l']
-        w = item['w']
+        plate_no += 1
+        yield {
+            'plate': plate_no,
+            'layout': layout,
+            'v_lines': layout.v_cuts,
+            'h_lines': layout.h_cuts,
+            'placed_rects': layout.rects,
+            'utilization': layout.utilization(),
+        }
         
-        # Start new column if needed (first item or column full/mismatch)
+        groups = [g for g in groups if g.remaining > 0]
+
+
+def plate_utilization(placed_rects, plate_w, plate_h):
+    """
+    Ratio of placed part area to plate area (0..1).
+    """
+    if plate_w <= 0 or plate_h <= 0:
+        return 0.0
+    return Layout(plate_w, plate_h, rects=placed_rects).utilization()
+
+
+def summarize_plates(plates, parts_list=None):
+    """
+    Summary of a multi-plate job from the dicts yielded by iter_nesting_plates.
+    
+    Returns:
+        dict: {'plate_count': int, 'utilization': [float per plate],
+               'mean_utilization': float, 'parts_placed': int,
+               'parts_unplaced': int (only counted when parts_list is given)}
+    """
+    utils = [p['utilization'] for p in plates]
+    placed = sum(len(p['placed_rects']) for p in plates)
+    
+    unplaced = 0
+    if parts_list is not None:
+        requested = sum(g.remaining for g in group_parts(parts_list))
+        unplaced = requested - placed
+    
+    return {
+        'plate_count': len(utils),
+        'utilization': utils,
+        'mean_utilization': sum(utils) / len(utils) if utils else 0.0,
+        'parts_placed': placed,
+        'parts_unplaced': unplaced,
+    }
+
+
+def _prepare_groups(parts_list, engine, sort_key, rotate, direction):
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown nesting engine: {engine}")
+    if sort_key is not None and sort_key not in SORT_KEYS:
+        raise ValueError(f"Unknown sort key: {sort_key}")
+    if direction not in DIRECTIONS:
+        raise ValueError(f"Unknown nesting direction: {direction}")
+    
+    # Row-first packs on the transposed plate, where parts are turned too
+    if direction == 'row':
+        rotate = not rotate
+    return group_parts(parts_list, sort_key, rotate)
+
+
+def _nest_plate(engine, direction, plate_w, plate_h, groups):
+    """
+    Nests one plate. Row-first runs the engine on the transposed plate
+    (columns become rows) and maps the result back.
+    """
+    if direction != 'row':
+        return _run_engine(engine, plate_w, plate_h, groups)
+    
+    t = _run_engine(engine, plate_h, plate_w, groups)
+    
+    # Transposed (x', y') -> (plate_w - y', plate_h - x') keeps the Top-Left start.
+    # Transposed vertical cuts are horizontal cuts on the plate and vice versa.
+    def flip(cuts):
+        xs = plate_w - cuts[:, [1, 3]]
+        ys = plate_h - cuts[:, [0, 2]]
+        return np.column_stack((xs.min(axis=1), ys.min(axis=1), xs.max(axis=1), ys.max(axis=1)))
+    
+    r = t.rects
+    rects = np.column_stack((plate_w - (r[:, 1] + r[:, 3]), plate_h - (r[:, 0] + r[:, 2]), r[:, 3], r[:, 2]))
+    return Layout(plate_w, plate_h, flip(t.h_cuts), flip(t.v_cuts), rects, t.part_ids)
+
+
+def _run_engine(engine, plate_w, plate_h, groups):
+    if engine == 'guillotine':
+        return _guillotine_layout(plate_w, plate_h, groups)
+    return _column_layout(plate_w, plate_h, groups)
+
+
+def _column_layout(plate_w, plate_h, groups):
+    """
+    Column Packing: fills columns left to right, each column top to bottom.
+    A run of identical parts is stacked into a column in one step.
+    Consumes group.remaining; whatever is left did not fit on the plate.
+    """
+    out = _LayoutBuilder()
+    
+    state = COLUMN_START
+    for g in groups:
+        state = _column_place_group(plate_w, plate_h, g, state, out)
+    _column_close(plate_w, plate_h, state, out)
+            
+    return out.build(plate_w, plate_h)
+
+
+# Column State: (current_x, col_width, current_y_from_top)
+COLUMN_START = (0, 0, 0)
+
+
+def _column_place_group(plate_w, plate_h, g, state, out):
+    """
+    Places one part group onto the Column Packing state, adding its cuts
+    and rects to the _LayoutBuilder out. Returns the new state.
+    """
+    current_x, col_width, current_y_from_top = state
+    l = g.length
+    w = g.width
+    
+    while g.remaining > 0:
+        # Start new column if needed (first item or column full)
         if col_width == 0:
-            if current_x + l > plate_w:
-                print(f"Part {l}x{w} doesn't fit in remaining width.")
-                i += 1
-                continue
+            if current_x + l > plate_w or w > plate_h:
+                break # Doesn't fit in remaining width
             col_width = l
             current_y_from_top = 0
+        
+        # Check Vertical Fit for the whole run.
+        # A part longer than the column (non-Length order) needs a new column.
+        n = 0
+        if l <= col_width:
+            n = stack_count(current_y_from_top, w, plate_h, g.remaining)
+        if n > 0:
+            # Place the run, Horizontal Cut (Green) under each part except at the bottom edge
+            ys = plate_h - (current_y_from_top + np.arange(1, n + 1) * w)
+            out.add_stack(current_x, ys, l, w, col_width, 0, g.type_id)
             
-        # Check Vertical Fit
-        if current_y_from_top + w <= plate_h:
-            # Place it
-            x_pos = current_x
-            y_pos = plate_h - (current_y_from_top + w)
-            
-            placed_rects.append((x_pos, y_pos, l, w))
-            
-            # Horizontal Cut (Green)
-            if y_pos > 0: # Don't cut bottom edge
-                h_lines.append([x_pos, y_pos, x_pos + col_width, y_pos])
-                
-            current_y_from_top += w
-            i += 1 # Item placed
+            current_y_from_top += n * w
+            g.remaining -= n
         else:
             # Column Full
-            # Finish this column
-            
             # Vertical Cut (Blue) at right of column
             cut_x = current_x + col_width
             if cut_x < plate_w:
-                v_lines.append([cut_x, 0, cut_x, plate_h])
+                out.add_v_cut(cut_x, 0, plate_h)
             
             current_x += col_width
             
-            # Reset
+            # Reset, try to place the rest in next column
             col_width = 0
-            # Do NOT increment i, try to place this item in next column
-            
-    # Close last column
+    
+    return (current_x, col_width, current_y_from_top)
+
+
+def _column_close(plate_w, plate_h, state, out):
+    """
+    Close last column
+    """
+    current_x, col_width, _ = state
     if col_width > 0:
         cut_x = current_x + col_width
         if cut_x < plate_w:
-            v_lines.append([cut_x, 0, cut_x, plate_h])
+            out.add_v_cut(cut_x, 0, plate_h)
+
+
+class NestingSession:
+    """
+    Incremental Column Packing for interactive editing.
+    
+    Keeps the packer state before every part group and the cuts / rects each
+    group produced. update() compares the new parts list with the previous
+    one (in nesting order) and re-packs only from the first group that
+    changed; the columns of all groups before it are reused as they are.
+    The result is identical to calculate_nesting_layout (column engine).
+    """
+    
+    def __init__(self, plate_w=0, plate_h=0):
+        self.plate_w = plate_w
+        self.plate_h = plate_h
+        self._keys = []      # (length, width, quantity) per group, in nesting order
+        self._states = [COLUMN_START]  # state before group i
+        self._segments = []  # _LayoutBuilder with the cuts / rects produced by group i
+        self._type_ids = []  # current parts_list index of group i
+        self.last_repacked = 0  # groups re-packed by the last update()
+    
+    def set_plate(self, plate_w, plate_h):
+        if (plate_w, plate_h) != (self.plate_w, self.plate_h):
+            self.plate_w = plate_w
+            self.plate_h = plate_h
+            self.reset()
+    
+    def reset(self):
+        self._keys = []
+        self._states = [COLUMN_START]
+        self._segments = []
+        self._type_ids = []
+    
+    def update(self, parts_list):
+        """
+        Re-nests parts_list, reusing everything before the first changed group.
+        Returns a Layout like calculate_nesting_layout.
+        """
+        groups = group_parts(parts_list)
+        keys = [(g.length, g.width, g.remaining) for g in groups]
+        
+        # First group that differs from the previous update
+        first = 0
+        while first < len(keys) and first < len(self._keys) and keys[first] == self._keys[first]:
+            first += 1
+        
+        self._keys = keys
+        self._type_ids = [g.type_id for g in groups]
+        del self._states[first + 1:]
+        del self._segments[first:]
+        
+        state = self._states[first]
+        for g in groups[first:]:
+            segment = _LayoutBuilder()
+            state = _column_place_group(self.plate_w, self.plate_h, g, state, segment)
+            self._segments.append(segment)
+            self._states.append(state)
+        self.last_repacked = len(groups) - first
+        
+        return self.layout()
+    
+    def layout(self):
+        out = _LayoutBuilder()
+        for segment in self._segments:
+            out.extend(segment)
+        _column_close(self.plate_w, self.plate_h, self._states[-1], out)
+        layout = out.build(self.plate_w, self.plate_h)
+        
+        # Reused segments may carry the index a part had before an edit
+        counts = [sum(len(b) for b in segment.rect_blocks) for segment in self._segments]
+        layout.part_ids = np.repeat(np.array(self._type_ids, dtype=np.int32), counts)
+        return layout
+
+
+class _FreeNode:
+    __slots__ = ('key', 'prio', 'left', 'right', 'hmax')
+
+    def __init__(self, key, prio):
+        self.key = key          # (w, h, x, y)
+        self.prio = prio
+        self.left = None
+        self.right = None
+        self.hmax = key[1]      # Tallest free rectangle in this subtree
+
+
+class _FreeRects:
+    """
+    Index of free rectangles (w, h, x, y) for Guillotine Packing: a treap
+    ordered by (w, h, x, y) where every node also knows the greatest height
+    in its subtree. The best fit (narrowest rectangle at least l wide, of
+    those the lowest one at least w tall) is one descent that skips every
+    subtree without a tall enough rectangle, and inserts / removals are
+    splits and merges, all O(log n) expected.
+    """
+    __slots__ = ('root', 'rng')
+
+    def __init__(self, seed=0):
+        self.root = None
+        self.rng = random.Random(seed)
+
+    @staticmethod
+    def _update(node):
+        h = node.key[1]
+        if node.left is not None and node.left.hmax > h:
+            h = node.left.hmax
+        if node.right is not None and node.right.hmax > h:
+            h = node.right.hmax
+        node.hmax = h
+
+    def _split(self, node, key):
+        """
+        (keys < key, keys >= key)
+        """
+        if node is None:
+            return None, None
+        if node.key < key:
+            node.right, right = self._split(node.right, key)
+            self._update(node)
+            return node, right
+        left, node.left = self._split(node.left, key)
+        self._update(node)
+        return left, node
+
+    def _merge(self, a, b):
+        # All keys of a are below the keys of b
+        if a is None:
+            return b
+        if b is None:
+            return a
+        if a.prio > b.prio:
+            a.right = self._merge(a.right, b)
+            self._update(a)
+            return a
+        b.left = self._merge(a, b.left)
+        self._update(b)
+        return b
+
+    def _relink(self, path, key, new):
+        # Puts new in the place of key below the last node of path, fixes hmax up the path
+        if not path:
+            self.root = new
+            return
+        parent = path[-1]
+        if key < parent.key:
+            parent.left = new
+        else:
+            parent.right = new
+        for node in reversed(path):
+            self._update(node)
+
+    def add(self, key):
+        new = _FreeNode(key, self.rng.random())
+        path = []
+        node = self.root
+        while node is not None and node.prio > new.prio:
+            path.append(node)
+            node = node.left if key < node.key else node.right
+        new.left, new.right = self._split(node, key)
+        self._update(new)
+        self._relink(path, key, new)
+
+    def _find(self, l, w):
+        # Nodes at least l wide on the way down, widest first: each one's key
+        # and right subtree come before the one above it
+        candidates = []
+        node = self.root
+        while node is not None and node.hmax >= w:
+            if node.key[0] < l:
+                # This node and its left subtree are too narrow
+                node = node.right
+            else:
+                candidates.append(node)
+                node = node.left
+        
+        for cand in reversed(candidates):
+            if cand.key[1] >= w:
+                return cand.key
+            node = cand.right
+            if node is not None and node.hmax >= w:
+                # Everything here is wide enough: leftmost tall enough rectangle
+                while True:
+                    if node.left is not None and node.left.hmax >= w:
+                        node = node.left
+                    elif node.key[1] >= w:
+                        return node.key
+                    else:
+                        node = node.right
+        return None
+
+    def pop_fit(self, l, w):
+        """
+        Removes and returns the best free rectangle for a part l x w, or None.
+        """
+        key = self._find(l, w)
+        if key is None:
+            return None
+        path = []
+        node = self.root
+        while node.key != key:
+            path.append(node)
+            node = node.left if key < node.key else node.right
+        self._relink(path, key, self._merge(node.left, node.right))
+        return key
+
+
+def _guillotine_layout(plate_w, plate_h, groups):
+    """
+    Guillotine Packing with an indexed set of free rectangles.
+    
+    Free rectangles live in a _FreeRects index, so the best-fit lookup
+    (narrowest rectangle that still takes the part's length, then the lowest
+    of those tall enough) is O(log n) instead of a scan over every free area.
+    Each placement stacks as many
+    parts of the group as fit at the top of the free rectangle, then splits
+    it with a full-height vertical cut (right remainder) and a horizontal cut
+    under the stack (remainder below), so gaps are filled again later.
+    Consumes group.remaining; whatever is left did not fit on the plate.
+    """
+    out = _LayoutBuilder()
+    
+    # Free rectangles as (w, h, x, y). Bottom-Left coordinates.
+    free = _FreeRects()
+    free.add((plate_w, plate_h, 0, 0))
+    
+    for g in groups:
+        l = g.length
+        w = g.width
+        
+        while g.remaining > 0:
+            # Narrowest rectangle wide enough, the lowest of those tall enough
+            fit = free.pop_fit(l, w)
+            if fit is None:
+                break # Doesn't fit in remaining free area
+            
+            fw, fh, fx, fy = fit
+            n = max(1, stack_count(0, w, fh, g.remaining))
+            
+            # Stack from Top-Left of the free rectangle (same as column packing),
+            # Horizontal Cut (Green) under each part above the free rectangle's bottom
+            ys = fy + fh - np.arange(1, n + 1) * w
+            out.add_stack(fx, ys, l, w, l, fy, g.type_id)
+            g.remaining -= n
             
-    return v_lines, h_lines, placed_rects
+            # Vertical Cut (Blue) at right of the stack, full height of free rectangle
+            if fw > l:
+                out.add_v_cut(fx + l, fy, fy + fh)
+                free.add((fw - l, fh, fx + l, fy))
+            
+            if fh > n * w:
+                free.add((l, fh - n * w, fx, fy))
+            
+    return out.build(plate_w, plate_h)
 
 
-def create_preview_image(plate_w, plate_h, v_lines, h_lines, parts_rects, img_size=(600, 400)):
+def create_preview_image(plate_w, plate_h, v_lines, h_lines, parts_rects, img_size=(600, 400), overlays=()):
     """
     Creates a visual preview.
     Note: Can handle parts_rects as (x,y,w,h) in Bottom-Left coords.
+    Lines and rects may be lists or (N, 4) arrays (e.g. from a Layout).
+    overlays: extra (lines, (r, g, b), thickness) drawn on top, e.g. rapids.
     """
     # Create blank white image
     img = np.ones((img_size[1], img_size[0], 3), dtype=np.uint8) * 255
@@ -118,42 +731,35 @@ def create_preview_image(plate_w, plate_h, v_lines, h_lines, parts_rects, img_si
     origin_x = pad + (avail_w - plate_w * scale) / 2
     origin_y = img_size[1] - pad - (avail_h - plate_h * scale) / 2
     
-    def to_pix(x, y):
-        # Input x,y are Bottom-Left based.
+    def to_pix(xy):
+        # Input x,y columns are Bottom-Left based.
         # Image Y is Top-Down.
         # So y=0 -> px_y = origin_y
         # y=H -> px_y = origin_y - H*scale
-        px = int(origin_x + x * scale)
-        py = int(origin_y - y * scale)
-        return px, py
+        px = origin_x + xy[..., 0] * scale
+        py = origin_y - xy[..., 1] * scale
+        return np.stack((px, py), axis=-1).astype(np.int32)
 
     # Draw Plate Border
-    p0 = to_pix(0, 0)
-    p1 = to_pix(plate_w, plate_h)
-    cv2.rectangle(img, (p0[0], p1[1]), (p1[0], p0[1]), (0, 0, 0), 2)
-
-    # Draw Parts
-    for (px, py, pw, ph) in parts_rects:
-        # px, py are bottom-left
-        pt_bl = to_pix(px, py)
-        pt_tr = to_pix(px + pw, py + ph) # Top-Right
-        
-        cv2.rectangle(img, (pt_bl[0], pt_tr[1]), (pt_tr[0], pt_bl[1]), (220, 220, 220), -1)
-        cv2.rectangle(img, (pt_bl[0], pt_tr[1]), (pt_tr[0], pt_bl[1]), (150, 150, 150), 1)
+    p0, p1 = to_pix(np.array([[0, 0], [plate_w, plate_h]], dtype=np.float64))
+    cv2.rectangle(img, (int(p0[0]), int(p1[1])), (int(p1[0]), int(p0[1])), (0, 0, 0), 2)
+
+    # Draw Parts, all at once as polygons
+    # px, py are bottom-left
+    rects = _as_rows(parts_rects)
+    if len(rects):
+        x, y, w, h = rects.T
+        corners = np.stack((np.column_stack((x, y)), np.column_stack((x + w, y)),
+                            np.column_stack((x + w, y + h)), np.column_stack((x, y + h))), axis=1)
+        polys = to_pix(corners)
+        cv2.fillPoly(img, list(polys), (220, 220, 220))
+        cv2.polylines(img, list(polys), True, (150, 150, 150), 1)
 
     # Draw Lines
-    # Vertical - Blue
-    for coords in v_lines:
-        x1, y1, x2, y2 = coords
-        pt1 = to_pix(x1, y1)
-        pt2 = to_pix(x2, y2)
-        cv2.line(img, pt1, pt2, (255, 0, 0), 2)
-        
-    # Horizontal - Green
-    for coords in h_lines:
-        x1, y1, x2, y2 = coords
-        pt1 = to_pix(x1, y1)
-        pt2 = to_pix(x2, y2)
-        cv2.line(img, pt1, pt2, (0, 200, 0), 2)
+    # Vertical - Blue, Horizontal - Green
+    for lines, color, thickness in ((v_lines, (255, 0, 0), 2), (h_lines, (0, 200, 0), 2)) + tuple(overlays):
+        segs = _as_rows(lines)
+        if len(segs):
+            cv2.polylines(img, list(to_pix(segs.reshape(-1, 2, 2))), False, color, thickness)
 
     return Image.fromarray(img)
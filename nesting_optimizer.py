@@ -0,0 +1,364 @@
+import contextlib
+import io
+import itertools
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+from nesting_engine import (calculate_nesting_layout, iter_nesting_plates, summarize_plates, group_parts,
+                            stack_count, ENGINES, SORT_KEYS, DIRECTIONS)
+from nesting_bounds import plate_lower_bound, plate_lower_bounds, utilization_upper_bound
+
+
+def strategy_variants(engines=ENGINES, sort_keys=tuple(SORT_KEYS), rotations=(False, True), directions=DIRECTIONS):
+    """
+    All combinations of nesting options as keyword dicts for iter_nesting_plates.
+    The first entry is the default strategy (column engine, length order).
+    """
+    variants = []
+    for engine, sort_key, rotate, direction in itertools.product(engines, sort_keys, rotations, directions):
+        variants.append({'engine': engine, 'sort_key': sort_key, 'rotate': rotate, 'direction': direction})
+    return variants
+
+
+def strategy_name(strategy):
+    """
+    Short label like 'column/length/rot/row'.
+    """
+    rot = 'rot' if strategy['rotate'] else 'norot'
+    return f"{strategy['engine']}/{strategy['sort_key']}/{rot}/{strategy['direction']}"
+
+
+def score_summary(summary):
+    """
+    Sort key for a job summary, lower is better: fewest unplaced parts, then
+    fewest plates, then the emptiest last plate (all other plates are fuller,
+    which leaves the largest remnant).
+    """
+    last = summary['utilization'][-1] if summary['utilization'] else 0.0
+    return (summary['parts_unplaced'], summary['plate_count'], last)
+
+
+def _evaluate_strategy(plate_w, plate_h, parts_list, strategy, deadline):
+    """
+    Worker: nests the whole job with one strategy and returns its summary.
+    Only the summary goes back to the parent, the winner is re-nested there.
+    Returns None if the deadline passes before the job is finished.
+    """
+    plates = []
+    # Dropped parts are reported by the summary, not printed by every worker
+    with contextlib.redirect_stdout(io.StringIO()):
+        for plate in iter_nesting_plates(plate_w, plate_h, parts_list, **strategy):
+            plates.append({'placed_rects': plate['placed_rects'], 'utilization': plate['utilization']})
+            if time.time() > deadline:
+                return None
+    return summarize_plates(plates, parts_list)
+
+
+def search_nesting_strategies(plate_w, plate_h, parts_list, time_budget=10.0, max_workers=None, strategies=None):
+    """
+    Runs many nesting strategies in parallel (one process per core) and
+    returns the best one found within time_budget seconds. Stops early once a
+    strategy reaches the plate lower bound (see nesting_bounds).
+
+    Args:
+        plate_w (float): Plate Length (Horizontal)
+        plate_h (float): Plate Width (Vertical)
+        parts_list (list): List of dicts [{'length': float, 'width': float, 'quantity': int}]
+        time_budget (float): Wall-clock budget in seconds
+        max_workers (int): Worker processes (default: all cores)
+        strategies (list): Option dicts for iter_nesting_plates (default: strategy_variants())
+
+    Returns:
+        dict: {'strategy': dict, 'name': str, 'summary': dict, 'evaluated': int, 'total': int,
+               'timed_out': bool, 'lower_bound': int, 'reached_bound': bool, 'elapsed': float}
+        or None if no strategy finished within the budget.
+    """
+    if strategies is None:
+        strategies = strategy_variants()
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    start = time.time()
+    deadline = start + time_budget
+
+    bounds = plate_lower_bounds(plate_w, plate_h, parts_list,
+                                allow_rotate=any(s.get('rotate') for s in strategies))
+
+    best = None
+    evaluated = 0
+    timed_out = False
+    reached_bound = False
+
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {
+            executor.submit(_evaluate_strategy, plate_w, plate_h, parts_list, s, deadline): s
+            for s in strategies
+        }
+        pending = set(futures)
+        while pending:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                timed_out = True
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for fut in done:
+                summary = fut.result()
+                if summary is None:
+                    continue
+                evaluated += 1
+                if best is None or score_summary(summary) < score_summary(best[1]):
+                    best = (futures[fut], summary)
+            # No strategy can use fewer plates than the lower bound
+            if best is not None and best[1]['parts_unplaced'] <= bounds['unfit'] \
+                    and best[1]['plate_count'] <= bounds['lower_bound']:
+                reached_bound = True
+                break
+    finally:
+        # Drop queued strategies, running ones stop themselves at the deadline
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if best is None:
+        return None
+
+    strategy, summary = best
+    return {
+        'strategy': strategy,
+        'name': strategy_name(strategy),
+        'summary': summary,
+        'evaluated': evaluated,
+        'total': len(strategies),
+        'timed_out': timed_out,
+        'lower_bound': bounds['lower_bound'],
+        'reached_bound': reached_bound,
+        'elapsed': time.time() - start,
+    }
+
+
+class _ColumnEvaluator:
+    """
+    Counts-only replay of Column Packing for one plate, used to score part
+    orders cheaply. The packer state before every position of the order is
+    kept, so a move that changes positions i.. only replays from position i.
+    """
+
+    def __init__(self, plate_w, plate_h, dims):
+        self.plate_w = plate_w
+        self.plate_h = plate_h
+        self.dims = dims  # type_id -> (length, width, quantity)
+
+    def step(self, state, type_id, rotated):
+        """
+        Packs one part group onto the state (x, col_width, used_y, area).
+        Same decisions as nesting_engine._column_layout.
+        """
+        x, col_width, used, area = state
+        l, w, rem = self.dims[type_id]
+        if rotated:
+            l, w = w, l
+
+        while rem > 0:
+            if col_width == 0:
+                if x + l > self.plate_w or w > self.plate_h:
+                    break
+                col_width = l
+                used = 0
+            n = stack_count(used, w, self.plate_h, rem) if l <= col_width else 0
+            if n > 0:
+                used += n * w
+                rem -= n
+                area += n * l * w
+            else:
+                x += col_width
+                col_width = 0
+        return (x, col_width, used, area)
+
+    def replay(self, order, states, start):
+        """
+        Replays order from position start. states[i] is the state before
+        position i (len(order) + 1 entries). Returns the new tail of states.
+        """
+        tail = [states[start]]
+        for type_id, rotated in order[start:]:
+            tail.append(self.step(tail[-1], type_id, rotated))
+        return tail
+
+    def energy(self, final_state):
+        """
+        Lower is better: placed area first, then the narrowest used length
+        (largest remnant at the right end of the plate).
+        """
+        x, col_width, _, area = final_state
+        plate_area = self.plate_w * self.plate_h
+        return -area / plate_area + 1e-3 * (x + col_width) / self.plate_w
+
+
+def anneal_nesting_order(plate_w, plate_h, parts_list, time_budget=2.0, on_improve=None, seed=None,
+                         allow_rotate=True):
+    """
+    Anytime Simulated Annealing over the part order and rotations of the
+    Column Packing engine for one plate (maximizes plate yield).
+
+    Starts from the default Length Descending order, so the result is never
+    worse than calculate_nesting_layout. Candidates are scored by replaying
+    the packer from the first changed position only. Stops early when the
+    single-plate utilization bound is reached.
+
+    Args:
+        plate_w (float): Plate Length (Horizontal)
+        plate_h (float): Plate Width (Vertical)
+        parts_list (list): List of dicts [{'length': float, 'width': float, 'quantity': int}]
+        time_budget (float): Wall-clock budget in seconds
+        on_improve (callable): Called with the best-so-far dict whenever it improves
+        seed (int): Random seed
+        allow_rotate (bool): Also try turning part types by 90 degrees
+
+    Returns:
+        dict: {'order': [(type_id, rotated)], 'parts_list': reordered parts_list,
+               'utilization': float, 'layout': (v_lines, h_lines, placed_rects),
+               'iterations': int, 'elapsed': float}
+    """
+    rng = random.Random(seed)
+    start_time = time.time()
+
+    groups = group_parts(parts_list)
+    dims = {g.type_id: (g.length, g.width, g.remaining) for g in groups}
+    plate_area = plate_w * plate_h
+    # Stop once the plate holds as much as it possibly can
+    target_area = utilization_upper_bound(plate_w, plate_h, parts_list, allow_rotate) * plate_area
+
+    evaluator = _ColumnEvaluator(plate_w, plate_h, dims)
+    order = [(g.type_id, False) for g in groups]
+    states = evaluator.replay(order, [(0, 0, 0, 0.0)], 0)
+    energy = evaluator.energy(states[-1])
+
+    def publish(iteration):
+        best = {
+            'order': list(best_order),
+            'utilization': best_states_area / plate_area if plate_area > 0 else 0.0,
+            'iteration': iteration,
+            'elapsed': time.time() - start_time,
+        }
+        if on_improve is not None:
+            on_improve(best)
+
+    best_order, best_energy, best_states_area = list(order), energy, states[-1][3]
+    publish(0)
+
+    n = len(order)
+    # Neighbour moves that can change anything: swap two positions, move one
+    # (both need two part types) or rotate one part type
+    moves, weights = [], []
+    if n > 1:
+        moves += ['swap', 'move']
+        weights += [0.4, 0.4]
+    if allow_rotate and n > 0:
+        moves.append('rotate')
+        weights.append(0.2)
+    iteration = 0
+    # Temperature in utilization units, cooled linearly over the budget
+    t0 = 0.02
+    # No moves (a single part type without rotation): the initial order is the answer
+    while moves and time.time() - start_time < time_budget:
+        # Nothing left to gain once the utilization bound is reached
+        if best_states_area >= target_area - 1e-9:
+            break
+        iteration += 1
+
+        cand = list(order)
+        move = rng.choices(moves, weights)[0]
+        i = rng.randrange(n)
+        if move == 'rotate':
+            type_id, rotated = cand[i]
+            cand[i] = (type_id, not rotated)
+            first = i
+        else:
+            # Another position than i, so the candidate always differs
+            j = rng.randrange(n - 1)
+            j += j >= i
+            if move == 'swap':
+                cand[i], cand[j] = cand[j], cand[i]
+            else:
+                cand.insert(j, cand.pop(i))
+            first = min(i, j)
+
+        tail = evaluator.replay(cand, states, first)
+        cand_energy = evaluator.energy(tail[-1])
+        delta = cand_energy - energy
+
+        temp = t0 * max(1e-3, 1.0 - (time.time() - start_time) / time_budget)
+        if delta <= 0 or rng.random() < math.exp(-delta / temp):
+            order = cand
+            states = states[:first] + tail
+            energy = cand_energy
+            if energy < best_energy - 1e-12:
+                best_order, best_energy, best_states_area = list(order), energy, states[-1][3]
+                publish(iteration)
+
+    # Build the real layout for the best order
+    best_parts = []
+    for type_id, rotated in best_order:
+        l, w, q = dims[type_id]
+        if rotated:
+            l, w = w, l
+        best_parts.append({'length': l, 'width': w, 'quantity': q})
+    layout = calculate_nesting_layout(plate_w, plate_h, best_parts, sort_key=None)
+
+    return {
+        'order': best_order,
+        'parts_list': best_parts,
+        'utilization': best_states_area / plate_area if plate_area > 0 else 0.0,
+        'layout': layout,
+        'iterations': iteration,
+        'elapsed': time.time() - start_time,
+    }
+
+
+def iter_annealed_plates(plate_w, plate_h, parts_list, time_budget=10.0, seed=None, allow_rotate=True):
+    """
+    Multi-Plate Column Packing where the part order and rotations of every
+    plate are chosen by anneal_nesting_order. The budget left is shared by the
+    plates still needed (plate lower bound), so a big job doesn't spend it all
+    on plate 1. Plates are yielded like iter_nesting_plates, part_ids index
+    parts_list.
+    """
+    deadline = time.time() + time_budget
+    remaining = [dict(p) for p in parts_list]
+    plate_no = 0
+
+    while any(g.remaining > 0 for g in group_parts(remaining)):
+        plates_left = max(1, plate_lower_bound(plate_w, plate_h, remaining, allow_rotate))
+        budget = max(0.0, deadline - time.time()) / plates_left
+        # The single plate layout reports every part that is left for the next plate
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = anneal_nesting_order(plate_w, plate_h, remaining, time_budget=budget, seed=seed,
+                                          allow_rotate=allow_rotate)
+        layout = result['layout']
+
+        if not len(layout.rects):
+            # Nothing fits even on an empty plate
+            for g in group_parts(remaining):
+                print(f"Part {g.length}x{g.width} doesn't fit on plate {plate_w}x{plate_h}. ({g.remaining} pcs dropped)")
+            return
+
+        # Layout part_ids index the reordered list, map them back to parts_list
+        type_ids = np.array([type_id for type_id, _ in result['order']], dtype=np.int32)
+        placed = np.bincount(layout.part_ids, minlength=len(type_ids))
+        for type_id, n in zip(type_ids, placed):
+            remaining[type_id]['quantity'] = int(remaining[type_id]['quantity']) - int(n)
+        layout.part_ids = type_ids[layout.part_ids]
+
+        plate_no += 1
+        yield {
+            'plate': plate_no,
+            'layout': layout,
+            'v_lines': layout.v_cuts,
+            'h_lines': layout.h_cuts,
+            'placed_rects': layout.rects,
+            'utilization': layout.utilization(),
+        }
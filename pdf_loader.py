@@ -1,7 +1,289 @@
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
 import fitz  # PyMuPDF
 import numpy as np
 import cv2
-import re
+
+from toolpath import merge_collinear_cuts
+
+# Filled rectangles at most this thin (points) are lines drawn as fills
+THIN_FILL = 2.0
+
+def _parse_dimensions(text):
+    """
+    W (Width/Vertical) and L (Length/Horizontal) values from the page text,
+    None where not found.
+    """
+    # Regex patterns to find "W : <number>" and "L : <number>"
+    # Pattern handles: W: 123.45, W : 123.45, W:123.45
+    w_pattern = r"W\s*[:]\s*([0-9.]+)"
+    l_pattern = r"L\s*[:]\s*([0-9.]+)"
+    
+    w_match = re.search(w_pattern, text, re.IGNORECASE)
+    l_match = re.search(l_pattern, text, re.IGNORECASE)
+    
+    w_val = float(w_match.group(1)) if w_match else None
+    l_val = float(l_match.group(1)) if l_match else None
+    
+    return w_val, l_val
+
+
+def _parse_table(text):
+    """
+    Part rows of the cut table in the page text, counted per size:
+    [{'length': float, 'width': float, 'quantity': int}, ...]
+    """
+    # Regex to match the table row structure shown in screenshot:
+    # 절단 ... W ... L
+    pattern = r"절단\s+\S+\s+\S+\s+(\d+(?:\.\d+)?)\s+(\d+(?:\.\d+)?)"
+    matches = re.findall(pattern, text)
+    
+    parts_map = {}
+    
+    for m in matches:
+        try:
+            val1 = float(m[0])
+            val2 = float(m[1])
+            
+            # Map to L (Horizontal) and W (Vertical)
+            # L is larger, W is smaller
+            l = max(val1, val2)
+            w = min(val1, val2)
+            
+            key = (l, w)
+            if key in parts_map:
+                parts_map[key] += 1
+            else:
+                parts_map[key] = 1
+        except:
+            continue
+            
+    # Convert map to list
+    parts_list = []
+    for (l, w), q in parts_map.items():
+        parts_list.append({'length': l, 'width': w, 'quantity': q})
+    return parts_list
+
+
+class _PixmapArray(np.ndarray):
+    """
+    NumPy view of a Pixmap's sample buffer. The view holds the Pixmap, so
+    the buffer lives as long as the array (or any slice of it) does.
+    """
+
+    def __array_finalize__(self, obj):
+        self.pixmap = getattr(obj, 'pixmap', None)
+
+
+def _render(page, dpi, gray=False, clip=None):
+    """
+    Renders a page as an OpenCV (BGR) image.
+    gray: render a single channel pixmap instead and return a view of its
+          samples (no copy, no color conversion)
+    clip: fitz.Rect / (x0, y0, x1, y1) in points to render only that part
+          of the page; pixel (0, 0) is then its top-left corner
+    """
+    # Increase resolution for better detection
+    zoom = dpi / 72  # 72 is the default PDF DPI
+    mat = fitz.Matrix(zoom, zoom)
+    clip = fitz.Rect(clip) if clip is not None else None
+    
+    if gray:
+        pix = page.get_pixmap(matrix=mat, colorspace=fitz.csGRAY, alpha=False, clip=clip)
+        img = _PixmapArray((pix.h, pix.w), dtype=np.uint8, buffer=pix.samples_mv, strides=(pix.stride, 1))
+        img.pixmap = pix
+        return img
+    
+    pix = page.get_pixmap(matrix=mat, clip=clip)
+    
+    # Convert to numpy array
+    # pix.samples is a bytes object, we need to convert it
+    img_array = np.frombuffer(pix.samples, dtype=np.uint8)
+    
+    if pix.n == 3:  # RGB
+        img = img_array.reshape((pix.h, pix.w, 3))
+        img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR) # Convert to BGR for OpenCV
+    elif pix.n == 4:  # RGBA
+        img = img_array.reshape((pix.h, pix.w, 4))
+        img = cv2.cvtColor(img, cv2.COLOR_RGBA2BGR)
+    elif pix.n == 1: # Gray
+        img = img_array.reshape((pix.h, pix.w))
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    else:
+        raise ValueError(f"Unsupported number of channels: {pix.n}")
+    return img
+
+
+def _path_segments(path):
+    """
+    Straight segments [(p1, p2)] of one page.get_drawings() path: lines,
+    stroked rectangle / quad edges and the center line of thin filled
+    rectangles. Curves are skipped.
+    """
+    stroked = 's' in (path.get('type') or '')
+    segments = []
+    for item in path['items']:
+        kind = item[0]
+        if kind == 'l':
+            segments.append((item[1], item[2]))
+        elif kind == 're':
+            r = item[1]
+            if stroked:
+                corners = [r.tl, r.tr, r.br, r.bl]
+                segments.extend(zip(corners, corners[1:] + corners[:1]))
+            elif r.width <= THIN_FILL or r.height <= THIN_FILL:
+                if r.width <= r.height:
+                    cx = (r.x0 + r.x1) / 2
+                    segments.append((fitz.Point(cx, r.y0), fitz.Point(cx, r.y1)))
+                else:
+                    cy = (r.y0 + r.y1) / 2
+                    segments.append((fitz.Point(r.x0, cy), fitz.Point(r.x1, cy)))
+        elif kind == 'qu' and stroked:
+            q = item[1]
+            corners = [q.ul, q.ur, q.lr, q.ll]
+            segments.extend(zip(corners, corners[1:] + corners[:1]))
+    return segments
+
+
+def _vector_lines(page, min_length, tol):
+    """
+    Axis-aligned lines of a page's drawings, see extract_vector_lines.
+    """
+    # Drawings are in unrotated page space
+    rot = page.rotation_matrix
+    segments = []
+    for path in page.get_drawings():
+        for p1, p2 in _path_segments(path):
+            p1, p2 = p1 * rot, p2 * rot
+            segments.append((p1.x, p1.y, p2.x, p2.y))
+
+    segs = np.array(segments, dtype=np.float64).reshape(-1, 4)
+    dx = np.abs(segs[:, 2] - segs[:, 0])
+    dy = np.abs(segs[:, 3] - segs[:, 1])
+    vertical = (dx <= tol) & (dy > tol)
+    horizontal = (dy <= tol) & (dx > tol)
+
+    # Straighten: mean of the constant coordinate
+    v = segs[vertical].copy()
+    v[:, [0, 2]] = v[:, [0, 2]].mean(axis=1, keepdims=True)
+    h = segs[horizontal].copy()
+    h[:, [1, 3]] = h[:, [1, 3]].mean(axis=1, keepdims=True)
+
+    v_lines, h_lines, _ = merge_collinear_cuts(v, h, tol=tol)
+    v_lines = v_lines[v_lines[:, 3] - v_lines[:, 1] >= min_length]
+    h_lines = h_lines[h_lines[:, 2] - h_lines[:, 0] >= min_length]
+    return v_lines, h_lines, page.rect.width, page.rect.height
+
+
+class PdfJob:
+    """
+    One nesting PDF, opened once. The page text, the parsed plate
+    dimensions and parts table, renders (per DPI) and vector lines are
+    worked out on first use and kept, so asking for all of them reads the
+    file once.
+
+    Use as a context manager (or call close()) to release the document:
+        with PdfJob(path) as job:
+            w, l = job.dimensions()
+            parts = job.parts()
+    """
+
+    def __init__(self, pdf_path, page_no=0):
+        self.path = pdf_path
+        self.page_no = page_no
+        self.doc = fitz.open(pdf_path)
+        self.page = self.doc.load_page(page_no)
+        self._text = None
+        self._dimensions = None
+        self._parts = None
+        self._images = {}   # (dpi, gray, clip) -> image
+        self._vector = {}   # (min_length, tol) -> extract_vector_lines result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """
+        Closes the document and drops the cached renders. Results already
+        parsed stay available.
+        """
+        if self.doc is not None:
+            self.page = None
+            self.doc.close()
+            self.doc = None
+        self._images.clear()
+
+    def _page(self):
+        if self.page is None:
+            raise ValueError(f"PDF job for {self.path} is closed")
+        return self.page
+
+    @property
+    def page_count(self):
+        return self.doc.page_count if self.doc is not None else None
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = self._page().get_text("text")
+        return self._text
+
+    def dimensions(self):
+        """
+        (width, length) from the page header, None where not found.
+        """
+        if self._dimensions is None:
+            self._dimensions = _parse_dimensions(self.text)
+        return self._dimensions
+
+    def parts(self):
+        """
+        Parts table: [{'length': float, 'width': float, 'quantity': int}, ...]
+        """
+        if self._parts is None:
+            self._parts = _parse_table(self.text)
+        # Copies, callers may edit them
+        return [dict(p) for p in self._parts]
+
+    def image(self, dpi=300, gray=False, clip=None):
+        """
+        The page rendered at dpi as an OpenCV (BGR) image, or as a
+        zero-copy grayscale view with gray=True. clip: see _render.
+        """
+        key = (dpi, gray, tuple(clip) if clip is not None else None)
+        if key not in self._images:
+            self._images[key] = _render(self._page(), dpi, gray, clip)
+        return self._images[key]
+
+    def vector_lines(self, min_length=12.0, tol=0.5):
+        """
+        (v_lines, h_lines, page_width, page_height), see extract_vector_lines.
+        """
+        key = (min_length, tol)
+        if key not in self._vector:
+            self._vector[key] = _vector_lines(self._page(), min_length, tol)
+        return self._vector[key]
+
+    def plate_rect(self, min_length=12.0, tol=0.5):
+        """
+        (x0, y0, x1, y1) in points: the border of the vector drawing (the
+        bounding box of its cut lines), None without vector lines. Pass it as
+        clip to image() to render just the plate.
+        """
+        v, h, _, _ = self.vector_lines(min_length, tol)
+        if not len(v) + len(h):
+            return None
+        lines = np.concatenate([np.asarray(v, dtype=float).reshape(-1, 4),
+                                np.asarray(h, dtype=float).reshape(-1, 4)])
+        xs, ys = lines[:, 0::2], lines[:, 1::2]
+        return (float(xs.min()), float(ys.min()), float(xs.max()), float(ys.max()))
+
 
 def extract_dimensions(pdf_path):
     """
@@ -9,115 +291,180 @@ def extract_dimensions(pdf_path):
     Returns: (width, length) or (None, None)
     """
     try:
-        doc = fitz.open(pdf_path)
-        page = doc.load_page(0)
-        text = page.get_text()
-        doc.close()
-        
-        # Regex patterns to find "W : <number>" and "L : <number>"
-        # Pattern handles: W: 123.45, W : 123.45, W:123.45
-        w_pattern = r"W\s*[:]\s*([0-9.]+)"
-        l_pattern = r"L\s*[:]\s*([0-9.]+)"
-        
-        w_match = re.search(w_pattern, text, re.IGNORECASE)
-        l_match = re.search(l_pattern, text, re.IGNORECASE)
-        
-        w_val = float(w_match.group(1)) if w_match else None
-        l_val = float(l_match.group(1)) if l_match else None
-        
-        return w_val, l_val
-        
+        with PdfJob(pdf_path) as job:
+            return job.dimensions()
     except Exception as e:
         print(f"Error extracting dimensions: {e}")
         return None, None
 
+
 def extract_table_info(pdf_path):
     """
     Extracts Part info (Length, Width, Quantity) from the PDF table.
     Returns: List of dictionaries [{'length': float, 'width': float, 'quantity': int}, ...]
     """
     try:
-        doc = fitz.open(pdf_path)
-        page = doc.load_page(0)
-        text = page.get_text("text") 
-        doc.close()
-        
-        # Regex to match the table row structure shown in screenshot:
-        # 절단 ... W ... L
-        pattern = r"절단\s+\S+\s+\S+\s+(\d+(?:\.\d+)?)\s+(\d+(?:\.\d+)?)"
-        matches = re.findall(pattern, text)
-        
-        parts_map = {}
-        
-        if matches:
-            for m in matches:
-                try:
-                    val1 = float(m[0])
-                    val2 = float(m[1])
-                    
-                    # Map to L (Horizontal) and W (Vertical)
-                    # L is larger, W is smaller
-                    l = max(val1, val2)
-                    w = min(val1, val2)
-                    
-                    key = (l, w)
-                    if key in parts_map:
-                        parts_map[key] += 1
-                    else:
-                        parts_map[key] = 1
-                except:
-                    continue
-                    
-        # Convert map to list
-        parts_list = []
-        for (l, w), q in parts_map.items():
-            parts_list.append({'length': l, 'width': w, 'quantity': q})
-            
-        # Return list (empty if no matches)
-        return parts_list
-
+        with PdfJob(pdf_path) as job:
+            return job.parts()
     except Exception as e:
         print(f"Error extracting table info: {e}")
         return []
 
-    except Exception as e:
-        print(f"Error extracting table info: {e}")
-        return None, None, None
-
 
-def load_pdf_image(pdf_path, dpi=300):
+def load_pdf_image(pdf_path, dpi=300, gray=False, clip=None):
     """
     Loads the first page of a PDF and returns it as an OpenCV image (numpy array).
+    gray: single channel, straight from the renderer without copies (detect_lines takes it as is)
+    clip: render only this page region (points, see _render)
     """
     try:
-        doc = fitz.open(pdf_path)
-        page = doc.load_page(0)  # Load the first page
-        
-        # Increase resolution for better detection
-        zoom = dpi / 72  # 72 is the default PDF DPI
-        mat = fitz.Matrix(zoom, zoom)
-        
-        pix = page.get_pixmap(matrix=mat)
-        
-        # Convert to numpy array
-        # pix.samples is a bytes object, we need to convert it
-        img_array = np.frombuffer(pix.samples, dtype=np.uint8)
-        
-        if pix.n == 3:  # RGB
-            img = img_array.reshape((pix.h, pix.w, 3))
-            img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR) # Convert to BGR for OpenCV
-        elif pix.n == 4:  # RGBA
-            img = img_array.reshape((pix.h, pix.w, 4))
-            img = cv2.cvtColor(img, cv2.COLOR_RGBA2BGR)
-        elif pix.n == 1: # Gray
-            img = img_array.reshape((pix.h, pix.w))
-            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-        else:
-            raise ValueError(f"Unsupported number of channels: {pix.n}")
-            
-        doc.close()
-        return img
-        
+        with PdfJob(pdf_path) as job:
+            return job.image(dpi, gray, clip)
     except Exception as e:
         print(f"Error loading PDF: {e}")
         return None
+
+
+def extract_vector_lines(pdf_path, page_no=0, min_length=12.0, tol=0.5):
+    """
+    Reads the axis-aligned lines of a vector PDF page straight from its
+    drawing commands (page.get_drawings()), without rendering it.
+    Coordinates are points with the origin at the top-left of the page as
+    displayed (page rotation applied), i.e. the rendered image at 72 DPI.
+    Collinear touching / overlapping segments (shared rectangle edges) are
+    fused into one line.
+
+    Args:
+        min_length: Shorter lines are dropped (12 pt = the 50 px Hough
+                    minimum at 300 DPI)
+        tol: Segments within tol of vertical / horizontal count as such,
+             and collinear segments closer than tol are joined
+
+    Returns: (v_lines, h_lines, page_width, page_height) with (N, 4) arrays,
+             or (None, None, None, None). Scanned pages give empty arrays.
+    """
+    try:
+        with PdfJob(pdf_path, page_no) as job:
+            return job.vector_lines(min_length, tol)
+    except Exception as e:
+        print(f"Error reading PDF drawings: {e}")
+        return None, None, None, None
+
+
+# Fewer pages than this are read in-process, starting workers would take longer
+# (a spawned worker imports this module first, about 0.4 s)
+PARALLEL_MIN_PAGES = 64
+
+# What read_pdf_pages can return per page
+PAGE_FIELDS = ('text', 'dimensions', 'parts', 'vector', 'image')
+
+# Document handle of a read_pdf_pages worker process
+_worker_doc = None
+
+
+def _page_result(page, page_no, fields, dpi):
+    """
+    The requested fields of one page as a dict (plus 'page': page_no).
+    """
+    result = {'page': page_no}
+    text = page.get_text("text") if {'text', 'dimensions', 'parts'} & set(fields) else None
+    if 'text' in fields:
+        result['text'] = text
+    if 'dimensions' in fields:
+        result['dimensions'] = _parse_dimensions(text)
+    if 'parts' in fields:
+        result['parts'] = _parse_table(text)
+    if 'vector' in fields:
+        result['vector'] = _vector_lines(page, 12.0, 0.5)
+    if 'image' in fields:
+        result['image'] = _render(page, dpi)
+    return result
+
+
+def _open_worker_doc(pdf_path):
+    # Pool initializer: every worker process opens the document once
+    global _worker_doc
+    _worker_doc = fitz.open(pdf_path)
+
+
+def _read_worker_page(page_no, fields, dpi):
+    return _page_result(_worker_doc.load_page(page_no), page_no, fields, dpi)
+
+
+def read_pdf_pages(pdf_path, fields=('dimensions', 'parts'), dpi=300, pages=None, max_workers=None):
+    """
+    Reads every page of a (multi-page) PDF and yields one dict per page, in
+    page order, as soon as it and all pages before it are done. Pages are
+    parsed / rendered in a process pool; each worker opens the document
+    once and reads pages from its own handle.
+
+    Args:
+        fields: Any of PAGE_FIELDS: 'text', 'dimensions' ((width, length)),
+                'parts' (table rows of the page), 'vector' (see
+                extract_vector_lines), 'image' (render at dpi)
+        pages: Page numbers to read (default: all)
+        max_workers: Worker processes (default: all cores). With 1, or fewer
+                     than PARALLEL_MIN_PAGES pages, pages are read in this process
+
+    Yields:
+        dict: {'page': page number, <field>: value, ...}
+    """
+    unknown = set(fields) - set(PAGE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown page fields: {sorted(unknown)}")
+
+    with fitz.open(pdf_path) as doc:
+        if pages is None:
+            pages = range(doc.page_count)
+        pages = list(pages)
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        max_workers = min(max_workers, len(pages))
+        if max_workers <= 1 or len(pages) < PARALLEL_MIN_PAGES:
+            # Not worth starting processes
+            for page_no in pages:
+                yield _page_result(doc.load_page(page_no), page_no, fields, dpi)
+            return
+
+    # Renders are large: small batches keep the results streaming
+    chunksize = 1 if 'image' in fields else max(1, len(pages) // (4 * max_workers))
+    # Spawned, not forked: the caller may have threads (GUI, MuPDF) a fork would copy mid-lock
+    executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_open_worker_doc, initargs=(pdf_path,),
+                                   mp_context=multiprocessing.get_context("spawn"))
+    try:
+        yield from executor.map(_read_worker_page, pages, [fields] * len(pages), [dpi] * len(pages),
+                                chunksize=chunksize)
+    finally:
+        # The caller may stop early: drop the pages not started yet
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def merge_part_tables(tables):
+    """
+    Joins the parts tables of several pages: quantities of the same size
+    add up, sizes keep the order they first appear in.
+    """
+    parts_map = {}
+    for table in tables:
+        for p in table:
+            key = (p['length'], p['width'])
+            parts_map[key] = parts_map.get(key, 0) + p['quantity']
+    return [{'length': l, 'width': w, 'quantity': q} for (l, w), q in parts_map.items()]
+
+
+def read_pdf_report(pdf_path, max_workers=None):
+    """
+    Plate dimensions and the parts table of a whole multi-page nesting
+    report (a table may continue over several pages).
+    Returns: {'dimensions': (width, length) from the first page that has
+              them, or (None, None), 'parts': merged table, 'pages': page count}
+    """
+    dimensions = (None, None)
+    tables = []
+    count = 0
+    for page in read_pdf_pages(pdf_path, ('dimensions', 'parts'), max_workers=max_workers):
+        count += 1
+        if dimensions == (None, None) and None not in page['dimensions']:
+            dimensions = page['dimensions']
+        tables.append(page['parts'])
+    return {'dimensions': dimensions, 'parts': merge_part_tables(tables), 'pages': count}
@@ -0,0 +1,430 @@
+import math
+import time
+
+import numpy as np
+
+
+def _as_rows(lines):
+    if lines is None:
+        return np.empty((0, 4), dtype=np.float64)
+    return np.asarray(lines, dtype=np.float64).reshape(-1, 4)
+
+
+def _merge_axis(lines, axis, tol):
+    """
+    Fuses collinear segments of one orientation.
+    axis 0: vertical cuts (x constant, run along y)
+    axis 1: horizontal cuts (y constant, run along x)
+    Returns (merged (M, 4) array, overlap length that was cut twice).
+    """
+    lines = _as_rows(lines)
+    if not len(lines):
+        return lines.copy(), 0.0
+
+    if axis == 0:
+        coord = lines[:, 0]
+        start = np.minimum(lines[:, 1], lines[:, 3])
+        end = np.maximum(lines[:, 1], lines[:, 3])
+    else:
+        coord = lines[:, 1]
+        start = np.minimum(lines[:, 0], lines[:, 2])
+        end = np.maximum(lines[:, 0], lines[:, 2])
+
+    # Hashed index: cuts on the same line share a rounded coordinate key
+    key = np.round(coord / tol).astype(np.int64)
+    order = np.lexsort((start, key))
+    key, coord, start, end = key[order], coord[order], start[order], end[order]
+
+    # Furthest end so far on the same line, before each segment. Ends are
+    # ranked and every line is offset above the previous ones, so one running
+    # maximum over all lines stays exact and restarts at each line.
+    group = np.cumsum(np.diff(key, prepend=key[0] - 1) != 0)
+    ends = np.unique(end)
+    span = len(ends) + 1
+    reach = np.maximum.accumulate(np.searchsorted(ends, end) + group * span) - group * span
+    prev_end = np.empty(len(end))
+    prev_end[1:] = ends[reach[:-1]]
+
+    # A segment starts a new stroke on a new line or past the stroke so far (+ tol)
+    new = np.ones(len(key), dtype=bool)
+    new[1:] = (group[1:] != group[:-1]) | (start[1:] > prev_end[1:] + tol)
+    # Contiguous or overlapping: extends the current stroke, overlaps were cut twice
+    joined = ~new
+    overlap = float(np.maximum(0.0, np.minimum(end[joined], prev_end[joined]) - start[joined]).sum())
+
+    first = np.flatnonzero(new)
+    m = np.column_stack((coord[first], start[first], np.maximum.reduceat(end, first)))
+    out = np.empty((len(m), 4))
+    if axis == 0:
+        out[:, 0] = m[:, 0]
+        out[:, 1] = m[:, 1]
+        out[:, 2] = m[:, 0]
+        out[:, 3] = m[:, 2]
+    else:
+        out[:, 0] = m[:, 1]
+        out[:, 1] = m[:, 0]
+        out[:, 2] = m[:, 2]
+        out[:, 3] = m[:, 0]
+    return out, overlap
+
+
+def merge_collinear_cuts(v_lines, h_lines, tol=1e-3, feed_rate=1000, toggle_time=1.0, rapid_rate=15000):
+    """
+    Cut-graph post-pass: groups cuts by their constant coordinate, fuses
+    contiguous / overlapping collinear segments into one stroke and drops
+    duplicates. Neighbouring columns that end parts at the same y then become
+    one long horizontal stroke instead of one stroke per column.
+
+    The merged strokes are sorted by coordinate, not in cutting order, so
+    they should go through order_toolpath (write_gcode optimize_order=True)
+    before they are cut.
+
+    Args:
+        v_lines, h_lines: [x1, y1, x2, y2] lists or (N, 4) arrays
+        tol (float): Coordinates closer than this are the same line / touching
+        feed_rate (float): Cutting feed (units/min) for the time estimate
+        toggle_time (float): Seconds per stroke for the M3/M5 pair
+        rapid_rate (float): G0 speed (units/min) for the time estimate
+
+    Returns:
+        merged_v, merged_h ((N, 4) arrays, lines run low -> high), stats dict:
+        {'strokes_before', 'strokes_after', 'strokes_removed',
+         'overlap_length', 'time_saved' (seconds, estimate for cutting both
+         in the given order, negative when the extra rapids cost more)}
+    """
+    v_in = _as_rows(v_lines)
+    h_in = _as_rows(h_lines)
+    merged_v, overlap_v = _merge_axis(v_in, 0, tol)
+    merged_h, overlap_h = _merge_axis(h_in, 1, tol)
+
+    before = len(v_in) + len(h_in)
+    after = len(merged_v) + len(merged_h)
+    overlap = overlap_v + overlap_h
+    removed = before - after
+
+    # Each removed stroke saves its spindle toggle, overlaps were cut twice,
+    # and the rapids between strokes change with the new stroke order
+    rapid_before = _pass_rapids(v_in, h_in)
+    rapid_after = _pass_rapids(merged_v, merged_h)
+    saved = removed * toggle_time
+    if feed_rate > 0:
+        saved += overlap / feed_rate * 60.0
+    if rapid_rate > 0:
+        saved += (rapid_before - rapid_after) / rapid_rate * 60.0
+
+    stats = {
+        'strokes_before': before,
+        'strokes_after': after,
+        'strokes_removed': removed,
+        'overlap_length': overlap,
+        'time_saved': saved,
+    }
+    return merged_v, merged_h, stats
+
+
+def rapid_distance(lines, start=(0.0, 0.0)):
+    """
+    Total G0 travel to cut lines in the given order and direction
+    (each stroke from (x1, y1) to (x2, y2)), starting at start.
+    Returns (distance, end position).
+    """
+    lines = _as_rows(lines)
+    if not len(lines):
+        return 0.0, tuple(start)
+    prev = np.vstack(([start], lines[:-1, 2:4]))
+    d = np.hypot(lines[:, 0] - prev[:, 0], lines[:, 1] - prev[:, 1])
+    return float(d.sum()), (float(lines[-1, 2]), float(lines[-1, 3]))
+
+
+def _pass_rapids(v_lines, h_lines):
+    """
+    G0 travel of the vertical pass then the horizontal pass, from the origin.
+    """
+    d_v, pos = rapid_distance(v_lines)
+    d_h, _ = rapid_distance(h_lines, pos)
+    return d_v + d_h
+
+
+class _EndpointGrid:
+    """
+    Uniform grid over stroke endpoints for nearest-neighbour lookups.
+    Used strokes are removed from their cells, so lookups only see what is left.
+    """
+
+    def __init__(self, lines):
+        pts = np.vstack((lines[:, 0:2], lines[:, 2:4]))
+        self.x0 = float(pts[:, 0].min())
+        self.y0 = float(pts[:, 1].min())
+        w = float(pts[:, 0].max()) - self.x0
+        h = float(pts[:, 1].max()) - self.y0
+        # About two endpoints per cell, also for long narrow plates
+        self.cell = max(math.sqrt(w * h / len(lines)), max(w, h) / len(lines), 1e-9)
+        self.n = len(lines)
+        self.cells = {}
+        self.keys = [None] * (2 * self.n)
+        for idx, (x, y) in enumerate(pts.tolist()):
+            # idx < n: stroke idx entered at (x1, y1); idx >= n: entered at (x2, y2)
+            key = self._key(x, y)
+            self.keys[idx] = key
+            self.cells.setdefault(key, []).append((idx, x, y))
+        self.gx_max, self.gy_max = self._key(float(pts[:, 0].max()), float(pts[:, 1].max()))
+
+    def _key(self, x, y):
+        return (int((x - self.x0) // self.cell), int((y - self.y0) // self.cell))
+
+    def remove(self, stroke):
+        """
+        Drops both endpoints of a stroke.
+        """
+        for idx in (stroke, stroke + self.n):
+            key = self.keys[idx]
+            cell = [p for p in self.cells[key] if p[0] != idx]
+            if cell:
+                self.cells[key] = cell
+            else:
+                del self.cells[key]
+
+    def nearest(self, x, y):
+        """
+        Closest endpoint to (x, y) as (stroke index, reversed), None once all are removed.
+        """
+        if not self.cells:
+            return None
+        cx, cy = self._key(x, y)
+        # Rings needed to cover the whole grid from here (the query may lie outside it)
+        max_ring = max(abs(cx), abs(cx - self.gx_max), abs(cy), abs(cy - self.gy_max)) + 1
+        best = None
+        best_d = float('inf')
+        for ring in range(max_ring + 1):
+            # Anything in this ring is at least (ring - 1) cells away
+            if best is not None and (ring - 1) * self.cell > best_d:
+                break
+            for gx, gy in self._ring(cx, cy, ring):
+                for idx, px, py in self.cells.get((gx, gy), ()):
+                    d = (px - x) ** 2 + (py - y) ** 2
+                    if d < best_d * best_d or best is None:
+                        best_d = d ** 0.5
+                        best = (idx % self.n, idx >= self.n)
+        return best
+
+    def _ring(self, cx, cy, ring):
+        """
+        Cells of the square ring around (cx, cy), clipped to the grid, so
+        long narrow grids don't walk the empty cells above and below.
+        """
+        if ring == 0:
+            yield cx, cy
+            return
+        y_lo, y_hi = max(cy - ring, 0), min(cy + ring, self.gy_max)
+        for gx in (cx - ring, cx + ring):
+            if 0 <= gx <= self.gx_max:
+                for gy in range(y_lo, y_hi + 1):
+                    yield gx, gy
+        x_lo, x_hi = max(cx - ring + 1, 0), min(cx + ring - 1, self.gx_max)
+        for gy in (cy - ring, cy + ring):
+            if 0 <= gy <= self.gy_max:
+                for gx in range(x_lo, x_hi + 1):
+                    yield gx, gy
+
+
+# Seconds of 2-opt refinement for a whole program / job (see TimeBudget)
+ORDER_TIME_LIMIT = 2.0
+
+
+class TimeBudget:
+    """
+    Seconds of optimization shared by several calls, e.g. both passes of a
+    program or every plate of a multi-plate job.
+    """
+
+    def __init__(self, seconds=ORDER_TIME_LIMIT):
+        self.left = seconds
+
+    def deadline(self):
+        return time.time() + max(0.0, self.left)
+
+    def spend(self, seconds):
+        self.left -= seconds
+
+
+def _two_opt(sx, sy, ex, ey, start, window, deadline):
+    """
+    Windowed 2-opt on an open path of strokes. Reversing strokes i..j also
+    flips each of them, so only the two boundary rapids change.
+    """
+    n = len(sx)
+    hyp = math.hypot
+    improved = True
+    while improved and time.time() < deadline:
+        improved = False
+        for i in range(n):
+            px, py = (ex[i - 1], ey[i - 1]) if i > 0 else start
+            for j in range(i, min(n, i + window)):
+                old = hyp(sx[i] - px, sy[i] - py)
+                new = hyp(ex[j] - px, ey[j] - py)
+                if j + 1 < n:
+                    old += hyp(sx[j + 1] - ex[j], sy[j + 1] - ey[j])
+                    new += hyp(sx[j + 1] - sx[i], sy[j + 1] - sy[i])
+                if new < old - 1e-9:
+                    # Reverse i..j: order flips and start/end swap
+                    sx[i:j + 1], ex[i:j + 1] = ex[i:j + 1][::-1], sx[i:j + 1][::-1]
+                    sy[i:j + 1], ey[i:j + 1] = ey[i:j + 1][::-1], sy[i:j + 1][::-1]
+                    improved = True
+            if time.time() >= deadline:
+                break
+
+
+def order_cuts(lines, start=(0.0, 0.0), window=32, budget=None):
+    """
+    Orders one pass of cuts to minimize rapid travel. Nearest-neighbour over
+    a grid index of stroke endpoints, then windowed 2-opt. Every stroke may be
+    cut in either direction (serpentine).
+
+    Args:
+        lines: [x1, y1, x2, y2] list or (N, 4) array
+        start: Tool position before the pass
+        window: 2-opt neighbourhood size (strokes)
+        budget: TimeBudget for the 2-opt refinement, the time used is taken
+                off it (default: a new ORDER_TIME_LIMIT budget)
+
+    Returns:
+        ordered (N, 4) array (strokes run from (x1, y1) to (x2, y2)),
+        end position after the last stroke
+    """
+    lines = _as_rows(lines)
+    n = len(lines)
+    if n == 0:
+        return lines.copy(), tuple(start)
+
+    grid = _EndpointGrid(lines)
+    rows = lines.tolist()
+    sx, sy, ex, ey = [], [], [], []
+    x, y = start
+    for _ in range(n):
+        stroke, rev = grid.nearest(x, y)
+        grid.remove(stroke)
+        x1, y1, x2, y2 = rows[stroke]
+        if rev:
+            x1, y1, x2, y2 = x2, y2, x1, y1
+        sx.append(x1)
+        sy.append(y1)
+        ex.append(x2)
+        ey.append(y2)
+        x, y = x2, y2
+
+    if budget is None:
+        budget = TimeBudget()
+    t0 = time.time()
+    _two_opt(sx, sy, ex, ey, tuple(start), window, budget.deadline())
+    budget.spend(time.time() - t0)
+
+    ordered = np.column_stack((sx, sy, ex, ey))
+    return ordered, (ex[-1], ey[-1])
+
+
+def order_toolpath(v_lines, h_lines, start=(0.0, 0.0), budget=None, **kwargs):
+    """
+    Orders the vertical pass, then the horizontal pass (starting where the
+    vertical pass ended) to minimize rapid travel. Both passes share one
+    2-opt TimeBudget (pass the job's budget to share it across plates).
+
+    Returns:
+        ordered_v, ordered_h ((N, 4) arrays), stats dict:
+        {'rapid_before', 'rapid_after'} (units of the cut coordinates)
+    """
+    before_v, pos = rapid_distance(v_lines, start)
+    before_h, _ = rapid_distance(h_lines, pos)
+
+    if budget is None:
+        budget = TimeBudget()
+    ordered_v, pos = order_cuts(v_lines, start, budget=budget, **kwargs)
+    ordered_h, _ = order_cuts(h_lines, pos, budget=budget, **kwargs)
+
+    after_v, pos = rapid_distance(ordered_v, start)
+    after_h, _ = rapid_distance(ordered_h, pos)
+
+    stats = {
+        'rapid_before': before_v + before_h,
+        'rapid_after': after_v + after_h,
+    }
+    return ordered_v, ordered_h, stats
+
+
+def find_repeated_patterns(lines, axis=1, tol=1e-3, min_repeats=2, min_cuts=2):
+    """
+    Finds groups of cuts that repeat at different offsets, e.g. identical
+    columns of a batch job. Cuts are grouped by their span (all horizontal
+    cuts of one column share x1..x2); a group's canonical key is its span
+    length and the cut offsets relative to the group origin, so equal keys
+    are the same pattern.
+
+    Args:
+        lines: [x1, y1, x2, y2] list or (N, 4) array of one pass
+        axis: 1 for horizontal cuts (grouped by x span), 0 for vertical cuts
+        tol: Coordinates closer than this are equal
+        min_repeats: Patterns used fewer times are left inline
+        min_cuts: Groups with fewer cuts are left inline
+
+    Returns:
+        patterns: list of (K, 4) arrays relative to the pattern origin,
+                  cuts in serpentine order
+        calls: list of (pattern index, origin x, origin y) in order of appearance
+        rest: (M, 4) array of the cuts that are not part of a pattern, in input order
+    """
+    lines = _as_rows(lines)
+    if not len(lines):
+        return [], [], lines.copy()
+
+    if axis == 1:
+        lo = np.minimum(lines[:, 0], lines[:, 2])
+        hi = np.maximum(lines[:, 0], lines[:, 2])
+        off = lines[:, 1]
+    else:
+        lo = np.minimum(lines[:, 1], lines[:, 3])
+        hi = np.maximum(lines[:, 1], lines[:, 3])
+        off = lines[:, 0]
+
+    span_keys = np.round(np.column_stack((lo, hi)) / tol).astype(np.int64)
+    groups = {}
+    for idx, key in enumerate(map(tuple, span_keys.tolist())):
+        groups.setdefault(key, []).append(idx)
+
+    # Canonical hash: span length and sorted cut offsets from the group origin
+    by_pattern = {}
+    for key, idxs in groups.items():
+        if len(idxs) < min_cuts:
+            continue
+        offs = np.unique(np.round(off[idxs] / tol).astype(np.int64))
+        canon = (key[1] - key[0], tuple((offs - offs[0]).tolist()))
+        by_pattern.setdefault(canon, []).append(idxs)
+
+    patterns = []
+    calls = []
+    grouped = np.zeros(len(lines), dtype=bool)
+    for canon, instances in by_pattern.items():
+        if len(instances) < min_repeats:
+            continue
+        first = instances[0]
+        length = float(hi[first[0]] - lo[first[0]])
+        base = float(off[first].min())
+        rel = np.unique(np.round(off[first] - base, 9))
+        body = np.zeros((len(rel), 4))
+        # Serpentine: every other cut runs back
+        fwd = np.arange(len(rel)) % 2 == 0
+        body[:, 0] = np.where(fwd, 0.0, length)
+        body[:, 2] = np.where(fwd, length, 0.0)
+        body[:, 1] = body[:, 3] = rel
+        if axis == 0:
+            body = body[:, [1, 0, 3, 2]]
+        pattern_id = len(patterns)
+        patterns.append(body)
+        for idxs in instances:
+            grouped[idxs] = True
+            origin = (float(lo[idxs[0]]), float(off[idxs].min()))
+            if axis == 0:
+                origin = origin[::-1]
+            calls.append((min(idxs), pattern_id) + origin)
+
+    # Calls in the order their first cut appears in the pass
+    calls = [c[1:] for c in sorted(calls)]
+    return patterns, calls, lines[~grouped]